@@ -0,0 +1,352 @@
+"""
+Command-Line Interface
+======================
+One entry point for the pipeline, driven by config.yaml:
+
+    python -m src load        # parse the CSV export into the bar cache
+    python -m src features    # model features + labels -> feature cache
+    python -m src train       # fit, evaluate, save .joblib + compiled .npz
+    python -m src score       # regime probabilities for cached features
+    python -m src export      # ONNX graph, regime_config.json, .mqh includes
+    python -m src bench       # stage benchmark vs stored baseline
+
+Paths in config.yaml are relative to its directory. Only the standard
+library is imported up front; each subcommand imports what it needs, so
+`score` (numpy + the compiled .npz model, no pandas or sklearn) starts in
+a fraction of a second.
+
+The feature cache (cache/matrices/<csv stem>/) holds the model matrix
+X.npy, labels y.npy, bar times dates.npy and a meta.json with the feature
+columns and the CSV's size/mtime, which `score` and `train` check. It is
+kept outside the FeatureStore root (cache/features), whose clear() and
+eviction own everything below it. `features` computes its columns through
+that store, so rebuilding the matrix for new labeling, dtype or timeframe
+settings reuses the stored feature columns.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict
+
+
+FEATURE_CACHE_DIR = Path('cache') / 'matrices'
+FEATURE_STORE_DIR = Path('cache') / 'features'
+
+
+def _load_config(path: str) -> Dict:
+    import yaml
+    with open(path, 'r') as f:
+        config = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    config['_path'] = Path(path).resolve()
+    config['_root'] = config['_path'].parent
+    return config
+
+
+def _path(config: Dict, value: str) -> Path:
+    path = Path(value)
+    return path if path.is_absolute() else config['_root'] / path
+
+
+def _csv_path(config: Dict, args) -> Path:
+    return _path(config, args.csv or config['data']['csv_file'])
+
+
+def _output_path(config: Dict, key: str) -> Path:
+    output = config.get('output', {})
+    return _path(config, output.get('models_dir', 'models')) / output[key]
+
+
+def _compiled_path(model_path: Path) -> Path:
+    return model_path.with_suffix('.compiled.npz')
+
+
+def _feature_cache(config: Dict, csv_path: Path) -> Path:
+    return config['_root'] / FEATURE_CACHE_DIR / csv_path.stem
+
+
+def _read_feature_cache(cache: Path, csv_path: Path, mmap: bool = True):
+    """(meta, X, y, dates) or None when missing or older than the CSV"""
+    import numpy as np
+
+    meta_path = cache / 'meta.json'
+    if not meta_path.exists():
+        return None
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    if csv_path.exists():
+        stat = os.stat(csv_path)
+        if (meta['source']['size'], meta['source']['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            print(f"Feature cache is stale for {csv_path.name}; run `python -m src features`")
+            return None
+    mode = 'r' if mmap else None
+    y = np.load(cache / 'y.npy', mmap_mode=mode) if (cache / 'y.npy').exists() else None
+    return (meta, np.load(cache / 'X.npy', mmap_mode=mode), y,
+            np.load(cache / 'dates.npy', mmap_mode=mode))
+
+
+def _higher_timeframes(config: Dict) -> list:
+    return list(config['data'].get('higher_timeframes') or [])
+
+
+def _dtype_policy(config: Dict):
+    return config['data'].get('dtype_policy', 'default')
+
+
+def _regime_params(config: Dict) -> Dict:
+    regime = config.get('regime', {})
+    return {
+        'lookforward': regime.get('lookforward_bars', 10),
+        'trend_threshold': regime.get('trend_threshold', 0.005),
+        'vol_threshold': regime.get('volatility_threshold', 1.5)
+    }
+
+
+# ----------------------------------------------------------------------
+# Subcommands
+# ----------------------------------------------------------------------
+
+def cmd_load(config: Dict, args) -> int:
+    from src.data_pipeline import load_mt5_csv
+
+    csv_path = _csv_path(config, args)
+    start = time.perf_counter()
+    df = load_mt5_csv(str(csv_path), use_cache=True)
+    print(f"Loaded {len(df):,} bars ({df['Date'].iloc[0]} to {df['Date'].iloc[-1]}) "
+          f"in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def cmd_features(config: Dict, args) -> int:
+    import numpy as np
+    from src.data_pipeline import (
+        load_mt5_csv, clean_data, create_time_features, get_dtype_policy, _file_signature
+    )
+    from src.feature_store import FeatureStore
+    from src.features import get_feature_columns
+    from src.multi_timeframe import add_higher_timeframe_features, get_mtf_feature_columns
+
+    csv_path = _csv_path(config, args)
+    policy = get_dtype_policy(_dtype_policy(config))
+    params = _regime_params(config)
+    timeframes = _higher_timeframes(config)
+    start = time.perf_counter()
+
+    df = create_time_features(clean_data(load_mt5_csv(str(csv_path), use_cache=True)), policy)
+    feature_columns = get_feature_columns()
+    store = FeatureStore(str(config['_root'] / FEATURE_STORE_DIR))
+    arrays = store.get_arrays(df, feature_columns, add_labels=True, **params)
+    valid = arrays.pop('_valid')
+    if timeframes:
+        # Joined columns are NaN until each higher timeframe has warmed up
+        mtf_columns = get_mtf_feature_columns(timeframes)
+        joined = add_higher_timeframe_features(df, timeframes)
+        for col in mtf_columns:
+            arrays[col] = joined[col].to_numpy()
+            valid &= ~np.isnan(arrays[col])
+        del joined
+        feature_columns = feature_columns + mtf_columns
+
+    X = np.empty((int(valid.sum()), len(feature_columns)), dtype=policy['feature'] or np.float64)
+    for j, col in enumerate(feature_columns):
+        X[:, j] = arrays[col][valid]
+    y = arrays['Regime'][valid].astype(policy['label'] or np.int64)
+    dates = df['Date'].values[valid].astype('datetime64[ns]').view(np.int64)
+
+    cache = _feature_cache(config, csv_path)
+    cache.mkdir(parents=True, exist_ok=True)
+    np.save(cache / 'X.npy', X)
+    np.save(cache / 'y.npy', y)
+    np.save(cache / 'dates.npy', dates)
+    with open(cache / 'meta.json', 'w') as f:
+        json.dump({'source': _file_signature(str(csv_path)), 'csv': str(csv_path),
+                   'feature_columns': feature_columns, 'rows': len(X),
+                   'dtype': str(X.dtype), 'dtype_policy': _dtype_policy(config),
+                   'regime_params': params,
+                   'higher_timeframes': timeframes}, f, indent=2)
+    print(f"Features: {len(X):,} rows x {len(feature_columns)} columns ({X.dtype}) "
+          f"-> {cache} in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def cmd_train(config: Dict, args) -> int:
+    from src.regime_detector import RegimeDetector
+    from src.tree_inference import CompiledEnsemble
+
+    csv_path = _csv_path(config, args)
+    cached = _read_feature_cache(_feature_cache(config, csv_path), csv_path, mmap=False)
+    if cached is None or cached[2] is None:
+        cmd_features(config, args)
+        cached = _read_feature_cache(_feature_cache(config, csv_path), csv_path, mmap=False)
+    meta, X, y, _ = cached
+    if (meta['regime_params'] != _regime_params(config)
+            or meta.get('higher_timeframes', []) != _higher_timeframes(config)
+            or meta.get('dtype_policy', 'default') != _dtype_policy(config)):
+        print("Features were built with other regime, timeframe or dtype settings; rebuilding")
+        cmd_features(config, args)
+        meta, X, y, _ = _read_feature_cache(_feature_cache(config, csv_path), csv_path, mmap=False)
+
+    # Chronological split, as split_data()
+    split = config.get('split', {})
+    train_end = int(len(X) * split.get('train_ratio', 0.7))
+    val_end = int(len(X) * (split.get('train_ratio', 0.7) + split.get('val_ratio', 0.15)))
+    print(f"Data split: train {train_end:,}, val {val_end - train_end:,}, test {len(X) - val_end:,}")
+
+    detector = RegimeDetector(meta['feature_columns'],
+                              backend=args.backend or config['model'].get('boosting_backend', 'exact'))
+    detector.fit(X[:train_end], y[:train_end], X[train_end:val_end], y[train_end:val_end])
+    results = detector.evaluate(X[val_end:], y[val_end:])
+
+    model_path = _output_path(config, 'model_file')
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    detector.save(str(model_path))
+    CompiledEnsemble.from_detector(detector).save(str(_compiled_path(model_path)))
+    print(f"\nFinal Test Accuracy: {results['accuracy']:.2%}")
+    return 0
+
+
+def cmd_score(config: Dict, args) -> int:
+    import numpy as np
+
+    start = time.perf_counter()
+    csv_path = _csv_path(config, args)
+    cached = _read_feature_cache(_feature_cache(config, csv_path), csv_path)
+    if cached is None:
+        print("No feature cache; run `python -m src features` first")
+        return 1
+    meta, X, _, dates = cached
+    if args.last:
+        X, dates = X[-args.last:], dates[-args.last:]
+
+    model_path = Path(args.model) if args.model else _output_path(config, 'model_file')
+    compiled_path = model_path if model_path.suffix == '.npz' else _compiled_path(model_path)
+    if compiled_path.exists():
+        from src.tree_inference import CompiledEnsemble
+        model = CompiledEnsemble.load(str(compiled_path))
+        columns = model.feature_columns
+    else:
+        from src.regime_detector import RegimeDetector
+        model = RegimeDetector.load(str(model_path))
+        columns = model.feature_columns
+    if columns and columns != meta['feature_columns']:
+        print("Model and feature cache use different feature columns")
+        return 1
+
+    proba = model.predict_proba(X)
+    regimes = proba.argmax(axis=1)
+
+    names = ['RANGING', 'TRENDING', 'VOLATILE']
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        if output.suffix == '.csv':
+            stamps = np.asarray(dates).astype('datetime64[ns]').astype('datetime64[s]').astype(str)
+            with open(output, 'w') as f:
+                f.write('Date,Regime,' + ','.join(f'P_{n}' for n in names) + '\n')
+                for stamp, regime, p in zip(stamps, regimes, proba):
+                    f.write(f"{stamp.replace('T', ' ')},{names[regime]},"
+                            f"{p[0]:.4f},{p[1]:.4f},{p[2]:.4f}\n")
+        else:
+            np.save(output, proba.astype(np.float32))
+        print(f"Scores saved: {output}")
+
+    share = np.bincount(regimes, minlength=3) / max(len(regimes), 1)
+    last = str(np.asarray(dates[-1:]).astype('datetime64[ns]').astype('datetime64[s]')[0])
+    print(f"Scored {len(X):,} bars in {time.perf_counter() - start:.3f}s: "
+          + ', '.join(f'{n} {s:.1%}' for n, s in zip(names, share)))
+    print(f"Last bar {last.replace('T', ' ')}: {names[regimes[-1]]} "
+          f"({proba[-1, regimes[-1]]:.1%})")
+    return 0
+
+
+def cmd_export(config: Dict, args) -> int:
+    from src.backtest import load_regime_settings
+    from src.export_onnx import export_to_onnx, create_mt5_include
+    from src.mql5_trees import create_mt5_trees_include
+
+    model_path = _output_path(config, 'model_file')
+    if not model_path.exists():
+        print(f"Model not found: {model_path}; run `python -m src train` first")
+        return 1
+    csv_path = _csv_path(config, args)
+    cached = _read_feature_cache(_feature_cache(config, csv_path), csv_path, mmap=False)
+    X_check = cached[1][-args.check_rows:] if cached is not None and args.check_rows else None
+
+    config_path = _output_path(config, 'config_file')
+    ok = export_to_onnx(str(model_path), str(_output_path(config, 'onnx_file')),
+                        str(config_path), X_check,
+                        load_regime_settings(str(config['_path'])))
+    # regime_config.json is written even when no graph could be
+    create_mt5_include(str(config_path), str(_output_path(config, 'mql_include')))
+    create_mt5_trees_include(str(model_path), str(model_path.parent / 'RegimeTrees.mqh'), X_check)
+    return 0 if ok else 1
+
+
+def cmd_bench(config: Dict, args) -> int:
+    from src.benchmark import run_and_compare
+
+    regressions = run_and_compare(args.sizes, str(config['_root'] / 'benchmarks'),
+                                  save_baseline=args.save_baseline,
+                                  threshold=args.threshold,
+                                  max_model_rows=args.max_model_rows,
+                                  backend=config['model'].get('boosting_backend', 'exact'))
+    return 1 if regressions else 0
+
+
+COMMANDS = {
+    'load': cmd_load,
+    'features': cmd_features,
+    'train': cmd_train,
+    'score': cmd_score,
+    'export': cmd_export,
+    'bench': cmd_bench
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m src',
+                                     description="Regime detection pipeline driven by config.yaml")
+    parser.add_argument('--config', default=str(Path(__file__).parent.parent / 'config.yaml'))
+    parser.add_argument('--csv', help="MT5 export (default: data.csv_file)")
+    parser.add_argument('--trace', metavar='PATH',
+                        help="Write a stage trace (.json Chrome trace, .jsonl records)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('load', help="Parse the CSV export into the columnar bar cache")
+    sub.add_parser('features', help="Compute features and labels into the feature cache")
+    train = sub.add_parser('train', help="Train, evaluate and save the regime detector")
+    train.add_argument('--backend', choices=['exact', 'hist'],
+                       help="Boosting backend (default: model.boosting_backend)")
+    score = sub.add_parser('score', help="Regime probabilities for the cached features")
+    score.add_argument('--model', help="Compiled .npz or .joblib (default: output paths)")
+    score.add_argument('--last', type=int, default=0, help="Only the last N bars")
+    score.add_argument('--output', help="Write probabilities (.npy) or a .csv table")
+    export = sub.add_parser('export', help="ONNX graph, MT5 config and tree includes")
+    export.add_argument('--check-rows', type=int, default=500,
+                        help="Latest cached rows used for parity checks (0 = none)")
+    bench = sub.add_parser('bench', help="Stage benchmark vs benchmarks/baseline.json")
+    bench.add_argument('sizes', nargs='*', default=['10k', '1M'], help="10k, 1M and/or 10M")
+    bench.add_argument('--save-baseline', action='store_true')
+    bench.add_argument('--threshold', type=float, default=0.20)
+    bench.add_argument('--max-model-rows', type=int, default=10_000)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    config = _load_config(args.config)
+    if args.trace:
+        from src import tracing
+        tracing.enable(args.trace)
+    try:
+        return COMMANDS[args.command](config, args)
+    finally:
+        if args.trace:
+            tracing.disable()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,403 @@
+"""
+Vectorized Bar-Level Backtester
+===============================
+Python replay of GoldScalpingEA_ML's entry and exit rules on H1 bars,
+driven by RegimeDetector predictions.
+
+Entries follow the EA's trend signal (EMA 9/21/50 alignment, ADX and
+MACD votes) with its momentum, session and spread filters; the predicted
+regime of the signal bar selects atr_sl_mult / atr_tp_mult /
+trailing_start / min_confidence from config.yaml's `trading:` section.
+
+Exits are evaluated for all candidate entries at once on (entries x bars
+held) windows:
+- initial ATR stop loss and take profit
+- breakeven once the best excursion reaches breakeven_pips
+- partial close at partial_close_pips
+- ATR trailing stop once the best excursion reaches trailing_start
+- early exit on an opposite signal while below cut_loss_pips
+- timeout after max_hold_bars
+
+Stop adjustments use information up to the previous bar close and take
+effect on the next bar; a bar touching both stop and target counts as a
+stop. Trades are evaluated on a short window first and only unresolved
+ones are re-run on a longer window. The only Python loop runs over taken
+trades, to enforce one position at a time (MaxPositions = 1).
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+if __name__ == "__main__":
+    # Run as a script (python src/backtest.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.fast_features import _shift, _rolling_mean, _ewm
+
+
+REGIME_NAMES = ['RANGING', 'TRENDING', 'VOLATILE']
+
+# Same values as config.yaml `trading:`
+DEFAULT_REGIME_SETTINGS = {
+    'RANGING': {'atr_sl_mult': 1.0, 'atr_tp_mult': 1.5, 'trailing_start': 8, 'min_confidence': 60},
+    'TRENDING': {'atr_sl_mult': 1.5, 'atr_tp_mult': 2.5, 'trailing_start': 15, 'min_confidence': 55},
+    'VOLATILE': {'atr_sl_mult': 2.0, 'atr_tp_mult': 2.0, 'trailing_start': 20, 'min_confidence': 70}
+}
+
+# EA inputs that are not regime specific (GoldScalpingEA_ML.mq5 defaults)
+DEFAULT_RULES = {
+    'pip_size': 0.1,             # PipValue() for 2-digit gold
+    'point': 0.01,               # Spread column is in points
+    'max_spread_pips': 25,
+    'breakeven_pips': 12,
+    'breakeven_offset_pips': 1,
+    'partial_close_pips': 25,
+    'partial_close_fraction': 0.5,
+    'trail_atr_mult': 0.8,
+    'cut_loss_pips': -18,
+    'reversal_confidence': 60,
+    'start_hour': 8,
+    'end_hour': 20,
+    'friday_close_hour': 17,
+    'atr_period': 14,
+    'max_hold_bars': 240
+}
+
+EXIT_REASONS = ['stop', 'target', 'reversal', 'timeout']
+
+# Holding windows tried in turn; unresolved trades move to the next
+_WINDOWS = (24, 96, 384)
+
+
+def load_regime_settings(config_path: str) -> Dict[str, Dict]:
+    """Read the `trading:` regime settings from config.yaml"""
+    import yaml
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f)
+    return {name.upper(): settings for name, settings in config['trading'].items()}
+
+
+def ea_signals(df: pd.DataFrame, rules: Optional[Dict] = None) -> Dict[str, np.ndarray]:
+    """
+    Per-bar EA trend signal and entry filters, as of each bar's close.
+
+    Returns direction (+1 buy, -1 sell, 0 hold), confidence (%),
+    tradeable (momentum, session and spread filters) and atr.
+    """
+    rules = {**DEFAULT_RULES, **(rules or {})}
+    close = df['Close'].to_numpy(dtype=np.float64)
+    high = df['High'].to_numpy(dtype=np.float64)
+    low = df['Low'].to_numpy(dtype=np.float64)
+
+    ema_f, ema_m, ema_s = _ewm(close, 9), _ewm(close, 21), _ewm(close, 50)
+    macd = _ewm(close, 12) - _ewm(close, 26)
+    macd_sig = _ewm(macd, 9)
+    adx = df['ADX'].to_numpy(dtype=np.float64)
+    rsi = df['RSI'].to_numpy(dtype=np.float64)
+
+    prev_close = _shift(close, 1)
+    tr = np.fmax(np.fmax(high - low, np.abs(high - prev_close)), np.abs(low - prev_close))
+    atr = _rolling_mean(tr, rules['atr_period'])
+
+    # GetTrendSignal votes
+    up = (ema_f > ema_m) & (ema_m > ema_s)
+    down = (ema_f < ema_m) & (ema_m < ema_s)
+    buy = np.where(up, 5 + 2 * (close > ema_f), 0)
+    sell = np.where(down & ~up, 5 + 2 * (close < ema_f), 0)
+    strong = adx > 25
+    buy = buy + np.where(strong & (ema_f > ema_m), 2, 0)
+    sell = sell + np.where(strong & ~(ema_f > ema_m), 2, 0)
+    buy = buy + np.where((macd > macd_sig) & (macd > 0), 2, 0)
+    sell = sell + np.where(~((macd > macd_sig) & (macd > 0)) & (macd < macd_sig) & (macd < 0), 2, 0)
+
+    total = buy + sell
+    direction = np.sign(buy - sell).astype(np.int8)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        confidence = np.where(total > 0,
+                              (np.maximum(buy, sell) / total * 100).astype(np.int64), 0)
+    confidence = np.where((total > 0) & (buy == sell), 50, confidence)
+
+    # PassesMomentumFilter, time filter and spread filter
+    hour = pd.DatetimeIndex(df['Date']).hour.values
+    dow = pd.DatetimeIndex(df['Date']).dayofweek.values
+    tradeable = (atr >= 10 * rules['point']) & ~((rsi > 45) & (rsi < 55))
+    tradeable &= (hour >= rules['start_hour']) & (hour < rules['end_hour'])
+    tradeable &= ~((dow == 4) & (hour >= rules['friday_close_hour']))
+    if 'Spread' in df.columns:
+        spread_pips = df['Spread'].to_numpy(dtype=np.float64) * rules['point'] / rules['pip_size']
+        tradeable &= spread_pips <= rules['max_spread_pips']
+
+    return {'direction': direction, 'confidence': confidence,
+            'tradeable': tradeable & ~np.isnan(atr), 'atr': atr}
+
+
+def _simulate(prices: Dict[str, np.ndarray], signal: np.ndarray, entry_bar: np.ndarray,
+              side: np.ndarray, sl_dist: np.ndarray, tp_dist: np.ndarray,
+              trail_start: np.ndarray, rules: Dict, window: int) -> Dict[str, np.ndarray]:
+    """
+    Exit of every candidate within `window` bars of entry.
+
+    Shorts are mirrored (prices negated, high/low swapped) so one
+    long-only rule set covers both sides. resolved is False where no
+    exit happened inside the window and more bars are available.
+    """
+    n = len(prices['open'])
+    pip = rules['pip_size']
+    idx = entry_bar[:, None] + np.arange(window)
+    valid = idx < n
+    idx = np.minimum(idx, n - 1)
+    s = side[:, None].astype(np.float64)
+
+    o = s * prices['open'][idx]
+    c = s * prices['close'][idx]
+    hi = np.where(side[:, None] > 0, prices['high'][idx], -prices['low'][idx])
+    lo = np.where(side[:, None] > 0, prices['low'][idx], -prices['high'][idx])
+    atr_prev = prices['atr'][idx - 1]
+
+    entry = o[:, 0]
+    e = entry[:, None]
+    sl = (entry - sl_dist)[:, None]
+    tp = (entry + tp_dist)[:, None]
+
+    # Best price seen through the previous bar drives breakeven/trailing
+    best = np.maximum.accumulate(hi, axis=1)
+    prev_best = np.empty_like(best)
+    prev_best[:, 0] = -np.inf
+    prev_best[:, 1:] = best[:, :-1]
+    excursion = prev_best - e
+
+    stop = np.where(excursion >= rules['breakeven_pips'] * pip,
+                    np.maximum(sl, e + rules['breakeven_offset_pips'] * pip), sl)
+    trail = np.where(excursion >= trail_start[:, None] * pip,
+                     prev_best - rules['trail_atr_mult'] * atr_prev, -np.inf)
+    stop = np.maximum(stop, np.maximum.accumulate(trail, axis=1))
+
+    stop_hit = lo <= stop
+    target_hit = hi >= tp
+    opposite = signal['opposite_long'][idx] & (side[:, None] > 0) | \
+        signal['opposite_short'][idx] & (side[:, None] < 0)
+    reversal = opposite & (c - e <= rules['cut_loss_pips'] * pip)
+
+    any_exit = (stop_hit | target_hit | reversal) & valid
+    rows = np.arange(len(entry_bar))
+    first = any_exit.argmax(axis=1)
+    has_exit = any_exit[rows, first]
+
+    # Timeout or end of data where nothing fired
+    last_valid = valid.sum(axis=1) - 1
+    at_end = entry_bar + window >= n
+    resolved = has_exit | (window >= rules['max_hold_bars']) | at_end
+    first = np.where(has_exit, first, np.minimum(last_valid, rules['max_hold_bars'] - 1))
+
+    reason = np.select(
+        [has_exit & stop_hit[rows, first], has_exit & target_hit[rows, first], has_exit],
+        [0, 1, 2], 3)
+    exit_price = np.select(
+        [reason == 0, reason == 1],
+        [np.minimum(o[rows, first], stop[rows, first]), np.maximum(o[rows, first], tp[:, 0])],
+        c[rows, first])
+
+    # Partial close at a fixed excursion, unless stopped out on that bar
+    level = entry + rules['partial_close_pips'] * pip
+    partial_hit = (hi >= level[:, None]) & valid
+    p_first = partial_hit.argmax(axis=1)
+    partial = partial_hit[rows, p_first] & (
+        (p_first < first) | ((p_first == first) & (reason != 0)))
+    partial_price = np.maximum(o[rows, p_first], level)
+    frac = rules['partial_close_fraction']
+    gain = np.where(partial,
+                    frac * (partial_price - entry) + (1 - frac) * (exit_price - entry),
+                    exit_price - entry)
+
+    return {
+        'resolved': resolved,
+        'exit_bar': entry_bar + first,
+        'reason': reason,
+        'entry_price': s[:, 0] * entry,
+        'exit_price': s[:, 0] * exit_price,
+        'gain': gain,
+        'partial': partial
+    }
+
+
+def simulate_exits(df: pd.DataFrame, signal: Dict[str, np.ndarray], entry_bar: np.ndarray,
+                   side: np.ndarray, sl_dist: np.ndarray, tp_dist: np.ndarray,
+                   trail_start: np.ndarray, rules: Dict) -> Dict[str, np.ndarray]:
+    """Exits for every candidate, growing the window only where needed"""
+    prices = {
+        'open': df['Open'].to_numpy(dtype=np.float64),
+        'high': df['High'].to_numpy(dtype=np.float64),
+        'low': df['Low'].to_numpy(dtype=np.float64),
+        'close': df['Close'].to_numpy(dtype=np.float64),
+        'atr': signal['atr']
+    }
+    windows = [w for w in _WINDOWS if w < rules['max_hold_bars']] + [rules['max_hold_bars']]
+
+    out = None
+    todo = np.arange(len(entry_bar))
+    for window in windows:
+        if len(todo) == 0:
+            break
+        part = _simulate(prices, signal, entry_bar[todo], side[todo], sl_dist[todo],
+                         tp_dist[todo], trail_start[todo], rules, window)
+        if out is None:
+            out = {k: np.empty(len(entry_bar), dtype=v.dtype) for k, v in part.items()}
+        done = part['resolved']
+        for key, values in part.items():
+            out[key][todo[done]] = values[done]
+        todo = todo[~done]
+    return out
+
+
+def run_backtest(df: pd.DataFrame,
+                 regimes: np.ndarray,
+                 regime_settings: Optional[Dict[str, Dict]] = None,
+                 rules: Optional[Dict] = None,
+                 signal: Optional[Dict[str, np.ndarray]] = None,
+                 verbose: bool = True) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Backtest the EA rules with regime-adaptive exits.
+
+    Args:
+        df: prepare_features() output (needs Date, OHLC, ADX, RSI; Spread
+            is used for costs and the spread filter when present)
+        regimes: Predicted regime per row (RegimeDetector.predict)
+        regime_settings: Per-regime settings keyed by regime name
+            (default: DEFAULT_REGIME_SETTINGS)
+        rules: Overrides for DEFAULT_RULES
+        signal: Precomputed ea_signals(df) (reused across sweeps)
+        verbose: Print the summary
+
+    Returns:
+        (trades DataFrame, summary dict). Gains are in pips per unit
+        position, net of the entry bar's spread.
+    """
+    start = time.perf_counter()
+    rules = {**DEFAULT_RULES, **(rules or {})}
+    settings = regime_settings or DEFAULT_REGIME_SETTINGS
+    signal = signal if signal is not None else ea_signals(df, rules)
+    pip = rules['pip_size']
+
+    table = {key: np.array([settings[name][key] for name in REGIME_NAMES], dtype=np.float64)
+             for key in ('atr_sl_mult', 'atr_tp_mult', 'trailing_start', 'min_confidence')}
+    regimes = np.asarray(regimes, dtype=np.intp)
+
+    # Signals on bar i close enter at bar i + 1 open
+    n = len(df)
+    candidate = (signal['tradeable'] & (signal['direction'] != 0) &
+                 (signal['confidence'] >= table['min_confidence'][regimes]))
+    candidate[n - 1] = False
+    sig_bar = np.flatnonzero(candidate)
+    regime = regimes[sig_bar]
+    side = signal['direction'][sig_bar].astype(np.int64)
+    atr = signal['atr'][sig_bar]
+
+    strong = signal['confidence'] >= rules['reversal_confidence']
+    signal = {**signal,
+              'opposite_long': strong & (signal['direction'] < 0),
+              'opposite_short': strong & (signal['direction'] > 0)}
+
+    exits = simulate_exits(df, signal, sig_bar + 1, side,
+                           table['atr_sl_mult'][regime] * atr,
+                           table['atr_tp_mult'][regime] * atr,
+                           table['trailing_start'][regime], rules)
+
+    # One position at a time: the next signal must come at or after the
+    # previous exit bar
+    taken = []
+    i = 0
+    exit_bar = exits['exit_bar']
+    while i < len(sig_bar):
+        taken.append(i)
+        i = np.searchsorted(sig_bar, exit_bar[i], side='left')
+        if i <= taken[-1]:
+            i = taken[-1] + 1
+    taken = np.asarray(taken, dtype=np.intp)
+
+    spread = (df['Spread'].to_numpy(dtype=np.float64) * rules['point']
+              if 'Spread' in df.columns else np.zeros(n))
+    entry_bar = sig_bar[taken] + 1
+    cost = spread[entry_bar]
+    gain = exits['gain'][taken] - cost
+    risk = (table['atr_sl_mult'][regime] * atr)[taken]
+
+    dates = df['Date'].to_numpy()
+    trades = pd.DataFrame({
+        'entry_time': dates[entry_bar],
+        'exit_time': dates[exit_bar[taken]],
+        'side': side[taken],
+        'regime': regime[taken],
+        'entry_price': exits['entry_price'][taken],
+        'exit_price': exits['exit_price'][taken],
+        'bars_held': exit_bar[taken] - entry_bar + 1,
+        'reason': np.asarray(EXIT_REASONS)[exits['reason'][taken]],
+        'partial': exits['partial'][taken],
+        'pnl_pips': gain / pip,
+        'cost_pips': cost / pip,
+        'r_multiple': gain / risk
+    })
+
+    summary = summarize_trades(trades)
+    summary['candidates'] = int(len(sig_bar))
+    summary['seconds'] = time.perf_counter() - start
+    if verbose:
+        print_summary(summary)
+    return trades, summary
+
+
+def summarize_trades(trades: pd.DataFrame) -> Dict:
+    """Aggregate trade statistics, overall and per regime"""
+    def _stats(t: pd.DataFrame) -> Dict:
+        pnl = t['pnl_pips'].to_numpy()
+        equity = np.cumsum(pnl)
+        drawdown = np.maximum.accumulate(np.concatenate([[0.0], equity]))[1:] - equity
+        wins, losses = pnl[pnl > 0].sum(), -pnl[pnl < 0].sum()
+        return {
+            'trades': int(len(pnl)),
+            'win_rate': float(np.mean(pnl > 0)) if len(pnl) else 0.0,
+            'total_pips': float(pnl.sum()),
+            'expectancy_pips': float(pnl.mean()) if len(pnl) else 0.0,
+            'profit_factor': float(wins / losses) if losses > 0 else float('inf'),
+            'max_drawdown_pips': float(drawdown.max()) if len(pnl) else 0.0,
+            'avg_r': float(t['r_multiple'].mean()) if len(pnl) else 0.0
+        }
+
+    summary = _stats(trades)
+    summary['by_regime'] = {name: _stats(trades[trades['regime'] == k])
+                            for k, name in enumerate(REGIME_NAMES)}
+    summary['exit_reasons'] = {r: int((trades['reason'] == r).sum()) for r in EXIT_REASONS}
+    return summary
+
+
+def print_summary(summary: Dict):
+    print(f"Backtest: {summary['trades']:,} trades from {summary['candidates']:,} candidate "
+          f"signals in {summary['seconds'] * 1000:.0f} ms")
+    print(f"  Win rate {summary['win_rate']:.1%}, total {summary['total_pips']:,.0f} pips, "
+          f"PF {summary['profit_factor']:.2f}, max DD {summary['max_drawdown_pips']:,.0f} pips")
+    for name, s in summary['by_regime'].items():
+        print(f"  {name:<9} {s['trades']:6,} trades  win {s['win_rate']:6.1%}  "
+              f"{s['total_pips']:10,.0f} pips  PF {s['profit_factor']:5.2f}")
+    print("  Exits: " + ", ".join(f"{r} {c:,}" for r, c in summary['exit_reasons'].items()))
+
+
+if __name__ == "__main__":
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+    from src.features import prepare_features
+    from src.regime_detector import RegimeDetector
+
+    root = Path(__file__).parent.parent
+    model_path = root / "models" / "regime_detector.joblib"
+    csv_path = root / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if model_path.exists() and csv_path.exists():
+        detector = RegimeDetector.load(str(model_path))
+        df = load_mt5_csv(str(csv_path), use_cache=True)
+        df = prepare_features(create_time_features(clean_data(df)), add_labels=False)
+        regimes = detector.predict(df[detector.feature_columns].values)
+        run_backtest(df, regimes, load_regime_settings(str(root / "config.yaml")))
+    else:
+        print("Model or CSV not found. Train the model first.")
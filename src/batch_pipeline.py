@@ -0,0 +1,418 @@
+"""
+Multi-Symbol Batch Pipeline
+===========================
+Nightly driver that trains and exports a regime model for every MT5
+export in a directory (XAUUSD, XAGUSD, FX pairs, ...).
+
+Each symbol runs load -> clean -> features -> labels -> train -> export
+in its own worker process:
+- Exports are discovered by their MT5 file name, <SYMBOL>_<TF>_....csv
+- Workers are recycled after every symbol (max_tasks_per_child=1), so a
+  large symbol's memory is returned to the OS before the next one starts
+- The worker count is capped by a memory budget using a per-symbol peak
+  estimate from the CSV size; biggest files are scheduled first
+- Worker output goes to a per-symbol log, not the console
+- With use_cache, bars and feature columns are kept in a bar cache and a
+  FeatureStore under output_dir, so reruns on unchanged (or appended)
+  exports skip parsing and most of the feature computation
+
+Artifacts land in <output_dir>/<SYMBOL>_<TF>/ (joblib model, ONNX graph,
+regime_config.json, RegimeModelConfig.mqh, RegimeTrees.mqh), and a
+consolidated per-symbol timing/metrics report is written as
+batch_report.csv / batch_report.json.
+"""
+
+import contextlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+if __name__ == "__main__":
+    # Run as a script (python src/batch_pipeline.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.multi_timeframe import TIMEFRAME_MINUTES
+
+
+STAGES = ['load', 'clean', 'features', 'labels', 'train', 'export']
+
+# <SYMBOL>_<TF>_<from>_<to>.csv as written by MT5 (suffix optional)
+_EXPORT_PATTERN = re.compile(
+    r'^(?P<symbol>[A-Za-z0-9.#+-]+?)_(?P<timeframe>' + '|'.join(TIMEFRAME_MINUTES) + r')(?:_.*)?$'
+)
+
+# Worker peak RSS estimate: fixed cost (imports, ONNX conversion) plus a
+# share per byte of CSV (bars, feature arrays, float64 X, fitted forest).
+# Measured: ~450 MB for small H1 exports with ONNX, 560 MB for a 30 MB /
+# 500k-bar M1 export
+WORKER_BASE_BYTES = 512 * 1024**2
+PEAK_BYTES_PER_CSV_BYTE = 13
+
+DEFAULT_REGIME_PARAMS = {
+    'lookforward': 10,
+    'trend_threshold': 0.005,
+    'vol_threshold': 1.5
+}
+
+
+def discover_exports(data_dir: str, timeframe: Optional[str] = None) -> List[Dict]:
+    """
+    MT5 exports in data_dir, one per symbol and timeframe.
+
+    When a symbol/timeframe has several exports the most recently
+    modified file is used. Files not named like an MT5 export are skipped.
+    """
+    found = {}
+    for path in sorted(Path(data_dir).glob('*.csv')):
+        match = _EXPORT_PATTERN.match(path.stem)
+        if match is None:
+            print(f"  Skipping {path.name}: not an MT5 <SYMBOL>_<TF>_... export")
+            continue
+        symbol, tf = match.group('symbol').upper(), match.group('timeframe')
+        if timeframe is not None and tf != timeframe:
+            continue
+        stat = path.stat()
+        key = (symbol, tf)
+        if key not in found or stat.st_mtime > found[key]['mtime']:
+            found[key] = {'symbol': symbol, 'timeframe': tf, 'path': str(path),
+                          'bytes': stat.st_size, 'mtime': stat.st_mtime}
+    return sorted(found.values(), key=lambda e: (e['symbol'], e['timeframe']))
+
+
+def load_batch_config(config_path: str) -> Dict:
+    """Split ratios, labeling, model and `batch:` settings from config.yaml"""
+    import yaml
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f)
+    regime = config.get('regime', {})
+    return {
+        'split': config.get('split', {}),
+        'regime_params': {
+            'lookforward': regime.get('lookforward_bars', 10),
+            'trend_threshold': regime.get('trend_threshold', 0.005),
+            'vol_threshold': regime.get('volatility_threshold', 1.5)
+        },
+        'backend': config.get('model', {}).get('boosting_backend', 'exact'),
+        'dtype_policy': config.get('data', {}).get('dtype_policy', 'default'),
+        'higher_timeframes': config.get('data', {}).get('higher_timeframes') or [],
+        'batch': config.get('batch', {}) or {}
+    }
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident set size of this process (Linux reports KB; NaN on Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return np.nan
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_symbol(task: Dict) -> Dict:
+    """Full pipeline for one export; failures are reported, not raised"""
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features, get_dtype_policy
+    from src.fast_features import compute_features
+    from src.feature_store import FeatureStore
+    from src.label_engine import compute_label_tensor
+    from src.features import get_feature_columns
+    from src.multi_timeframe import add_higher_timeframe_features, get_mtf_feature_columns
+    from src.regime_detector import RegimeDetector
+    from sklearn.metrics import f1_score
+
+    entry = task['entry']
+    out_dir = Path(task['output_dir']) / f"{entry['symbol']}_{entry['timeframe']}"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    params = task['regime_params']
+    policy = get_dtype_policy(task['dtype_policy'])
+    row = {'symbol': entry['symbol'], 'timeframe': entry['timeframe'],
+           'csv_mb': entry['bytes'] / 1024**2, 'status': 'ok', 'error': ''}
+    timings = {stage: np.nan for stage in STAGES}
+
+    start = time.perf_counter()
+    stage = 'load'
+    with open(out_dir / 'pipeline.log', 'w') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            t = time.perf_counter()
+            df = load_mt5_csv(entry['path'], use_cache=task['use_cache'],
+                              cache_dir=task['cache_dir'])
+            row['raw_rows'] = len(df)
+            timings['load'] = time.perf_counter() - t
+
+            stage = 'clean'
+            t = time.perf_counter()
+            df = create_time_features(clean_data(df), policy)
+            timings['clean'] = time.perf_counter() - t
+
+            stage = 'features'
+            t = time.perf_counter()
+            feature_columns = get_feature_columns()
+            if task['feature_store_dir']:
+                store = FeatureStore(task['feature_store_dir'])
+                arrays = store.get_arrays(df, feature_columns, add_labels=False)
+            else:
+                arrays = compute_features(df, add_labels=False)
+            valid = arrays.pop('_valid')
+            if task['higher_timeframes']:
+                mtf_columns = get_mtf_feature_columns(task['higher_timeframes'])
+                joined = add_higher_timeframe_features(df, task['higher_timeframes'],
+                                                       base_minutes=TIMEFRAME_MINUTES[entry['timeframe']])
+                for col in mtf_columns:
+                    arrays[col] = joined[col].to_numpy()
+                    valid &= ~np.isnan(arrays[col])
+                del joined
+                feature_columns = feature_columns + mtf_columns
+            timings['features'] = time.perf_counter() - t
+
+            stage = 'labels'
+            t = time.perf_counter()
+            labels = compute_label_tensor(df, [params['lookforward']],
+                                          [(params['trend_threshold'], params['vol_threshold'])])
+            regime = labels['regime'][:, 0, 0]
+            valid &= regime >= 0
+            X = np.empty((int(valid.sum()), len(feature_columns)),
+                         dtype=policy['feature'] or np.float64)
+            for j, col in enumerate(feature_columns):
+                X[:, j] = arrays[col][valid]
+            y = regime[valid].astype(policy['label'] or np.int64)
+            row['first_bar'] = str(df['Date'].values[valid][0])[:19] if len(y) else ''
+            row['last_bar'] = str(df['Date'].values[valid][-1])[:19] if len(y) else ''
+            del df, arrays, labels, regime, valid
+            timings['labels'] = time.perf_counter() - t
+
+            stage = 'train'
+            t = time.perf_counter()
+            split = task['split']
+            train_end = int(len(y) * split.get('train_ratio', 0.7))
+            test_start = int(len(y) * (split.get('train_ratio', 0.7) + split.get('val_ratio', 0.15)))
+            if train_end == 0 or test_start >= len(y):
+                raise ValueError(f"Not enough bars after warm-up: {len(y)}")
+            detector = RegimeDetector(feature_columns, n_jobs=task['n_jobs'],
+                                      backend=task['backend'])
+            fit_results = detector.fit(X[:train_end], y[:train_end])
+            X_test, y_test = X[test_start:], y[test_start:]
+            test_results = detector.evaluate(X_test, y_test)
+            row.update({
+                'rows': len(y),
+                'train_rows': train_end,
+                'test_rows': len(y_test),
+                'train_accuracy': fit_results['train_accuracy'],
+                'test_accuracy': test_results['accuracy'],
+                'test_f1_macro': f1_score(y_test, test_results['predictions'], average='macro',
+                                          labels=[0, 1, 2], zero_division=0),
+                **{f'share_{name}': float(np.mean(y == k))
+                   for k, name in RegimeDetector.REGIME_NAMES.items()}
+            })
+            timings['train'] = time.perf_counter() - t
+
+            stage = 'export'
+            t = time.perf_counter()
+            model_path = str(out_dir / 'regime_detector.joblib')
+            detector.save(model_path)
+            X_check = X_test[-task['check_rows']:] if task['check_rows'] else None
+            del X, y
+            row['onnx'] = False
+            if task['export_onnx']:
+                from src.export_onnx import export_to_onnx, create_mt5_include
+                row['onnx'] = export_to_onnx(model_path, str(out_dir / 'regime_detector.onnx'),
+                                             str(out_dir / 'regime_config.json'), X_check,
+                                             task['regime_settings'])
+                create_mt5_include(str(out_dir / 'regime_config.json'),
+                                   str(out_dir / 'RegimeModelConfig.mqh'))
+                with open(out_dir / 'regime_config.json', 'r') as f:
+                    # 'ensemble', 'rf_only' (hist backend) or None
+                    row['onnx_graph'] = json.load(f).get('onnx_graph')
+            if task['export_trees']:
+                from src.mql5_trees import create_mt5_trees_include
+                check = create_mt5_trees_include(model_path, str(out_dir / 'RegimeTrees.mqh'),
+                                                 X_check)
+                if check is not None:
+                    row['trees_max_abs_diff'] = check['max_abs_diff']
+            timings['export'] = time.perf_counter() - t
+            if task['export_onnx'] and not row['onnx']:
+                row['status'] = 'failed:export'
+                row['error'] = 'ONNX export or parity check failed (see pipeline.log)'
+        except Exception as e:
+            row['status'] = f'failed:{stage}'
+            row['error'] = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+
+    row.update({f'{s}_seconds': timings[s] for s in STAGES})
+    row['total_seconds'] = time.perf_counter() - start
+    row['peak_rss_mb'] = _peak_rss_mb()
+    row['output_dir'] = str(out_dir)
+    return row
+
+
+def run_batch(data_dir: str,
+              output_dir: str,
+              timeframe: Optional[str] = None,
+              symbols: Optional[List[str]] = None,
+              regime_params: Optional[Dict] = None,
+              symbol_params: Optional[Dict[str, Dict]] = None,
+              split: Optional[Dict] = None,
+              backend: str = 'exact',
+              dtype_policy: str = 'default',
+              higher_timeframes: Optional[List[str]] = None,
+              regime_settings: Optional[Dict[str, Dict]] = None,
+              n_workers: Optional[int] = None,
+              memory_budget_gb: Optional[float] = None,
+              use_cache: bool = True,
+              export_onnx: bool = True,
+              export_trees: bool = True,
+              check_rows: int = 500) -> pd.DataFrame:
+    """
+    Train and export one regime model per discovered export.
+
+    Args:
+        data_dir: Directory of MT5 CSV exports
+        output_dir: Root for per-symbol artifact directories and the report
+        timeframe: Only use exports of this timeframe (default: all)
+        symbols: Only these symbols (default: all discovered)
+        regime_params: lookforward / trend_threshold / vol_threshold
+            (default: DEFAULT_REGIME_PARAMS)
+        symbol_params: Per-symbol overrides of regime_params, e.g.
+            {'EURUSD': {'trend_threshold': 0.002}}
+        split: train_ratio / val_ratio of the chronological split
+        backend: Boosting backend ('exact' or 'hist')
+        dtype_policy: DTYPE_POLICIES name; 'compact' trains on float32
+        higher_timeframes: Higher-timeframe features to join (e.g.
+            ['H4', 'D1']); timeframes not above a symbol's own are skipped
+        regime_settings: Per-regime EA settings written into the exports
+        n_workers: Worker processes (default: one per CPU)
+        memory_budget_gb: Cap on the summed estimated peak memory of
+            concurrent workers (default: no cap)
+        use_cache: Load through the columnar bar cache and read feature
+            columns through a FeatureStore in output_dir
+        export_onnx: Write ONNX graph + regime_config.json + .mqh config
+        export_trees: Write the native RegimeTrees.mqh
+        check_rows: Test rows used for the export parity checks (0 = none)
+
+    Returns:
+        Report DataFrame, one row per symbol
+    """
+    entries = discover_exports(data_dir, timeframe)
+    if symbols is not None:
+        wanted = {s.upper() for s in symbols}
+        entries = [e for e in entries if e['symbol'] in wanted]
+    if not entries:
+        raise ValueError(f"No MT5 exports found in {data_dir}")
+    # Biggest first, so a long symbol does not start last
+    entries.sort(key=lambda e: -e['bytes'])
+
+    n_workers = min(n_workers or os.cpu_count() or 1, len(entries))
+    if memory_budget_gb is not None:
+        peak = WORKER_BASE_BYTES + entries[0]['bytes'] * PEAK_BYTES_PER_CSV_BYTE
+        n_workers = max(1, min(n_workers, int(memory_budget_gb * 1024**3 // max(peak, 1))))
+    # Forest threads share the cores with the other symbols
+    n_jobs = max(1, (os.cpu_count() or 1) // n_workers)
+
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    base_params = {**DEFAULT_REGIME_PARAMS, **(regime_params or {})}
+    tasks = [{
+        'entry': entry,
+        'output_dir': output_dir,
+        'regime_params': {**base_params, **(symbol_params or {}).get(entry['symbol'], {})},
+        'split': split or {},
+        'backend': backend,
+        'dtype_policy': dtype_policy,
+        'higher_timeframes': [tf for tf in (higher_timeframes or [])
+                              if TIMEFRAME_MINUTES[tf] > TIMEFRAME_MINUTES[entry['timeframe']]],
+        'regime_settings': regime_settings,
+        'n_jobs': n_jobs,
+        'use_cache': use_cache,
+        'cache_dir': str(Path(output_dir) / 'barcache'),
+        'feature_store_dir': str(Path(output_dir) / 'featurestore') if use_cache else None,
+        'export_onnx': export_onnx,
+        'export_trees': export_trees,
+        'check_rows': check_rows
+    } for entry in entries]
+
+    print(f"Batch pipeline: {len(tasks)} exports "
+          f"({', '.join(e['symbol'] + ' ' + e['timeframe'] for e in entries)}), "
+          f"{n_workers} workers x {n_jobs} threads")
+
+    start = time.perf_counter()
+    rows = []
+    # A fresh process per symbol releases its memory before the next one
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             max_tasks_per_child=1) as pool:
+        for row in pool.map(_run_symbol, tasks):
+            print(f"  {row['symbol']:<10} {row['timeframe']:<4} {row['status']:<14} "
+                  f"{row['total_seconds']:7.1f}s")
+            rows.append(row)
+    wall = time.perf_counter() - start
+
+    report = pd.DataFrame(rows).sort_values(['symbol', 'timeframe']).reset_index(drop=True)
+    save_report(report, output_dir, {'wall_seconds': wall, 'n_workers': n_workers,
+                                     'n_jobs': n_jobs})
+    print_report(report, wall)
+    return report
+
+
+def save_report(report: pd.DataFrame, output_dir: str, run_info: Dict):
+    """batch_report.csv (one row per symbol) and batch_report.json"""
+    report.to_csv(Path(output_dir) / 'batch_report.csv', index=False)
+    summary = {
+        **run_info,
+        'symbols': len(report),
+        'failed': int((report['status'] != 'ok').sum()),
+        'symbol_seconds_total': float(report['total_seconds'].sum()),
+        'stage_seconds_total': {s: float(report[f'{s}_seconds'].sum()) for s in STAGES},
+        'max_peak_rss_mb': float(report['peak_rss_mb'].max()),
+        'per_symbol': json.loads(report.to_json(orient='records'))
+    }
+    with open(Path(output_dir) / 'batch_report.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f"  Report saved: {Path(output_dir) / 'batch_report.csv'}")
+
+
+def print_report(report: pd.DataFrame, wall_seconds: float):
+    header = ''.join(f"{s:>9}" for s in STAGES)
+    print(f"\n  {'symbol':<14}{'rows':>10}{header}{'total':>9}{'rss MB':>8}{'test acc':>10}{'f1':>7}")
+    for _, r in report.iterrows():
+        name = f"{r['symbol']} {r['timeframe']}"
+        if r['status'] != 'ok':
+            print(f"  {name:<14} {r['status']}: {r['error']}")
+            continue
+        stages = ''.join(f"{r[f'{s}_seconds']:9.2f}" for s in STAGES)
+        print(f"  {name:<14}{int(r['rows']):10,}{stages}{r['total_seconds']:9.1f}"
+              f"{r['peak_rss_mb']:8.0f}{r['test_accuracy']:10.2%}{r['test_f1_macro']:7.3f}")
+    total = report['total_seconds'].sum()
+    print(f"  Wall time {wall_seconds:.1f}s for {total:.1f}s of symbol work "
+          f"({total / max(wall_seconds, 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+    from src.backtest import load_regime_settings
+
+    root = Path(__file__).parent.parent
+    config = load_batch_config(str(root / "config.yaml"))
+    batch = config['batch']
+    data_dir = root / batch.get('data_dir', 'data')
+
+    if data_dir.exists():
+        run_batch(str(data_dir), str(root / batch.get('output_dir', 'models/batch')),
+                  timeframe=batch.get('timeframe'),
+                  symbols=batch.get('symbols'),
+                  regime_params=config['regime_params'],
+                  symbol_params=batch.get('symbol_params'),
+                  split=config['split'],
+                  backend=config['backend'],
+                  dtype_policy=config['dtype_policy'],
+                  higher_timeframes=config['higher_timeframes'],
+                  regime_settings=load_regime_settings(str(root / "config.yaml")),
+                  n_workers=batch.get('workers'),
+                  memory_budget_gb=batch.get('memory_budget_gb'))
+    else:
+        print(f"Data directory not found: {data_dir}")
@@ -0,0 +1,347 @@
+"""
+Pipeline Benchmark Suite
+========================
+Times and memory-profiles every stage of the data -> features -> train
+-> export pipeline on synthetic OHLC data, and compares the results with
+a stored baseline.
+
+Stages: load_mt5_csv, clean_data, create_time_features, each
+add_*_features function, add_regime_labels, RegimeDetector.fit,
+predict_proba and export_to_onnx. Each stage runs on the previous
+stage's output; model stages use at most max_model_rows rows, since
+fitting 10M bars is not a benchmark anyone waits for.
+
+Timing is the best of `repeats` untraced runs; peak memory comes from one
+extra run under tracemalloc (numpy and pandas allocations included, work
+in joblib worker processes not), so tracing never inflates the timings.
+A stage timed fewer than MIN_TIMING_REPEATS times (fit, export, every
+stage of sizes above 100k bars) is one noisy sample, so it only counts
+as slower past SINGLE_RUN_THRESHOLD.
+
+Synthetic bars are a random walk with switching volatility regimes, so
+every regime class appears in the labels. Generated CSVs (MT5 export
+format) are cached in the benchmark directory.
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+SIZES = {'10k': 10_000, '1M': 1_000_000, '10M': 10_000_000}
+
+STAGES = [
+    'load_mt5_csv', 'clean_data', 'create_time_features',
+    'add_price_features', 'add_volatility_features', 'add_trend_features',
+    'add_momentum_features', 'add_regime_labels',
+    'fit', 'predict_proba', 'export_to_onnx'
+]
+
+# Relative slowdown / memory growth counted as a regression
+DEFAULT_THRESHOLD = 0.20
+
+# Ignore differences below these (timer noise, allocator jitter)
+MIN_SECONDS_DELTA = 0.05
+MIN_MB_DELTA = 10.0
+
+# Timings from fewer runs than this (on either side) are single samples:
+# run-to-run jitter of a few hundred ms on multi-second stages is common,
+# so they need a slowdown beyond SINGLE_RUN_THRESHOLD to be flagged
+MIN_TIMING_REPEATS = 3
+SINGLE_RUN_THRESHOLD = 0.50
+
+_BAR_MINUTES = {'M1': 1, 'M5': 5, 'H1': 60}
+
+
+def generate_ohlc(n_bars: int, timeframe: str = 'M1', seed: int = 42) -> pd.DataFrame:
+    """
+    Synthetic bars with the load_mt5_csv schema.
+
+    Gold-like random walk whose volatility switches between calm, normal
+    and stressed states (mean state length ~500 bars). Weekends are
+    skipped like a real feed.
+    """
+    rng = np.random.default_rng(seed)
+    minutes = _BAR_MINUTES[timeframe]
+
+    # Markov volatility regimes
+    switches = rng.random(n_bars) < 1 / 500
+    state = np.cumsum(switches) % 3
+    sigma = np.array([0.3, 1.0, 2.5])[rng.permutation(3)][state] * 4e-4 * np.sqrt(minutes)
+    drift = np.repeat(rng.normal(0, 2e-5, switches.sum() + 1), np.diff(
+        np.concatenate(([0], np.flatnonzero(switches), [n_bars]))))[:n_bars]
+    close = 1800 * np.exp(np.cumsum(drift + rng.normal(0, 1, n_bars) * sigma))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    wick = np.abs(rng.normal(0, 1, (2, n_bars))) * sigma * close * 0.5
+    high = np.maximum(open_, close) + wick[0]
+    low = np.minimum(open_, close) - wick[1]
+
+    # Trading minutes only: Monday 00:00 to Friday 23:59
+    week = 5 * 24 * 60 // minutes
+    bar = np.arange(n_bars)
+    offset = (bar // week) * 7 * 24 * 60 + (bar % week) * minutes
+    dates = np.datetime64('2000-01-03T00:00') + offset.astype('timedelta64[m]')
+
+    return pd.DataFrame({
+        'Date': dates.astype('datetime64[ns]'),
+        'Open': open_.round(2),
+        'High': high.round(2),
+        'Low': low.round(2),
+        'Close': close.round(2),
+        'TickVolume': rng.integers(50, 5000, n_bars),
+        'Volume': np.zeros(n_bars, dtype=np.int64),
+        'Spread': rng.integers(10, 40, n_bars)
+    })
+
+
+def write_mt5_csv(df: pd.DataFrame, path: str):
+    """Write bars as a tab-separated MT5 export (<DATE> <TIME> ...)"""
+    dates = pd.DatetimeIndex(df['Date'])
+    out = pd.DataFrame({
+        '<DATE>': dates.strftime('%Y.%m.%d'),
+        '<TIME>': dates.strftime('%H:%M:%S'),
+        '<OPEN>': df['Open'], '<HIGH>': df['High'], '<LOW>': df['Low'],
+        '<CLOSE>': df['Close'], '<TICKVOL>': df['TickVolume'],
+        '<VOL>': df['Volume'], '<SPREAD>': df['Spread']
+    })
+    out.to_csv(path, sep='\t', index=False, float_format='%.2f')
+
+
+def synthetic_csv(n_bars: int, bench_dir: str, timeframe: str = 'M1', seed: int = 42) -> str:
+    """Path of a cached synthetic MT5 export, generated on first use"""
+    path = Path(bench_dir) / f"SYNTH_{timeframe}_{n_bars}_{seed}.csv"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        print(f"  Generating {n_bars:,} synthetic bars -> {path.name}")
+        write_mt5_csv(generate_ohlc(n_bars, timeframe, seed), str(path))
+    return str(path)
+
+
+def _measure(fn: Callable, repeats: int, memory: bool) -> Tuple[object, float, float]:
+    """(result, best seconds, traced peak MB) with stage output silenced"""
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - start)
+    peak = np.nan
+    if memory:
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result, best, peak
+
+
+def benchmark_size(n_bars: int,
+                   bench_dir: str,
+                   repeats: int = 3,
+                   memory: bool = True,
+                   max_model_rows: int = 10_000,
+                   backend: str = 'exact',
+                   stages: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """
+    Run every stage once per size.
+
+    Returns:
+        {stage: {'seconds', 'peak_mb', 'rows', 'rows_per_sec', 'repeats'}}; skipped
+        stages (e.g. ONNX export without skl2onnx) are omitted
+    """
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+    from src.features import (
+        add_price_features, add_volatility_features, add_trend_features,
+        add_momentum_features, add_regime_labels, get_feature_columns
+    )
+    from src.regime_detector import RegimeDetector
+
+    stages = stages or STAGES
+    csv_path = synthetic_csv(n_bars, bench_dir)
+    # Slow stages are timed once on big inputs
+    reps = repeats if n_bars <= 100_000 else 1
+    results = {}
+
+    def record(stage, fn, rows, n_repeats=reps):
+        if stage not in stages:
+            return fn()
+        out, seconds, peak = _measure(fn, n_repeats, memory)
+        results[stage] = {'seconds': seconds, 'peak_mb': peak, 'rows': rows,
+                          'rows_per_sec': rows / seconds if seconds > 0 else np.nan,
+                          'repeats': n_repeats}
+        print(f"  {stage:<24} {seconds:9.3f}s  peak {peak:9.1f} MB  ({rows:,} rows)")
+        return out
+
+    print(f"Benchmark: {n_bars:,} bars")
+    df = record('load_mt5_csv', lambda: load_mt5_csv(csv_path), n_bars)
+    df = record('clean_data', lambda: clean_data(df), len(df))
+    df = record('create_time_features', lambda: create_time_features(df), len(df))
+    for name, fn in (('add_price_features', add_price_features),
+                     ('add_volatility_features', add_volatility_features),
+                     ('add_trend_features', add_trend_features),
+                     ('add_momentum_features', add_momentum_features),
+                     ('add_regime_labels', add_regime_labels)):
+        df = record(name, lambda fn=fn, df=df: fn(df), len(df))
+
+    if not {'fit', 'predict_proba', 'export_to_onnx'} & set(stages):
+        return results
+
+    feature_columns = get_feature_columns()
+    model_df = df.dropna().iloc[-max_model_rows:]
+    del df
+    X = model_df[feature_columns].to_numpy(dtype=np.float64)
+    y = model_df['Regime'].to_numpy()
+    del model_df
+
+    detector = RegimeDetector(feature_columns, backend=backend)
+    record('fit', lambda: detector.fit(X, y), len(X), 1)
+    record('predict_proba', lambda: detector.predict_proba(X), len(X))
+
+    if 'export_to_onnx' in stages:
+        from src.export_onnx import ONNX_AVAILABLE, export_to_onnx
+        if not ONNX_AVAILABLE:
+            print("  export_to_onnx           skipped (skl2onnx not installed)")
+            return results
+        model_path = str(Path(bench_dir) / 'bench_model.joblib')
+        with contextlib.redirect_stdout(io.StringIO()):
+            detector.save(model_path)
+        record('export_to_onnx',
+               lambda: export_to_onnx(model_path, str(Path(bench_dir) / 'bench_model.onnx'),
+                                      str(Path(bench_dir) / 'bench_config.json')),
+               len(feature_columns), 1)
+    return results
+
+
+def _environment() -> Dict:
+    import sklearn
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def run_benchmarks(sizes: List[str] = ('10k', '1M'),
+                   bench_dir: str = 'benchmarks',
+                   output_path: Optional[str] = None,
+                   **kwargs) -> Dict:
+    """
+    Benchmark each named size (keys of SIZES) and write JSON results.
+
+    Args:
+        sizes: Size names to run (1M peaks near 3 GB RSS; '10M' needs
+            roughly 10x that for the pandas feature stages)
+        bench_dir: Directory for synthetic CSVs and export artifacts
+        output_path: Results JSON (default: <bench_dir>/latest.json)
+        **kwargs: Passed to benchmark_size (repeats, memory,
+            max_model_rows, backend, stages)
+    """
+    report = {'environment': _environment(),
+              'settings': {k: v for k, v in kwargs.items()},
+              'results': {}}
+    for name in sizes:
+        report['results'][name] = benchmark_size(SIZES[name], bench_dir, **kwargs)
+
+    output_path = output_path or str(Path(bench_dir) / 'latest.json')
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2, default=float)
+    print(f"Results saved: {output_path}")
+    return report
+
+
+def compare_to_baseline(report: Dict, baseline: Dict,
+                        threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    """
+    Stage-by-stage comparison against a baseline report.
+
+    A stage regresses when its time (or traced peak memory) grows by more
+    than `threshold` and by more than the noise floor (MIN_SECONDS_DELTA,
+    MIN_MB_DELTA). Timings with fewer than MIN_TIMING_REPEATS runs on
+    either side (baselines without a 'repeats' entry count as one run)
+    must grow by more than SINGLE_RUN_THRESHOLD instead. Returns the
+    regressions; prints the full table.
+    """
+    if baseline.get('environment', {}).get('cpu_count') != report['environment']['cpu_count']:
+        print("  Warning: baseline was recorded on a different machine")
+
+    regressions = []
+    print(f"  {'size':<5} {'stage':<24} {'base s':>9} {'now s':>9} {'ratio':>6} "
+          f"{'base MB':>9} {'now MB':>9}  status")
+    for size, stages in report['results'].items():
+        base_stages = baseline.get('results', {}).get(size, {})
+        for stage, now in stages.items():
+            base = base_stages.get(stage)
+            if base is None:
+                continue
+            ratio = now['seconds'] / base['seconds'] if base['seconds'] > 0 else np.nan
+            repeats = min(now.get('repeats', 1), base.get('repeats', 1))
+            time_threshold = (threshold if repeats >= MIN_TIMING_REPEATS
+                              else max(threshold, SINGLE_RUN_THRESHOLD))
+            slow = (now['seconds'] > base['seconds'] * (1 + time_threshold)
+                    and now['seconds'] - base['seconds'] > MIN_SECONDS_DELTA)
+            fat = (np.isfinite(now['peak_mb']) and np.isfinite(base['peak_mb'])
+                   and now['peak_mb'] > base['peak_mb'] * (1 + threshold)
+                   and now['peak_mb'] - base['peak_mb'] > MIN_MB_DELTA)
+            status = ' '.join(s for s, bad in (('SLOWER', slow), ('MORE-MEMORY', fat)) if bad)
+            if status:
+                regressions.append({'size': size, 'stage': stage, 'time_ratio': ratio,
+                                    'base': base, 'now': now, 'status': status})
+            print(f"  {size:<5} {stage:<24} {base['seconds']:9.3f} {now['seconds']:9.3f} "
+                  f"{ratio:6.2f} {base['peak_mb']:9.1f} {now['peak_mb']:9.1f}  {status or 'ok'}")
+    print(f"  {len(regressions)} regression(s) at threshold {threshold:.0%}")
+    return regressions
+
+
+def load_report(path: str) -> Dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def run_and_compare(sizes: List[str] = ('10k', '1M'),
+                    bench_dir: str = 'benchmarks',
+                    save_baseline: bool = False,
+                    threshold: float = DEFAULT_THRESHOLD,
+                    **kwargs) -> List[Dict]:
+    """
+    Benchmark, then compare with <bench_dir>/baseline.json (written
+    instead when missing or when save_baseline is set).
+
+    Returns:
+        Regressions (empty when the baseline was just written)
+    """
+    import shutil
+
+    baseline_path = Path(bench_dir) / "baseline.json"
+    latest_path = Path(bench_dir) / "latest.json"
+    report = run_benchmarks(sizes, bench_dir, str(latest_path), **kwargs)
+    if save_baseline or not baseline_path.exists():
+        shutil.copy(latest_path, baseline_path)
+        print(f"Baseline saved: {baseline_path}")
+        return []
+    return compare_to_baseline(report, load_report(str(baseline_path)), threshold)
+
+
+if __name__ == "__main__":
+    import sys
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+    # python -m src.benchmark [sizes...] [--save-baseline]
+    sizes = [a for a in sys.argv[1:] if a in SIZES] or ['10k', '1M']
+    regressions = run_and_compare(sizes, str(Path(__file__).parent.parent / "benchmarks"),
+                                  save_baseline='--save-baseline' in sys.argv)
+    sys.exit(1 if regressions else 0)
@@ -6,14 +6,65 @@ Loads and preprocesses XAUUSD data for regime detection.
 
 import pandas as pd
 import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import sys
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Dict, Iterator
 
+if __name__ == "__main__":
+    # Run as a script (python src/data_pipeline.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.tracing import traced
+
+
+# Bump when the on-disk cache layout changes
+BAR_CACHE_VERSION = 1
+
+# Bytes hashed at each end of the source file for cache invalidation
+_SIGNATURE_BLOCK = 1 << 20
+
+# Column storage per dtype policy. 'default' keeps pandas' own dtypes
+# (float64 features, int64 flags/labels); 'compact' stores features as
+# float32, 0/1 flags and regime labels as int8 and calendar fields as
+# uint8, and drops indicator intermediates once consumed. Prices stay
+# float64 under both: every indicator is computed from them.
+DTYPE_POLICIES = {
+    'default': {
+        'feature': None, 'flag': None, 'label': None, 'calendar': None,
+        'drop_intermediates': False
+    },
+    'compact': {
+        'feature': 'float32', 'flag': 'int8', 'label': 'int8', 'calendar': 'uint8',
+        'drop_intermediates': True
+    }
+}
 
-def load_mt5_csv(filepath: str) -> pd.DataFrame:
+CALENDAR_COLUMNS = ['Hour', 'DayOfWeek', 'Month']
+SESSION_COLUMNS = ['IsAsianSession', 'IsLondonSession', 'IsNYSession', 'IsOverlap']
+
+
+@traced('load')
+def load_mt5_csv(filepath: str, use_cache: bool = False,
+                 cache_dir: Optional[str] = None) -> pd.DataFrame:
     """Load MT5 exported CSV (tab-separated)"""
+    if use_cache:
+        return load_mt5_csv_cached(filepath, cache_dir)
+    
     df = pd.read_csv(filepath, sep='\t')
+    df = _normalize_mt5_columns(df)
+    
+    # Stable, so clean_data keeps the first-seen row of a duplicate Date
+    df = df.sort_values('Date', kind='stable').reset_index(drop=True)
     
+    return df
+
+
+def _normalize_mt5_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Rename MT5 <COLUMN> headers and combine Date/Time"""
     # Rename columns to standard format
     column_map = {
         '<DATE>': 'Date',
@@ -35,24 +86,205 @@ def load_mt5_csv(filepath: str) -> pd.DataFrame:
     else:
         df['Date'] = pd.to_datetime(df['Date'])
     
-    df = df.sort_values('Date').reset_index(drop=True)
+    return df
+
+
+def iter_mt5_csv(filepath: str,
+                 chunk_size: int = 100_000,
+                 reorder_window: int = 1_000) -> Iterator[pd.DataFrame]:
+    """
+    Stream an MT5 CSV as cleaned, time-ordered chunks of bars.
+    
+    Applies Date de-duplication and then the clean_data filters
+    (positive prices, High >= Low), in clean_data's order, as it goes:
+    an invalid first row for a Date still shadows later duplicates.
+    Memory stays bounded by
+    chunk_size regardless of file size. The last reorder_window rows of
+    every chunk are held back and merged with the next one, which puts
+    rows that arrive out of order across a chunk boundary back in place.
+    Rows older than anything already emitted are dropped.
+    
+    Args:
+        filepath: MT5 export path
+        chunk_size: Rows read from the CSV per step
+        reorder_window: Rows held back to absorb out-of-order arrivals
+    
+    Yields:
+        DataFrames with the same columns as load_mt5_csv
+    """
+    carry = None
+    last_emitted = None
+    late_rows = 0
+    
+    reader = pd.read_csv(filepath, sep='\t', chunksize=chunk_size)
+    for raw in reader:
+        chunk = _normalize_mt5_columns(raw)
+        
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        
+        # Stable sort keeps the first-seen row for each duplicate Date
+        chunk = chunk.sort_values('Date', kind='stable')
+        chunk = chunk.drop_duplicates(subset=['Date'])
+        
+        if last_emitted is not None:
+            late = chunk['Date'].values <= last_emitted
+            late_rows += int(late.sum())
+            chunk = chunk[~late]
+        
+        if len(chunk) <= reorder_window:
+            carry = chunk
+            continue
+        
+        split = len(chunk) - reorder_window
+        carry = chunk.iloc[split:]
+        out = chunk.iloc[:split]
+        # Invalid rows count as emitted, so their duplicates stay dropped
+        last_emitted = out['Date'].values[-1]
+        out = out[_valid_price_mask(out)]
+        if len(out):
+            yield out.reset_index(drop=True)
+    
+    if carry is not None:
+        carry = carry[_valid_price_mask(carry)]
+        if len(carry):
+            yield carry.reset_index(drop=True)
+    
+    if late_rows:
+        print(f"  Dropped {late_rows} duplicate or late rows outside reorder window")
+
+
+def _file_signature(filepath: str) -> Dict:
+    """Size, mtime and a hash of the head/tail blocks of a source file"""
+    stat = os.stat(filepath)
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        digest.update(f.read(_SIGNATURE_BLOCK))
+        if stat.st_size > 2 * _SIGNATURE_BLOCK:
+            f.seek(-_SIGNATURE_BLOCK, os.SEEK_END)
+            digest.update(f.read(_SIGNATURE_BLOCK))
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha1': digest.hexdigest()
+    }
+
+
+def get_cache_path(filepath: str, cache_dir: Optional[str] = None) -> Path:
+    """Directory holding the columnar cache for a CSV export"""
+    src = Path(filepath)
+    base = Path(cache_dir) if cache_dir else src.parent
+    return base / f"{src.stem}.barcache"
+
+
+def save_bar_cache(df: pd.DataFrame, cache_path: str, signature: Dict,
+                   price_dtype: str = 'float64'):
+    """
+    Write bars as one .npy file per column plus a meta.json.
     
+    Date is stored as int64 epoch nanoseconds, prices as float64 (or
+    float32) and integer columns (TickVolume, Volume, Spread) as int32.
+    """
+    cache_path = Path(cache_path)
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+    
+    columns = {}
+    for col in df.columns:
+        values = df[col].values
+        if col == 'Date':
+            arr = values.astype('datetime64[ns]').view('int64')
+        elif np.issubdtype(values.dtype, np.integer):
+            arr = values.astype('int32')
+        else:
+            arr = values.astype(price_dtype)
+        np.save(tmp_path / f"{col}.npy", np.ascontiguousarray(arr))
+        columns[col] = str(arr.dtype)
+    
+    meta = {
+        'version': BAR_CACHE_VERSION,
+        'source': signature,
+        'rows': len(df),
+        'columns': columns
+    }
+    with open(tmp_path / 'meta.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+    
+    # Swap in atomically so a crashed write never leaves a half cache
+    if cache_path.exists():
+        shutil.rmtree(cache_path)
+    os.replace(tmp_path, cache_path)
+
+
+def load_bar_cache(cache_path: str,
+                   signature: Optional[Dict] = None) -> Optional[pd.DataFrame]:
+    """
+    Memory-map a columnar bar cache.
+    
+    Returns None if the cache is missing, stale for the given source
+    signature, or written by a different cache version.
+    """
+    cache_path = Path(cache_path)
+    meta_path = cache_path / 'meta.json'
+    if not meta_path.exists():
+        return None
+    
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    if meta.get('version') != BAR_CACHE_VERSION:
+        return None
+    if signature is not None and meta.get('source') != signature:
+        return None
+    
+    data = {}
+    for col in meta['columns']:
+        arr = np.asarray(np.load(cache_path / f"{col}.npy", mmap_mode='r'))
+        if col == 'Date':
+            arr = arr.view('datetime64[ns]')
+        data[col] = arr
+    
+    # One Series per column: a dict of bare arrays may be consolidated
+    # into 2D blocks, which copies the mapped files into RAM
+    df = pd.DataFrame({col: pd.Series(arr, copy=False) for col, arr in data.items()},
+                      copy=False)
+    if not all(np.shares_memory(df[col].to_numpy(), arr) for col, arr in data.items()):
+        print(f"Warning: bar cache {cache_path.name} was copied into memory, not mapped")
     return df
 
 
+def load_mt5_csv_cached(filepath: str, cache_dir: Optional[str] = None,
+                        price_dtype: str = 'float64') -> pd.DataFrame:
+    """
+    Load MT5 CSV through the columnar cache.
+    
+    The first load parses the CSV and writes the cache; later loads
+    memory-map it. The cache is rebuilt whenever the source file size,
+    mtime or head/tail hash changes.
+    """
+    cache_path = get_cache_path(filepath, cache_dir)
+    signature = _file_signature(filepath)
+    
+    df = load_bar_cache(str(cache_path), signature)
+    if df is not None:
+        return df
+    
+    df = load_mt5_csv(filepath)
+    save_bar_cache(df, str(cache_path), signature, price_dtype)
+    # Return the cached layout so a miss and a hit give the same dtypes
+    del df
+    return load_bar_cache(str(cache_path), signature)
+
+
+@traced('clean')
 def clean_data(df: pd.DataFrame) -> pd.DataFrame:
     """Clean and validate price data"""
     # Remove duplicates
     df = df.drop_duplicates(subset=['Date'])
     
-    # Remove rows with zero/negative prices
-    price_cols = ['Open', 'High', 'Low', 'Close']
-    for col in price_cols:
-        if col in df.columns:
-            df = df[df[col] > 0]
-    
-    # Ensure High >= Low
-    df = df[df['High'] >= df['Low']]
+    # Remove rows with zero/negative prices, ensure High >= Low
+    df = df[_valid_price_mask(df)]
     
     # Reset index
     df = df.reset_index(drop=True)
@@ -60,23 +292,56 @@ def clean_data(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def create_time_features(df: pd.DataFrame) -> pd.DataFrame:
-    """Add time-based features"""
+def _valid_price_mask(df: pd.DataFrame) -> np.ndarray:
+    """Rows with positive prices and High >= Low"""
+    mask = np.ones(len(df), dtype=bool)
+    price_cols = ['Open', 'High', 'Low', 'Close']
+    for col in price_cols:
+        if col in df.columns:
+            mask &= df[col].values > 0
+    mask &= df['High'].values >= df['Low'].values
+    return mask
+
+
+@traced('time_features')
+def create_time_features(df: pd.DataFrame, dtype_policy='default') -> pd.DataFrame:
+    """Add time-based features (dtypes per DTYPE_POLICIES)"""
+    policy = get_dtype_policy(dtype_policy)
     df = df.copy()
     
-    df['Hour'] = df['Date'].dt.hour
-    df['DayOfWeek'] = df['Date'].dt.dayofweek
-    df['Month'] = df['Date'].dt.month
+    dates = df['Date'].dt
+    df['Hour'] = dates.hour.astype(policy['calendar'] or 'int32')
+    df['DayOfWeek'] = dates.dayofweek.astype(policy['calendar'] or 'int32')
+    df['Month'] = dates.month.astype(policy['calendar'] or 'int32')
     
     # Trading sessions (UTC times - adjust for your broker)
-    df['IsAsianSession'] = ((df['Hour'] >= 0) & (df['Hour'] < 8)).astype(int)
-    df['IsLondonSession'] = ((df['Hour'] >= 8) & (df['Hour'] < 16)).astype(int)
-    df['IsNYSession'] = ((df['Hour'] >= 13) & (df['Hour'] < 22)).astype(int)
-    df['IsOverlap'] = ((df['Hour'] >= 13) & (df['Hour'] < 16)).astype(int)  # London/NY overlap
+    flag = policy['flag'] or int
+    df['IsAsianSession'] = ((df['Hour'] >= 0) & (df['Hour'] < 8)).astype(flag)
+    df['IsLondonSession'] = ((df['Hour'] >= 8) & (df['Hour'] < 16)).astype(flag)
+    df['IsNYSession'] = ((df['Hour'] >= 13) & (df['Hour'] < 22)).astype(flag)
+    df['IsOverlap'] = ((df['Hour'] >= 13) & (df['Hour'] < 16)).astype(flag)  # London/NY overlap
     
     return df
 
 
+def get_dtype_policy(policy='default') -> Dict:
+    """Resolve a policy name, or a dict of overrides on 'default'"""
+    if isinstance(policy, dict):
+        return {**DTYPE_POLICIES['default'], **policy}
+    if policy not in DTYPE_POLICIES:
+        raise ValueError(f"Unknown dtype policy '{policy}', expected one of {list(DTYPE_POLICIES)}")
+    return DTYPE_POLICIES[policy]
+
+
+def cast_columns(df: pd.DataFrame, columns, dtype: Optional[str]) -> pd.DataFrame:
+    """Cast the listed columns present in df (no-op for dtype None)"""
+    if dtype is None:
+        return df
+    mapping = {col: dtype for col in columns if col in df.columns and df[col].dtype != dtype}
+    return df.astype(mapping) if mapping else df
+
+
+@traced('split')
 def split_data(
     df: pd.DataFrame,
     train_ratio: float = 0.7,
@@ -103,16 +368,13 @@ def split_data(
 
 if __name__ == "__main__":
     # Test the pipeline
-    import sys
-    sys.path.insert(0, str(Path(__file__).parent.parent))
-    
     csv_path = Path(__file__).parent.parent / "data" / "XAUUSD_H1.csv"
     if not csv_path.exists():
         # Try root directory
         csv_path = Path(__file__).parent.parent / "XAUUSD_H1_201501020900_202512221100.csv"
     
     if csv_path.exists():
-        df = load_mt5_csv(str(csv_path))
+        df = load_mt5_csv(str(csv_path), use_cache=True)
         df = clean_data(df)
         df = create_time_features(df)
         print(f"\nLoaded {len(df):,} records")
@@ -4,88 +4,189 @@ Export Regime Detector to ONNX
 Converts the trained model to ONNX format for use in MT5.
 """
 
+import importlib.util
 import numpy as np
 import joblib
 import json
+import sys
+import time
 from pathlib import Path
-from sklearn.ensemble import VotingClassifier
+from typing import Dict, Optional
 
-# ONNX conversion
-try:
-    from skl2onnx import convert_sklearn
-    from skl2onnx.common.data_types import FloatTensorType
-    ONNX_AVAILABLE = True
-except ImportError:
-    ONNX_AVAILABLE = False
+if __name__ == "__main__":
+    # Run as a script (python src/export_onnx.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.tracing import traced
+
+# Max |ONNX - sklearn| probability difference accepted by verify_onnx_model,
+# with sklearn fed the same float32 scaled input as the graph. Against the
+# float64 pipeline, rows within float32 rounding of a split go the other
+# way (reported as float64_max_abs_diff: up to 4.5e-3 for the exact
+# ensemble, 3e-2 for a RandomForest-only graph on XAUUSD H1)
+PARITY_TOLERANCE = 1e-5
+
+# ONNX conversion; skl2onnx itself is imported by export_to_onnx (slow import)
+ONNX_AVAILABLE = importlib.util.find_spec('skl2onnx') is not None
+if not ONNX_AVAILABLE:
     print("Warning: skl2onnx not installed. Run: pip install skl2onnx")
 
 
+@traced('export.verify')
+def verify_onnx_model(
+    onnx_path: str,
+    model,
+    scaler,
+    X_check: np.ndarray,
+    latency_runs: int = 200,
+    tolerance: float = PARITY_TOLERANCE
+) -> Optional[Dict]:
+    """
+    Check ONNX probabilities against scaler + model.predict_proba.
+    
+    The reference scales in float32 as the graph's Scaler node does, so
+    the check isolates conversion errors from input rounding.
+    Also measures single-row and batch inference latency of the
+    exported graph. The report's 'passed' is False when any probability
+    differs by more than `tolerance`. Returns None if onnxruntime is not
+    installed.
+    """
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        print("  onnxruntime not installed, skipping parity check")
+        return None
+    
+    session = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    X32 = np.ascontiguousarray(X_check, dtype=np.float32)
+    
+    onnx_proba = session.run(['probabilities'], {input_name: X32})[0]
+    scaled32 = (X32 - scaler.mean_.astype(np.float32)) * (1 / scaler.scale_).astype(np.float32)
+    sk_proba = model.predict_proba(scaled32)
+    sk_proba64 = model.predict_proba(scaler.transform(X_check))
+    
+    diff = np.abs(onnx_proba - sk_proba)
+    diff64 = np.abs(onnx_proba - sk_proba64)
+    same_class = np.mean(onnx_proba.argmax(axis=1) == sk_proba64.argmax(axis=1))
+    
+    def _latency(batch):
+        times = []
+        for _ in range(latency_runs):
+            start = time.perf_counter()
+            session.run(['probabilities'], {input_name: batch})
+            times.append(time.perf_counter() - start)
+        return np.percentile(times, [50, 99]) * 1e6
+    
+    single_p50, single_p99 = _latency(X32[:1])
+    batch_p50, _ = _latency(X32)
+    
+    report = {
+        'rows': len(X_check),
+        'max_abs_diff': float(diff.max()),
+        'mean_abs_diff': float(diff.mean()),
+        'float64_max_abs_diff': float(diff64.max()),
+        'argmax_agreement': float(same_class),
+        'tolerance': tolerance,
+        'passed': bool(diff.max() <= tolerance),
+        'latency_us_single_p50': float(single_p50),
+        'latency_us_single_p99': float(single_p99),
+        'latency_us_batch_p50': float(batch_p50)
+    }
+    
+    print(f"  Parity on {len(X_check):,} rows: max |diff| {report['max_abs_diff']:.2e} "
+          f"({report['float64_max_abs_diff']:.2e} vs float64 input), "
+          f"argmax agreement {same_class:.2%}")
+    if not report['passed']:
+        print(f"  ERROR: ONNX parity above tolerance {tolerance:.0e}")
+    print(f"  Latency: single row p50 {single_p50:.0f}us p99 {single_p99:.0f}us, "
+          f"batch of {len(X_check):,} p50 {batch_p50/1000:.1f}ms")
+    
+    return report
+
+
+@traced('export.onnx')
 def export_to_onnx(
     model_path: str,
     onnx_path: str,
-    config_path: str
+    config_path: str,
+    X_check: Optional[np.ndarray] = None,
+    regime_settings: Optional[Dict] = None
 ) -> bool:
     """
     Export sklearn model to ONNX format for MT5.
     
+    The exported graph is the whole soft-voting ensemble with the
+    StandardScaler fused in front of it: raw features in, averaged RF +
+    GB class probabilities out (output 'probabilities', no ZipMap).
+    If skl2onnx cannot convert the boosting member (HistGradientBoosting
+    fails in current skl2onnx) the graph holds scaler + RandomForest
+    only; RegimeTrees.mqh (mql5_trees) carries the full ensemble.
+    regime_config.json is written either way, with 'onnx_graph' set to
+    'ensemble', 'rf_only' or null.
+    
     Args:
         model_path: Path to saved .joblib model
         onnx_path: Output path for .onnx file
         config_path: Output path for config .json file
+        X_check: Optional held-out raw feature rows for the parity and
+            latency check
+        regime_settings: Per-regime trading settings for the EA
+            (default: backtest.DEFAULT_REGIME_SETTINGS; the script reads
+            config.yaml's `trading:` section)
     
     Returns:
-        True if successful
+        True if an ONNX graph was written and passed the parity check
     """
-    if not ONNX_AVAILABLE:
-        print("ERROR: skl2onnx not available")
-        return False
+    if regime_settings is None:
+        from src.backtest import DEFAULT_REGIME_SETTINGS
+        regime_settings = DEFAULT_REGIME_SETTINGS
     
     # Load model
     save_dict = joblib.load(model_path)
     model = save_dict['model']
     scaler = save_dict['scaler']
     feature_columns = save_dict['feature_columns']
+    # Models saved before backends existed used exact GradientBoosting
+    backend = save_dict.get('backend', 'exact')
     
     n_features = len(feature_columns)
     
-    print(f"Exporting model with {n_features} features...")
+    print(f"Exporting model with {n_features} features ({backend} boosting backend)...")
     
-    # For ensemble, we need to export the underlying estimators
-    # MT5 ONNX support is limited, so we'll export the RandomForest component
-    if isinstance(model, VotingClassifier):
-        # Get the Random Forest (more ONNX-compatible)
-        rf_model = model.named_estimators_['rf']
-        export_model = rf_model
-        print("  Using RandomForest component for ONNX export")
-    else:
-        export_model = model
+    # Scaler -> RF + GB -> probability averaging, all in one graph, so the
+    # EA runs exactly the model we evaluate and needs no ScaleFeatures pass.
+    # flatten_transform only affects transform(), which skl2onnx rejects.
+    if hasattr(model, 'flatten_transform'):
+        model.flatten_transform = False
+    candidates = [('ensemble', model)]
+    if hasattr(model, 'named_estimators_'):
+        candidates.append(('rf_only', model.named_estimators_['rf']))
     
-    # Define input type
-    initial_type = [('float_input', FloatTensorType([None, n_features]))]
+    graph, exported = None, None
+    if not ONNX_AVAILABLE:
+        print("  ERROR: skl2onnx not available, no ONNX graph written")
+    for name, candidate in candidates if ONNX_AVAILABLE else []:
+        if _convert(scaler, candidate, n_features, onnx_path):
+            graph, exported = name, candidate
+            break
+    if graph == 'rf_only':
+        print("  ONNX graph holds scaler + RandomForest only; "
+              "use RegimeTrees.mqh for the full ensemble")
     
-    # Convert to ONNX
-    try:
-        onnx_model = convert_sklearn(
-            export_model,
-            initial_types=initial_type,
-            target_opset=12  # MT5 compatible opset
-        )
-        
-        # Save ONNX model
-        with open(onnx_path, "wb") as f:
-            f.write(onnx_model.SerializeToString())
-        print(f"  ONNX model saved: {onnx_path}")
-        
-    except Exception as e:
-        print(f"  ONNX conversion failed: {e}")
-        print("  Falling back to joblib-only export")
-        return False
+    validation = None
+    if graph is not None and X_check is not None:
+        validation = verify_onnx_model(onnx_path, exported, scaler, X_check)
     
     # Save configuration for MT5
     config = {
-        'model_file': Path(onnx_path).name,
+        'model_file': Path(onnx_path).name if graph else None,
+        'onnx_graph': graph,
+        'backend': backend,
         'feature_columns': feature_columns,
         'n_features': n_features,
+        # Scaling happens inside the ONNX graph; kept for reference
+        'scaler_fused': True,
         'scaler': {
             'mean': scaler.mean_.tolist(),
             'scale': scaler.scale_.tolist()
@@ -96,37 +197,46 @@ def export_to_onnx(
             2: 'VOLATILE'
         },
         'regime_settings': {
-            'RANGING': {
-                'atr_sl_mult': 1.0,
-                'atr_tp_mult': 1.5,
-                'trailing_start': 8,
-                'min_confidence': 60,
-                'description': 'Mean-reversion, tight stops'
-            },
-            'TRENDING': {
-                'atr_sl_mult': 1.5,
-                'atr_tp_mult': 2.5,
-                'trailing_start': 15,
-                'min_confidence': 55,
-                'description': 'Trend following, let profits run'
-            },
-            'VOLATILE': {
-                'atr_sl_mult': 2.0,
-                'atr_tp_mult': 2.0,
-                'trailing_start': 20,
-                'min_confidence': 70,
-                'description': 'High volatility, be cautious'
-            }
+            name: dict(values) for name, values in regime_settings.items()
         }
     }
+    if validation is not None:
+        config['validation'] = validation
     
     with open(config_path, 'w') as f:
         json.dump(config, f, indent=2)
     print(f"  Config saved: {config_path}")
     
+    return graph is not None and (validation is None or validation['passed'])
+
+
+def _convert(scaler, model, n_features: int, onnx_path: str) -> bool:
+    """Write scaler + model as one ONNX graph; one error line on failure"""
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+    from sklearn.pipeline import Pipeline
+    
+    try:
+        onnx_model = convert_sklearn(
+            Pipeline([('scaler', scaler), ('model', model)]),
+            initial_types=[('float_input', FloatTensorType([None, n_features]))],
+            target_opset={'': 12, 'ai.onnx.ml': 3},  # MT5 compatible opset
+            options={id(model): {'zipmap': False}}
+        )
+    except Exception as e:
+        # skl2onnx errors embed whole node attribute dumps
+        message = str(e).splitlines()[0] if str(e) else ''
+        print(f"  ONNX conversion of {type(model).__name__} failed: "
+              f"{type(e).__name__}: {message[:160]}")
+        return False
+    
+    with open(onnx_path, "wb") as f:
+        f.write(onnx_model.SerializeToString())
+    print(f"  ONNX model saved: {onnx_path}")
     return True
 
 
+@traced('export.mqh')
 def create_mt5_include(config_path: str, output_path: str):
     """
     Create MQL5 include file with model configuration.
@@ -146,6 +256,8 @@ def create_mt5_include(config_path: str, output_path: str):
 
 // Model configuration
 #define REGIME_MODEL_FEATURES {config['n_features']}
+// 1 = the ONNX graph scales its own input: feed raw features, skip ScaleFeatures
+#define REGIME_SCALER_FUSED {int(config.get('scaler_fused', False))}
 #define REGIME_RANGING   0
 #define REGIME_TRENDING  1
 #define REGIME_VOLATILE  2
@@ -173,7 +285,7 @@ RegimeSettings g_regime_settings[3] = {{
    {{ {config['regime_settings']['VOLATILE']['atr_sl_mult']}, {config['regime_settings']['VOLATILE']['atr_tp_mult']}, {config['regime_settings']['VOLATILE']['trailing_start']}, {config['regime_settings']['VOLATILE']['min_confidence']} }}   // VOLATILE
 }};
 
-// Scale features using saved scaler parameters
+// Scale features using saved scaler parameters (only for non-fused models)
 void ScaleFeatures(double &features[], double &scaled[]) {{
    ArrayResize(scaled, REGIME_MODEL_FEATURES);
    for(int i = 0; i < REGIME_MODEL_FEATURES; i++) {{
@@ -199,23 +311,32 @@ string GetRegimeName(int regime) {{
 
 
 if __name__ == "__main__":
-    from pathlib import Path
+    from src.mql5_trees import create_mt5_trees_include
+    from src.backtest import load_regime_settings
     
-    model_dir = Path(__file__).parent.parent / "models"
+    root = Path(__file__).parent.parent
+    model_dir = root / "models"
     model_path = model_dir / "regime_detector.joblib"
     
     if model_path.exists():
         export_to_onnx(
             str(model_path),
             str(model_dir / "regime_detector.onnx"),
-            str(model_dir / "regime_config.json")
+            str(model_dir / "regime_config.json"),
+            regime_settings=load_regime_settings(str(root / "config.yaml"))
         )
         
         create_mt5_include(
             str(model_dir / "regime_config.json"),
             str(model_dir / "RegimeModelConfig.mqh")
         )
+        
+        # ONNX-free path: the same ensemble as native MQL5 functions
+        create_mt5_trees_include(
+            str(model_path),
+            str(model_dir / "RegimeTrees.mqh")
+        )
     else:
         print(f"Model not found: {model_path}")
-        print("Run train_regime.py first to train the model.")
+        print("Run `python -m src train` first to train the model.")
 
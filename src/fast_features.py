@@ -0,0 +1,345 @@
+"""
+Fused NumPy Feature Engine
+==========================
+Single-pass alternative to the chained add_*_features functions.
+
+Computes only the columns in get_feature_columns() (plus regime labels)
+from contiguous NumPy arrays. True range, returns and the shared moving
+averages are computed once; no intermediate DataFrames are built.
+
+Rolling windows are reduced directly over strided views, so results
+match the pandas path to floating-point rounding (~1e-12 relative) at any
+history length, and the rows kept are exactly the rows prepare_features()
+keeps after its dropna().
+"""
+
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional
+from scipy.signal import lfilter
+
+if __name__ == "__main__":
+    # Run as a script (python src/fast_features.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.features import get_feature_columns
+from src.tracing import traced
+
+
+# Longest warm-up of any column prepare_features() computes (SMA_100).
+# Rows before it are dropped by the pandas path's dropna().
+PANDAS_WARMUP = 99
+
+TIME_COLUMNS = [
+    'Hour', 'DayOfWeek',
+    'IsAsianSession', 'IsLondonSession', 'IsNYSession', 'IsOverlap'
+]
+
+LABEL_COLUMNS = ['FutureReturn', 'FutureReturnAbs', 'FutureVolRatio', 'Regime']
+
+
+def _shift(x: np.ndarray, n: int) -> np.ndarray:
+    """pandas-style shift (positive = lag) with NaN fill"""
+    out = np.full(len(x), np.nan)
+    if n > 0:
+        out[n:] = x[:-n]
+    elif n < 0:
+        out[:n] = x[-n:]
+    else:
+        out[:] = x
+    return out
+
+
+def _windows(x: np.ndarray, p: int) -> np.ndarray:
+    """Strided (n - p + 1, p) view of trailing windows, no copy"""
+    return np.lib.stride_tricks.sliding_window_view(x, p)
+
+
+def _rolling_mean(x: np.ndarray, p: int) -> np.ndarray:
+    """
+    Rolling mean with pandas min_periods=p semantics.
+
+    Sums each window directly rather than differencing a running prefix
+    sum, so rounding error stays ~p*eps instead of growing with history
+    length. NaN/inf in a window propagate exactly as in pandas.
+    """
+    out = np.full(len(x), np.nan)
+    if len(x) < p:
+        return out
+    out[p - 1:] = _windows(x, p).sum(axis=1) / p
+    return out
+
+
+def _rolling_std(x: np.ndarray, p: int, block: int = 1 << 16) -> np.ndarray:
+    """Rolling sample std (ddof=1), two-pass per window, in row blocks"""
+    out = np.full(len(x), np.nan)
+    if len(x) < p:
+        return out
+    windows = _windows(x, p)
+    for start in range(0, len(windows), block):
+        w = windows[start:start + block]
+        centred = w - w.mean(axis=1)[:, None]
+        var = (centred * centred).sum(axis=1) / (p - 1)
+        out[p - 1 + start:p - 1 + start + len(w)] = np.sqrt(var)
+    return out
+
+
+def _rolling_extreme(x: np.ndarray, p: int, fn) -> np.ndarray:
+    """Rolling min/max over strided windows (no window copies)"""
+    out = np.full(len(x), np.nan)
+    if len(x) < p:
+        return out
+    out[p - 1:] = fn(_windows(x, p), axis=1)
+    return out
+
+
+def _ewm(x: np.ndarray, span: int) -> np.ndarray:
+    """EWM mean with adjust=False, seeded with the first value"""
+    alpha = 2.0 / (span + 1.0)
+    y, _ = lfilter([alpha], [1.0, alpha - 1.0], x, zi=[(1.0 - alpha) * x[0]])
+    return y
+
+
+def _nan_if_zero(x: np.ndarray) -> np.ndarray:
+    """Equivalent of Series.replace(0, np.nan)"""
+    return np.where(x == 0, np.nan, x)
+
+
+@traced('features.fast')
+def compute_features(df: pd.DataFrame,
+                     add_labels: bool = True,
+                     lookforward: int = 10,
+                     trend_threshold: float = 0.005,
+                     vol_threshold: float = 1.5) -> Dict[str, np.ndarray]:
+    """
+    Compute feature (and label) columns as NumPy arrays.
+
+    Returns a dict of full-length arrays plus a boolean '_valid' entry
+    marking the rows prepare_features() would keep.
+    """
+    o = np.ascontiguousarray(df['Open'].values, dtype=np.float64)
+    h = np.ascontiguousarray(df['High'].values, dtype=np.float64)
+    l = np.ascontiguousarray(df['Low'].values, dtype=np.float64)
+    c = np.ascontiguousarray(df['Close'].values, dtype=np.float64)
+    n = len(c)
+
+    out = {}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Shared price primitives
+        prev_c = _shift(c, 1)
+        ret = c / prev_c - 1.0
+        ret_abs = np.abs(ret)
+        rng = h - l
+        tr = np.fmax(np.fmax(rng, np.abs(h - prev_c)), np.abs(l - prev_c))
+
+        out['RangePercent'] = rng / c
+        out['BodyPercent'] = np.abs(c - o) / _nan_if_zero(rng)
+
+        # Volatility
+        atr = {p: _rolling_mean(tr, p) for p in (5, 10, 14, 20)}
+        vol = {p: _rolling_std(ret, p) for p in (5, 10, 20)}
+        for p in (5, 10, 20):
+            out[f'ATR_{p}_Pct'] = atr[p] / c
+            out[f'Volatility_{p}'] = vol[p]
+        out['VolatilityRatio'] = vol[5] / _nan_if_zero(vol[20])
+        out['ATRRatio'] = atr[5] / _nan_if_zero(atr[20])
+
+        # Trend
+        sma20 = _rolling_mean(c, 20)
+        sma50 = _rolling_mean(c, 50)
+        out['PriceVsSMA20'] = (c - sma20) / sma20
+        out['PriceVsSMA50'] = (c - sma50) / sma50
+        sma20_lag = _shift(sma20, 5)
+        sma50_lag = _shift(sma50, 10)
+        out['SMA20_Slope'] = (sma20 - sma20_lag) / sma20_lag
+        out['SMA50_Slope'] = (sma50 - sma50_lag) / sma50_lag
+
+        ema = {p: _ewm(c, p) for p in (5, 10, 12, 20, 26, 50)}
+        out['MA_Alignment'] = (
+            (ema[5] > ema[10]).astype(np.int64) +
+            (ema[10] > ema[20]).astype(np.int64) +
+            (ema[20] > ema[50]).astype(np.int64)
+        ) - 1.5
+
+        plus_dm = h - _shift(h, 1)
+        minus_dm = _shift(l, 1) - l
+        plus_dm[plus_dm < 0] = 0
+        minus_dm[minus_dm < 0] = 0
+        plus_di = 100 * (_rolling_mean(plus_dm, 14) / atr[14])
+        minus_di = 100 * (_rolling_mean(minus_dm, 14) / atr[14])
+        dx = 100 * np.abs(plus_di - minus_di) / _nan_if_zero(plus_di + minus_di)
+        out['ADX'] = _rolling_mean(dx, 14)
+        out['DI_Diff'] = plus_di - minus_di
+
+        # Momentum
+        delta = c - prev_c
+        gain = _rolling_mean(np.where(delta > 0, delta, 0.0), 14)
+        loss = _rolling_mean(-np.where(delta < 0, delta, 0.0), 14)
+        rsi = 100 - (100 / (1 + gain / _nan_if_zero(loss)))
+        out['RSI'] = rsi
+        out['RSI_Extreme'] = ((rsi < 30) | (rsi > 70)).astype(np.int64)
+
+        macd = ema[12] - ema[26]
+        out['MACD_Hist'] = macd - _ewm(macd, 9)
+
+        low14 = _rolling_extreme(l, 14, np.min)
+        high14 = _rolling_extreme(h, 14, np.max)
+        stoch_k = 100 * (c - low14) / _nan_if_zero(high14 - low14)
+        out['Stoch_K'] = stoch_k
+
+        for p in (5, 10, 20):
+            lag = _shift(c, p)
+            out[f'ROC_{p}'] = (c - lag) / lag
+
+        # Time features (passed through if create_time_features ran)
+        if 'Hour' in df.columns:
+            for col in TIME_COLUMNS:
+                out[col] = df[col].values
+        else:
+            dates = pd.DatetimeIndex(df['Date'])
+            hour = dates.hour.values
+            out['Hour'] = hour
+            out['DayOfWeek'] = dates.dayofweek.values
+            out['IsAsianSession'] = ((hour >= 0) & (hour < 8)).astype(np.int64)
+            out['IsLondonSession'] = ((hour >= 8) & (hour < 16)).astype(np.int64)
+            out['IsNYSession'] = ((hour >= 13) & (hour < 22)).astype(np.int64)
+            out['IsOverlap'] = ((hour >= 13) & (hour < 16)).astype(np.int64)
+
+        # Rows the pandas path keeps: every computed column non-NaN,
+        # including intermediates it never returns to the model
+        valid = np.ones(n, dtype=bool)
+        valid[:min(PANDAS_WARMUP, n)] = False
+        for col in get_feature_columns():
+            if out[col].dtype.kind == 'f':
+                valid &= ~np.isnan(out[col])
+        # Stoch_D = 3-bar mean of Stoch_K
+        valid &= ~np.isnan(_rolling_mean(stoch_k, 3))
+
+        if add_labels:
+            future_return = _shift(c, -lookforward) / c - 1
+            future_return_abs = np.abs(future_return)
+            future_vol = _shift(_rolling_mean(ret_abs, lookforward), -lookforward)
+            avg_vol = _rolling_mean(ret_abs, 50)
+            future_vol_ratio = future_vol / _nan_if_zero(avg_vol)
+
+            conditions = [
+                (future_return_abs > trend_threshold) & (future_vol_ratio < vol_threshold),
+                (future_vol_ratio >= vol_threshold),
+            ]
+            out['FutureReturn'] = future_return
+            out['FutureReturnAbs'] = future_return_abs
+            out['FutureVolRatio'] = future_vol_ratio
+            out['Regime'] = np.select(conditions, [1, 2], default=0)
+
+            valid &= ~np.isnan(future_return) & ~np.isnan(future_vol_ratio)
+
+    out['_valid'] = valid
+    return out
+
+
+def prepare_features_fast(df: pd.DataFrame, add_labels: bool = True,
+                          columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Drop-in replacement for prepare_features() restricted to model columns.
+
+    Returns the input columns plus get_feature_columns() (and label
+    columns), over the same rows the pandas path keeps.
+    """
+    print("Adding features (fused engine)...")
+
+    arrays = compute_features(df, add_labels=add_labels)
+    valid = arrays.pop('_valid')
+
+    if columns is None:
+        columns = get_feature_columns() + (LABEL_COLUMNS if add_labels else [])
+
+    data = {col: df[col].values[valid] for col in df.columns if col not in arrays}
+    for col in columns:
+        data[col] = arrays[col][valid]
+
+    result = pd.DataFrame(data)
+    print(f"  Dropped {len(df) - len(result)} rows with NaN")
+    return result
+
+
+def benchmark_feature_engines(df: pd.DataFrame, repeats: int = 3) -> Dict:
+    """
+    Time and trace peak memory of prepare_features vs prepare_features_fast.
+
+    Also checks both paths keep the same rows and agree on every model
+    column.
+    """
+    from src.features import prepare_features
+    import contextlib
+    import io
+
+    def _measure(fn):
+        best = float('inf')
+        for _ in range(repeats):
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                result = fn(df)
+                best = min(best, time.perf_counter() - start)
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn(df)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, best, peak
+
+    ref, ref_time, ref_peak = _measure(prepare_features)
+    fast, fast_time, fast_peak = _measure(prepare_features_fast)
+
+    cols = get_feature_columns() + LABEL_COLUMNS
+    same_rows = len(ref) == len(fast) and bool((ref['Date'].values == fast['Date'].values).all())
+    max_rel_err = 0.0
+    if same_rows:
+        for col in cols:
+            a = ref[col].values.astype(np.float64)
+            b = fast[col].values.astype(np.float64)
+            finite = np.isfinite(a) & np.isfinite(b)
+            if not finite.any():
+                continue
+            # Error relative to the column's scale, not to values near zero
+            scale = max(float(np.abs(a[finite]).max()), 1e-300)
+            err = float(np.abs(a[finite] - b[finite]).max()) / scale
+            max_rel_err = max(max_rel_err, err)
+
+    results = {
+        'rows': len(df),
+        'pandas_seconds': ref_time,
+        'fused_seconds': fast_time,
+        'speedup': ref_time / fast_time,
+        'pandas_peak_mb': ref_peak / 1e6,
+        'fused_peak_mb': fast_peak / 1e6,
+        'same_rows': same_rows,
+        'max_rel_error': max_rel_err
+    }
+
+    print(f"Feature engine benchmark ({len(df):,} bars):")
+    print(f"  pandas: {ref_time*1000:8.1f} ms  peak {ref_peak/1e6:8.1f} MB")
+    print(f"  fused:  {fast_time*1000:8.1f} ms  peak {fast_peak/1e6:8.1f} MB")
+    print(f"  Speedup: {results['speedup']:.1f}x, same rows: {same_rows}, "
+          f"max rel error: {max_rel_err:.2e}")
+
+    return results
+
+
+if __name__ == "__main__":
+    # Compare against the pandas path on the full history
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+
+    csv_path = Path(__file__).parent.parent / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if csv_path.exists():
+        df = load_mt5_csv(str(csv_path), use_cache=True)
+        df = clean_data(df)
+        df = create_time_features(df)
+        benchmark_feature_engines(df)
+    else:
+        print(f"CSV not found: {csv_path}")
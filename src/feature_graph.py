@@ -0,0 +1,268 @@
+"""
+Demand-Driven Feature Graph
+===========================
+Features declared as named nodes with explicit inputs.
+
+Requesting a column list resolves only the ancestors those columns need,
+evaluates each shared sub-result (true range, moving averages, EMAs) once
+and skips everything else. Ablation runs over the config.yaml feature
+groups then cost only what the selected groups use.
+
+Any column already present on the input frame (OHLC, Date, or time
+features from create_time_features) is used as a source node directly.
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+if __name__ == "__main__":
+    # Run as a script (python src/feature_graph.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.fast_features import (
+    _shift, _rolling_mean, _rolling_std, _rolling_extreme, _ewm, _nan_if_zero
+)
+
+
+class FeatureGraph:
+    """Registry of feature nodes and their dependencies"""
+
+    def __init__(self):
+        self.nodes: Dict[str, Tuple[List[str], Callable]] = {}
+
+    def add(self, name: str, inputs: List[str], fn: Callable):
+        """Register node `name` computed as fn(*inputs)"""
+        if name in self.nodes:
+            raise ValueError(f"Feature node already registered: {name}")
+        self.nodes[name] = (list(inputs), fn)
+
+    def node(self, name: str, inputs: List[str]) -> Callable:
+        """Decorator form of add()"""
+        def register(fn):
+            self.add(name, inputs, fn)
+            return fn
+        return register
+
+    def resolve(self, columns: List[str], sources: Optional[List[str]] = None) -> List[str]:
+        """
+        Topologically ordered list of nodes needed for `columns`.
+
+        Names in `sources` are treated as already available and are not
+        expanded.
+        """
+        sources = set(sources or [])
+        order = []
+        state = {}  # name -> 'visiting' | 'done'
+
+        def visit(name):
+            if name in sources or state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f"Cycle in feature graph at: {name}")
+            if name not in self.nodes:
+                raise KeyError(f"Unknown feature: {name}")
+            state[name] = 'visiting'
+            for dep in self.nodes[name][0]:
+                visit(dep)
+            state[name] = 'done'
+            order.append(name)
+
+        for col in columns:
+            visit(col)
+        return order
+
+    def compute(self, df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+        """
+        Evaluate only what `columns` needs.
+
+        Returns a frame with the requested columns over all input rows
+        (no NaN dropping).
+        """
+        sources = list(df.columns)
+        order = self.resolve(columns, sources)
+
+        # Remaining consumers per node, so intermediates are freed as soon
+        # as their last dependent has run
+        uses = {}
+        for name in order:
+            for dep in self.nodes[name][0]:
+                uses[dep] = uses.get(dep, 0) + 1
+        wanted = set(columns)
+
+        values = {}
+        for name in order:
+            inputs, fn = self.nodes[name]
+            args = [values[i] if i in values else df[i].values for i in inputs]
+            values[name] = fn(*args)
+            for dep in inputs:
+                uses[dep] -= 1
+                if uses[dep] == 0 and dep in values and dep not in wanted:
+                    del values[dep]
+
+        data = {col: values[col] if col in values else df[col].values for col in columns}
+        return pd.DataFrame(data, index=df.index)
+
+
+def _ratio(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return a / b
+
+
+def build_default_graph() -> FeatureGraph:
+    """Graph of every column produced by prepare_features()"""
+    g = FeatureGraph()
+
+    # Shared primitives
+    g.add('PrevClose', ['Close'], lambda c: _shift(c, 1))
+    g.add('Return', ['Close', 'PrevClose'], lambda c, pc: _ratio(c, pc) - 1.0)
+    g.add('Return_Abs', ['Return'], np.abs)
+    g.add('LogReturn', ['Close', 'PrevClose'], lambda c, pc: np.log(_ratio(c, pc)))
+    g.add('Range', ['High', 'Low'], lambda h, l: h - l)
+    g.add('TR', ['High', 'Low', 'PrevClose', 'Range'],
+          lambda h, l, pc, r: np.fmax(np.fmax(r, np.abs(h - pc)), np.abs(l - pc)))
+
+    # Price
+    g.add('RangePercent', ['Range', 'Close'], _ratio)
+    g.add('Body', ['Open', 'Close'], lambda o, c: np.abs(c - o))
+    g.add('BodyPercent', ['Body', 'Range'], lambda b, r: _ratio(b, _nan_if_zero(r)))
+    g.add('UpperWick', ['High', 'Open', 'Close'], lambda h, o, c: h - np.maximum(o, c))
+    g.add('LowerWick', ['Low', 'Open', 'Close'], lambda l, o, c: np.minimum(o, c) - l)
+
+    # Volatility
+    for p in (5, 10, 14, 20, 50):
+        g.add(f'ATR_{p}', ['TR'], lambda tr, p=p: _rolling_mean(tr, p))
+    for p in (5, 10, 20, 50):
+        g.add(f'ATR_{p}_Pct', [f'ATR_{p}', 'Close'], _ratio)
+        g.add(f'Volatility_{p}', ['Return'], lambda r, p=p: _rolling_std(r, p))
+        g.add(f'RangeVol_{p}', ['Range'], lambda r, p=p: _rolling_std(r, p))
+    g.add('VolatilityRatio', ['Volatility_5', 'Volatility_20'],
+          lambda a, b: _ratio(a, _nan_if_zero(b)))
+    g.add('ATRRatio', ['ATR_5', 'ATR_20'], lambda a, b: _ratio(a, _nan_if_zero(b)))
+
+    # Trend
+    for p in (5, 10, 20, 50, 100):
+        g.add(f'SMA_{p}', ['Close'], lambda c, p=p: _rolling_mean(c, p))
+    for p in (5, 10, 12, 20, 26, 50, 100):
+        g.add(f'EMA_{p}', ['Close'], lambda c, p=p: _ewm(c, p))
+    g.add('PriceVsSMA20', ['Close', 'SMA_20'], lambda c, s: _ratio(c - s, s))
+    g.add('PriceVsSMA50', ['Close', 'SMA_50'], lambda c, s: _ratio(c - s, s))
+    g.add('SMA20_Slope', ['SMA_20'], lambda s: _ratio(s - _shift(s, 5), _shift(s, 5)))
+    g.add('SMA50_Slope', ['SMA_50'], lambda s: _ratio(s - _shift(s, 10), _shift(s, 10)))
+    g.add('MA_Alignment', ['EMA_5', 'EMA_10', 'EMA_20', 'EMA_50'],
+          lambda e5, e10, e20, e50: (
+              (e5 > e10).astype(np.int64) +
+              (e10 > e20).astype(np.int64) +
+              (e20 > e50).astype(np.int64)
+          ) - 1.5)
+
+    def _dm(x, sign):
+        dm = sign * (x - _shift(x, 1))
+        dm[dm < 0] = 0
+        return dm
+
+    g.add('PlusDM', ['High'], lambda h: _dm(h, 1))
+    g.add('MinusDM', ['Low'], lambda l: _dm(l, -1))
+    g.add('PlusDI', ['PlusDM', 'ATR_14'], lambda dm, atr: 100 * _ratio(_rolling_mean(dm, 14), atr))
+    g.add('MinusDI', ['MinusDM', 'ATR_14'], lambda dm, atr: 100 * _ratio(_rolling_mean(dm, 14), atr))
+    g.add('ADX', ['PlusDI', 'MinusDI'],
+          lambda pdi, mdi: _rolling_mean(
+              100 * _ratio(np.abs(pdi - mdi), _nan_if_zero(pdi + mdi)), 14))
+    g.add('DI_Diff', ['PlusDI', 'MinusDI'], lambda pdi, mdi: pdi - mdi)
+
+    # Momentum
+    g.add('Delta', ['Close', 'PrevClose'], lambda c, pc: c - pc)
+    g.add('RSI', ['Delta'], lambda d: 100 - _ratio(100, 1 + _ratio(
+        _rolling_mean(np.where(d > 0, d, 0.0), 14),
+        _nan_if_zero(_rolling_mean(-np.where(d < 0, d, 0.0), 14)))))
+    g.add('RSI_Extreme', ['RSI'], lambda r: ((r < 30) | (r > 70)).astype(np.int64))
+    g.add('MACD', ['EMA_12', 'EMA_26'], lambda a, b: a - b)
+    g.add('MACD_Signal', ['MACD'], lambda m: _ewm(m, 9))
+    g.add('MACD_Hist', ['MACD', 'MACD_Signal'], lambda m, s: m - s)
+    g.add('Low14', ['Low'], lambda l: _rolling_extreme(l, 14, np.min))
+    g.add('High14', ['High'], lambda h: _rolling_extreme(h, 14, np.max))
+    g.add('Stoch_K', ['Close', 'Low14', 'High14'],
+          lambda c, lo, hi: 100 * _ratio(c - lo, _nan_if_zero(hi - lo)))
+    g.add('Stoch_D', ['Stoch_K'], lambda k: _rolling_mean(k, 3))
+    for p in (5, 10, 20):
+        g.add(f'ROC_{p}', ['Close'], lambda c, p=p: _ratio(c - _shift(c, p), _shift(c, p)))
+
+    # Time (only used when create_time_features has not run)
+    g.add('Hour', ['Date'], lambda d: pd.DatetimeIndex(d).hour.values)
+    g.add('DayOfWeek', ['Date'], lambda d: pd.DatetimeIndex(d).dayofweek.values)
+    g.add('IsAsianSession', ['Hour'], lambda h: ((h >= 0) & (h < 8)).astype(np.int64))
+    g.add('IsLondonSession', ['Hour'], lambda h: ((h >= 8) & (h < 16)).astype(np.int64))
+    g.add('IsNYSession', ['Hour'], lambda h: ((h >= 13) & (h < 22)).astype(np.int64))
+    g.add('IsOverlap', ['Hour'], lambda h: ((h >= 13) & (h < 16)).astype(np.int64))
+
+    return g
+
+
+def compute_feature_groups(df: pd.DataFrame,
+                           groups: Dict[str, List[str]],
+                           include: Optional[List[str]] = None,
+                           graph: Optional[FeatureGraph] = None) -> pd.DataFrame:
+    """
+    Compute the union of columns for the selected feature groups.
+
+    Args:
+        df: Cleaned bars (optionally with time features)
+        groups: Mapping like the `features:` section of config.yaml
+        include: Group names to use (default: all)
+        graph: Feature graph (default: build_default_graph())
+    """
+    graph = graph or build_default_graph()
+    columns = []
+    for name in include or list(groups):
+        for col in groups[name]:
+            if col not in columns:
+                columns.append(col)
+    return graph.compute(df, columns)
+
+
+def ablation_timings(df: pd.DataFrame,
+                     groups: Dict[str, List[str]]) -> Dict[str, Dict]:
+    """Nodes evaluated and compute time when dropping each group in turn"""
+    graph = build_default_graph()
+    results = {}
+    for dropped in [None] + list(groups):
+        include = [g for g in groups if g != dropped]
+        columns = [c for g in include for c in groups[g]]
+        start = time.perf_counter()
+        compute_feature_groups(df, groups, include, graph)
+        results[dropped or 'all'] = {
+            'nodes': len(graph.resolve(columns, list(df.columns))),
+            'seconds': time.perf_counter() - start
+        }
+    print("Feature group ablation:")
+    for name, r in results.items():
+        label = 'none' if name == 'all' else name
+        print(f"  dropped {label:<12} {r['nodes']:3d} nodes  {r['seconds']*1000:8.1f} ms")
+    return results
+
+
+def load_feature_groups(config_path: str) -> Dict[str, List[str]]:
+    """Read the `features:` groups from config.yaml"""
+    import yaml
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f)
+    return config['features']
+
+
+if __name__ == "__main__":
+    # Ablation over the config feature groups
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+
+    root = Path(__file__).parent.parent
+    csv_path = root / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if csv_path.exists():
+        df = load_mt5_csv(str(csv_path), use_cache=True)
+        df = clean_data(df)
+        df = create_time_features(df)
+        ablation_timings(df, load_feature_groups(str(root / "config.yaml")))
+    else:
+        print(f"CSV not found: {csv_path}")
@@ -0,0 +1,374 @@
+"""
+Feature Store
+=============
+Content-addressed on-disk cache for feature matrices and regime labels.
+
+Entries are keyed by a hash of the input bars, FEATURE_CODE_VERSION and
+the parameters that affect the output:
+- features: `periods` (add_volatility_features)
+- labels:   `lookforward`, `trend_threshold`, `vol_threshold`
+
+Features and labels are stored separately, so changing only the labeling
+thresholds reuses the stored features (a partial hit). Columns are kept
+one .npy per column and memory-mapped on load, so requesting a column
+subset only reads those columns. When new bars are appended to the CSV,
+the stored entry is extended by recomputing just the tail. Total size is
+bounded with least-recently-used eviction.
+
+`python -m src features`, batch_pipeline and the hyperparam_search
+script read their feature columns through the store, so repeat runs on
+the same bars skip the feature computation.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+if __name__ == "__main__":
+    # Run as a script (python src/feature_store.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.features import (
+    add_price_features, add_volatility_features, add_trend_features,
+    add_momentum_features, add_regime_labels, get_feature_columns
+)
+
+
+# Bump whenever features.py changes what it computes
+FEATURE_CODE_VERSION = 1
+
+DEFAULT_PERIODS = [5, 10, 20, 50]
+
+LABEL_COLUMNS = ['FutureReturn', 'FutureReturnAbs', 'FutureVolRatio', 'Regime']
+
+# Bars recomputed before the stored end when extending an entry. EMAs are
+# seeded from the first bar, so the context must be long enough for them
+# to converge (span 100 decays by ~1e-17 over 2000 bars).
+FEATURE_CONTEXT_BARS = 2000
+
+_KEY_COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close']
+
+
+def hash_bars(df: pd.DataFrame, n_rows: Optional[int] = None) -> str:
+    """SHA1 over Date and OHLC of the first n_rows bars"""
+    n_rows = len(df) if n_rows is None else n_rows
+    digest = hashlib.sha1()
+    for col in _KEY_COLUMNS:
+        values = df[col].values[:n_rows]
+        if col == 'Date':
+            values = values.astype('datetime64[ns]').view('int64')
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+
+def _params_key(kind: str, params: Dict) -> str:
+    blob = json.dumps({'kind': kind, 'version': FEATURE_CODE_VERSION, 'params': params},
+                      sort_keys=True)
+    return hashlib.sha1(blob.encode()).hexdigest()[:16]
+
+
+def _compute_feature_columns(df: pd.DataFrame, periods: List[int]) -> Dict[str, np.ndarray]:
+    """Full-length feature columns from the pandas pipeline"""
+    out = add_price_features(df)
+    out = add_volatility_features(out, periods)
+    out = add_trend_features(out)
+    out = add_momentum_features(out)
+    new_cols = [c for c in out.columns if c not in df.columns]
+    return {c: out[c].values for c in new_cols}
+
+
+def _compute_label_columns(df: pd.DataFrame, lookforward: int,
+                           trend_threshold: float,
+                           vol_threshold: float) -> Dict[str, np.ndarray]:
+    """Full-length label columns from add_regime_labels"""
+    base = pd.DataFrame({'Close': df['Close'].values})
+    base['Return_Abs'] = base['Close'].pct_change().abs()
+    out = add_regime_labels(base, lookforward, trend_threshold, vol_threshold)
+    return {c: out[c].values for c in LABEL_COLUMNS}
+
+
+class FeatureStore:
+    """On-disk, size-bounded store of feature and label columns"""
+
+    def __init__(self, root: str, max_bytes: int = 2 * 1024**3):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        # Counted per entry kind lookup (features, labels)
+        self.stats = {'hits': 0, 'extensions': 0, 'misses': 0}
+
+    # ------------------------------------------------------------------
+    # Entry management
+    # ------------------------------------------------------------------
+
+    def _family_dir(self, kind: str, params: Dict) -> Path:
+        return self.root / kind / _params_key(kind, params)
+
+    def _find_entry(self, df: pd.DataFrame, kind: str,
+                    params: Dict) -> Tuple[Optional[Path], Optional[Dict]]:
+        """Entry whose bars equal df or a prefix of df (longest first)"""
+        family = self._family_dir(kind, params)
+        if not family.exists():
+            return None, None
+
+        candidates = []
+        for entry in family.iterdir():
+            meta_path = entry / 'meta.json'
+            if not meta_path.exists():
+                continue
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta['n_rows'] <= len(df):
+                candidates.append((meta['n_rows'], entry, meta))
+
+        for n_rows, entry, meta in sorted(candidates, key=lambda c: -c[0]):
+            if hash_bars(df, n_rows) == meta['data_hash']:
+                os.utime(entry / 'meta.json')  # LRU touch
+                return entry, meta
+        return None, None
+
+    def _write_entry(self, df: pd.DataFrame, kind: str, params: Dict,
+                     columns: Dict[str, np.ndarray]) -> Path:
+        data_hash = hash_bars(df)
+        entry = self._family_dir(kind, params) / data_hash
+        tmp = entry.with_name(entry.name + '.tmp')
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir(parents=True)
+
+        nbytes = 0
+        for name, values in columns.items():
+            arr = np.ascontiguousarray(values)
+            np.save(tmp / f"{name}.npy", arr)
+            nbytes += arr.nbytes
+
+        meta = {
+            'kind': kind,
+            'params': params,
+            'version': FEATURE_CODE_VERSION,
+            'data_hash': data_hash,
+            'n_rows': len(df),
+            'columns': list(columns),
+            'nbytes': nbytes,
+            'created': time.time()
+        }
+        with open(tmp / 'meta.json', 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        if entry.exists():
+            shutil.rmtree(entry)
+        os.replace(tmp, entry)
+        self.evict()
+        return entry
+
+    @staticmethod
+    def _read_columns(entry: Path, names: List[str],
+                      mmap: bool = True) -> Dict[str, np.ndarray]:
+        mode = 'r' if mmap else None
+        return {
+            name: np.asarray(np.load(entry / f"{name}.npy", mmap_mode=mode))
+            for name in names
+        }
+
+    def _get_columns(self, df: pd.DataFrame, kind: str, params: Dict,
+                     compute: Callable[[pd.DataFrame], Dict[str, np.ndarray]],
+                     context: int, overlap: int,
+                     names: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Load `names` for one entry kind, computing or extending as needed.
+
+        When a stored entry covers a prefix of df, only the bars from
+        n_rows - context onward are recomputed; the last `overlap` stored
+        rows are replaced (forward-looking labels become defined once
+        later bars exist) and the new rows are appended. pandas' running
+        window sums depend on where they start, so extended values agree
+        with a full recompute to rounding (~1e-13 relative), not bitwise.
+        """
+        entry, meta = self._find_entry(df, kind, params)
+
+        if entry is not None and meta['n_rows'] == len(df):
+            self.stats['hits'] += 1
+            return self._read_columns(entry, names or meta['columns'])
+
+        if entry is not None:
+            self.stats['extensions'] += 1
+            n_old = meta['n_rows']
+            start = max(0, n_old - overlap - context)
+            keep = n_old - overlap
+            tail = compute(df.iloc[start:].reset_index(drop=True))
+            old = self._read_columns(entry, meta['columns'], mmap=False)
+            columns = {
+                name: np.concatenate([old[name][:keep], tail[name][keep - start:]])
+                for name in meta['columns']
+            }
+            # The old columns are in memory, so no file in the entry is
+            # still mapped (Windows cannot delete mapped files)
+            del old
+            shutil.rmtree(entry)
+        else:
+            self.stats['misses'] += 1
+            columns = compute(df)
+
+        self._write_entry(df, kind, params, columns)
+        if names is None:
+            return columns
+        return {name: columns[name] for name in names}
+
+    def evict(self):
+        """Remove least recently used entries until under max_bytes"""
+        entries = []
+        for meta_path in self.root.glob('*/*/*/meta.json'):
+            # Another process sharing the root may remove entries meanwhile
+            try:
+                with open(meta_path, 'r') as f:
+                    nbytes = json.load(f)['nbytes']
+                entries.append((meta_path.stat().st_mtime, nbytes, meta_path.parent))
+            except FileNotFoundError:
+                continue
+
+        total = sum(e[1] for e in entries)
+        for _, nbytes, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= nbytes
+
+    def clear(self):
+        """Delete every stored entry"""
+        shutil.rmtree(self.root)
+        self.root.mkdir(parents=True)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def get_arrays(self,
+                   df: pd.DataFrame,
+                   columns: Optional[List[str]] = None,
+                   periods: Optional[List[int]] = None,
+                   lookforward: int = 10,
+                   trend_threshold: float = 0.005,
+                   vol_threshold: float = 1.5,
+                   add_labels: bool = True) -> Dict[str, np.ndarray]:
+        """
+        Stored equivalent of compute_features().
+
+        Returns a dict of full-length arrays for the requested feature
+        columns (and with add_labels the label columns), plus a boolean
+        '_valid' entry marking the rows prepare_features() keeps after
+        its dropna().
+
+        Args:
+            df: Cleaned bars with time features
+            columns: Feature columns to return (default: get_feature_columns())
+            periods: Volatility periods (default: [5, 10, 20, 50])
+            lookforward, trend_threshold, vol_threshold: Labeling params
+            add_labels: Include regime labels
+        """
+        periods = list(periods or DEFAULT_PERIODS)
+        columns = columns or get_feature_columns()
+        feat_params = {'periods': periods}
+
+        # Row validity depends on every computed column (as in
+        # prepare_features' dropna), so it is stored once as '_valid'
+        # and partial column loads never need the rest
+        def compute_feats(part):
+            cols = _compute_feature_columns(part, periods)
+            valid = np.ones(len(part), dtype=bool)
+            for values in cols.values():
+                if values.dtype.kind == 'f':
+                    valid &= ~np.isnan(values)
+            cols['_valid'] = valid
+            return cols
+
+        stored = [c for c in columns if c not in df.columns]
+        feats = self._get_columns(df, 'features', feat_params, compute_feats,
+                                  context=FEATURE_CONTEXT_BARS, overlap=0,
+                                  names=stored + ['_valid'])
+        valid = feats.pop('_valid').copy()
+        # Source columns (time features etc.) are checked like prepare_features
+        for col in df.columns:
+            values = df[col].values
+            if values.dtype.kind == 'f':
+                valid &= ~np.isnan(values)
+
+        arrays = {col: feats[col] if col in feats else df[col].values for col in columns}
+        if add_labels:
+            label_params = {
+                'lookforward': lookforward,
+                'trend_threshold': trend_threshold,
+                'vol_threshold': vol_threshold
+            }
+            labels = self._get_columns(
+                df, 'labels', label_params,
+                lambda part: _compute_label_columns(part, lookforward,
+                                                    trend_threshold, vol_threshold),
+                context=50 + lookforward, overlap=lookforward
+            )
+            for name in ('FutureReturn', 'FutureVolRatio'):
+                valid &= ~np.isnan(labels[name])
+            arrays.update(labels)
+
+        arrays['_valid'] = valid
+        return arrays
+
+    def get_features(self,
+                     df: pd.DataFrame,
+                     columns: Optional[List[str]] = None,
+                     periods: Optional[List[int]] = None,
+                     lookforward: int = 10,
+                     trend_threshold: float = 0.005,
+                     vol_threshold: float = 1.5,
+                     add_labels: bool = True) -> pd.DataFrame:
+        """
+        Stored equivalent of prepare_features().
+
+        Returns Date, the requested feature columns and (with add_labels)
+        the label columns, over the rows prepare_features() keeps after
+        its dropna(). Arguments as get_arrays().
+        """
+        arrays = self.get_arrays(df, columns, periods, lookforward,
+                                 trend_threshold, vol_threshold, add_labels)
+        valid = arrays.pop('_valid')
+        data = {'Date': df['Date'].values[valid]}
+        for col, values in arrays.items():
+            data[col] = values[valid]
+        return pd.DataFrame(data)
+
+    def summary(self) -> Dict:
+        """Entry count, total bytes and hit statistics"""
+        metas = list(self.root.glob('*/*/*/meta.json'))
+        total = 0
+        for meta_path in metas:
+            with open(meta_path, 'r') as f:
+                total += json.load(f)['nbytes']
+        return {'entries': len(metas), 'bytes': total, **self.stats}
+
+
+if __name__ == "__main__":
+    # Demonstrate cold vs warm lookups
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+
+    root = Path(__file__).parent.parent
+    csv_path = root / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if csv_path.exists():
+        df = load_mt5_csv(str(csv_path), use_cache=True)
+        df = clean_data(df)
+        df = create_time_features(df)
+
+        store = FeatureStore(str(root / "cache" / "features"))
+        for label in ('cold', 'warm'):
+            start = time.perf_counter()
+            features = store.get_features(df)
+            print(f"{label}: {len(features):,} rows in {time.perf_counter() - start:.3f}s")
+        print(store.summary())
+    else:
+        print(f"CSV not found: {csv_path}")
@@ -9,9 +9,30 @@ Creates features optimized for detecting market regime:
 
 import pandas as pd
 import numpy as np
+import sys
+from pathlib import Path
 from typing import List, Tuple
 
+if __name__ == "__main__":
+    # Run as a script (python src/features.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.data_pipeline import CALENDAR_COLUMNS, SESSION_COLUMNS, cast_columns, get_dtype_policy
+from src.tracing import traced
+
 
+# 0/1 indicator columns (int8 under the compact dtype policy)
+FLAG_COLUMNS = ['RSI_Extreme'] + SESSION_COLUMNS
+
+# Columns a prepare_features() stage reads that an earlier stage wrote;
+# with drop_intermediates they live until their last reader has run
+_STAGE_INPUTS = {
+    'volatility': {'Return', 'Range'},
+    'labels': {'Return_Abs'}
+}
+
+
+@traced('features.price')
 def add_price_features(df: pd.DataFrame) -> pd.DataFrame:
     """Basic price-derived features"""
     df = df.copy()
@@ -36,6 +57,7 @@ def add_price_features(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+@traced('features.volatility')
 def add_volatility_features(df: pd.DataFrame, periods: List[int] = [5, 10, 20, 50]) -> pd.DataFrame:
     """Volatility indicators for regime detection"""
     df = df.copy()
@@ -64,6 +86,7 @@ def add_volatility_features(df: pd.DataFrame, periods: List[int] = [5, 10, 20, 5
     return df
 
 
+@traced('features.trend')
 def add_trend_features(df: pd.DataFrame) -> pd.DataFrame:
     """Trend strength indicators"""
     df = df.copy()
@@ -111,6 +134,7 @@ def add_trend_features(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+@traced('features.momentum')
 def add_momentum_features(df: pd.DataFrame) -> pd.DataFrame:
     """Momentum indicators"""
     df = df.copy()
@@ -145,6 +169,7 @@ def add_momentum_features(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+@traced('labels')
 def add_regime_labels(df: pd.DataFrame, 
                        lookforward: int = 10,
                        trend_threshold: float = 0.005,
@@ -207,21 +232,55 @@ def get_feature_columns() -> List[str]:
     ]
 
 
-def prepare_features(df: pd.DataFrame, add_labels: bool = True) -> pd.DataFrame:
-    """Full feature engineering pipeline"""
-    print("Adding features...")
+def apply_dtype_policy(df: pd.DataFrame, dtype_policy='default') -> pd.DataFrame:
+    """Cast model features, flags, calendar fields and Regime per policy"""
+    policy = get_dtype_policy(dtype_policy)
+    floats = [c for c in get_feature_columns()
+              if c in df.columns and df[c].dtype.kind == 'f']
+    df = cast_columns(df, floats, policy['feature'])
+    df = cast_columns(df, FLAG_COLUMNS, policy['flag'])
+    df = cast_columns(df, CALENDAR_COLUMNS, policy['calendar'])
+    return cast_columns(df, ['Regime'], policy['label'])
+
+
+@traced('prepare_features')
+def prepare_features(df: pd.DataFrame, add_labels: bool = True,
+                     dtype_policy='default') -> pd.DataFrame:
+    """
+    Full feature engineering pipeline.
     
-    df = add_price_features(df)
-    df = add_volatility_features(df)
-    df = add_trend_features(df)
-    df = add_momentum_features(df)
+    With a policy that drops intermediates (e.g. 'compact'), columns that
+    are neither inputs, model features nor Regime are removed right after
+    the stage that last reads them; their NaN warm-up still counts toward
+    the final dropna(), so exactly the same rows are kept.
+    """
+    policy = get_dtype_policy(dtype_policy)
+    print("Adding features...")
     
+    stages = [
+        ('price', add_price_features),
+        ('volatility', add_volatility_features),
+        ('trend', add_trend_features),
+        ('momentum', add_momentum_features)
+    ]
     if add_labels:
-        df = add_regime_labels(df)
+        stages.append(('labels', add_regime_labels))
+    
+    keep = set(df.columns) | set(get_feature_columns()) | {'Regime'}
+    valid = np.ones(len(df), dtype=bool)
+    for i, (_, stage) in enumerate(stages):
+        df = stage(df)
+        if policy['drop_intermediates']:
+            needed = keep.union(*(_STAGE_INPUTS.get(name, ()) for name, _ in stages[i + 1:]))
+            consumed = [c for c in df.columns if c not in needed]
+            valid &= df[consumed].notna().all(axis=1).values
+            df = df.drop(columns=consumed)
+        df = apply_dtype_policy(df, policy)
     
     # Drop NaN rows
     initial_len = len(df)
-    df = df.dropna().reset_index(drop=True)
+    valid &= df.notna().all(axis=1).values
+    df = df[valid].reset_index(drop=True)
     print(f"  Dropped {initial_len - len(df)} rows with NaN")
     
     return df
@@ -229,10 +288,6 @@ def prepare_features(df: pd.DataFrame, add_labels: bool = True) -> pd.DataFrame:
 
 if __name__ == "__main__":
     # Test feature engineering
-    import sys
-    from pathlib import Path
-    sys.path.insert(0, str(Path(__file__).parent.parent))
-    
     from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
     
     csv_path = Path(__file__).parent.parent / "XAUUSD_H1_201501020900_202512221100.csv"
@@ -0,0 +1,325 @@
+"""
+Hyperparameter Search
+=====================
+Joint search over RegimeDetector ensemble parameters and the labeling
+parameters of add_regime_labels (lookforward, trend_threshold,
+vol_threshold).
+
+- Labels for every (lookforward, trend, vol) tuple in the space come
+  from one label_engine pass and are shared by all configurations
+- Trials run concurrently on a process pool that attaches to the feature
+  matrix through shared memory (see walk_forward)
+- Successive halving: every configuration is first fitted on a small,
+  recent slice of the training window; only the best 1/eta advance to
+  the next, larger budget
+- Every finished trial is appended to a JSON-lines log; rerunning with
+  the same log, space and seed skips work that is already done
+
+Configurations are scored by macro F1 on a chronological validation
+window, because plain accuracy is not comparable across label thresholds
+that change the class balance.
+"""
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+if __name__ == "__main__":
+    # Run as a script (python src/hyperparam_search.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.label_engine import compute_label_tensor, threshold_grid
+from src.walk_forward import _share_array, _attach_shared, _SHARED
+
+
+# Example search space. Keys are '<member>__<param>' for the ensemble
+# ('rf', 'gb') and 'label__<param>' for add_regime_labels.
+DEFAULT_SPACE = {
+    'rf__n_estimators': [100, 200, 400],
+    'rf__max_depth': [6, 10, 14, None],
+    'rf__min_samples_leaf': [5, 10, 25],
+    'gb__n_estimators': [50, 100, 200],
+    'gb__max_depth': [3, 5],
+    'gb__learning_rate': [0.03, 0.1, 0.3],
+    'label__lookforward': [5, 10, 20],
+    'label__trend_threshold': [0.003, 0.005, 0.008],
+    'label__vol_threshold': [1.3, 1.5, 1.8]
+}
+
+LABEL_DEFAULTS = {'lookforward': 10, 'trend_threshold': 0.005, 'vol_threshold': 1.5}
+
+
+def sample_configs(space: Dict[str, List], n_trials: int, seed: int = 42) -> List[Dict]:
+    """Draw n_trials distinct configurations (or the full grid if smaller)"""
+    rng = np.random.default_rng(seed)
+    keys = sorted(space)
+    grid_size = int(np.prod([len(space[k]) for k in keys]))
+    n_trials = min(n_trials, grid_size)
+
+    configs, seen = [], set()
+    while len(configs) < n_trials:
+        config = {k: space[k][rng.integers(len(space[k]))] for k in keys}
+        key = config_id(config)
+        if key not in seen:
+            seen.add(key)
+            configs.append(config)
+    return configs
+
+
+def config_id(config: Dict) -> str:
+    """Stable short hash of a configuration"""
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def split_config(config: Dict) -> Tuple[Dict, Dict]:
+    """Split a flat config into (model_params, label_params)"""
+    model_params = {}
+    label_params = dict(LABEL_DEFAULTS)
+    for key, value in config.items():
+        group, name = key.split('__', 1)
+        if group == 'label':
+            label_params[name] = value
+        else:
+            model_params.setdefault(group, {})[name] = value
+    return model_params, label_params
+
+
+class LabelCache:
+    """Regime label arrays memoized per labeling-parameter tuple"""
+
+    def __init__(self, df: pd.DataFrame):
+        # Labeling only reads Close and Return_Abs
+        self.base = df[['Close', 'Return_Abs']].reset_index(drop=True)
+        self.cache: Dict[Tuple, np.ndarray] = {}
+
+    def prefetch(self, horizons: List[int], trend_thresholds: List[float],
+                 vol_thresholds: List[float]):
+        """Label every combination with one label_engine pass"""
+        sets = threshold_grid(trend_thresholds, vol_thresholds)
+        regime = compute_label_tensor(self.base, horizons, sets)['regime']
+        for j, h in enumerate(horizons):
+            for k, (trend, vol) in enumerate(sets):
+                self.cache[(h, trend, vol)] = np.ascontiguousarray(regime[:, j, k])
+
+    def get(self, lookforward: int, trend_threshold: float,
+            vol_threshold: float) -> np.ndarray:
+        """int8 labels, -1 where the future window is incomplete"""
+        key = (lookforward, trend_threshold, vol_threshold)
+        if key not in self.cache:
+            self.prefetch([lookforward], [trend_threshold], [vol_threshold])
+        return self.cache[key]
+
+
+def _run_trial(task: Dict) -> Dict:
+    """Fit one configuration at one budget and score it on validation"""
+    from src.regime_detector import RegimeDetector
+    from sklearn.metrics import accuracy_score, f1_score
+
+    X = _SHARED['X']
+    y = task['labels']
+    train_start, train_end = task['train']
+    val_start, val_end = task['val']
+
+    X_train, y_train = X[train_start:train_end], y[train_start:train_end]
+    keep = y_train >= 0
+    X_val, y_val = X[val_start:val_end], y[val_start:val_end]
+    keep_val = y_val >= 0
+
+    detector = RegimeDetector(task['feature_columns'], n_jobs=task['n_jobs'],
+                              model_params=task['model_params'])
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        detector.fit(X_train[keep], y_train[keep])
+    fit_seconds = time.perf_counter() - start
+
+    y_pred = detector.predict(X_val[keep_val])
+    return {
+        'trial_id': task['trial_id'],
+        'config': task['config'],
+        'rung': task['rung'],
+        'fraction': task['fraction'],
+        'train_samples': int(keep.sum()),
+        'score': f1_score(y_val[keep_val], y_pred, average='macro',
+                          labels=[0, 1, 2], zero_division=0),
+        'val_accuracy': accuracy_score(y_val[keep_val], y_pred),
+        'fit_seconds': fit_seconds
+    }
+
+
+def _read_log(log_path: Optional[str]) -> Dict[Tuple[str, int], Dict]:
+    done = {}
+    if log_path and Path(log_path).exists():
+        with open(log_path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    done[(record['trial_id'], record['rung'])] = record
+    return done
+
+
+def run_search(df: pd.DataFrame,
+               feature_columns: List[str],
+               space: Optional[Dict[str, List]] = None,
+               n_trials: int = 81,
+               eta: int = 3,
+               min_fraction: float = 1 / 9,
+               train_ratio: float = 0.7,
+               val_ratio: float = 0.15,
+               log_path: Optional[str] = 'search_trials.jsonl',
+               n_workers: Optional[int] = None,
+               seed: int = 42) -> pd.DataFrame:
+    """
+    Successive-halving search over model and labeling parameters.
+
+    Args:
+        df: prepare_features(df, add_labels=False) output
+        feature_columns: Model input columns
+        space: Parameter lists (default: DEFAULT_SPACE)
+        n_trials: Configurations in the first rung
+        eta: Keep the best 1/eta per rung; budget grows by eta
+        min_fraction: Share of the training window used in rung 0
+        train_ratio, val_ratio: Chronological split; the remaining test
+            share is never touched
+        log_path: JSON-lines trial log used for resuming (None = no log)
+        n_workers: Worker processes (default: one per CPU)
+        seed: Seed for configuration sampling
+
+    Returns:
+        One row per configuration at the furthest rung it reached, sorted
+        by rung then score (best first)
+    """
+    space = space or DEFAULT_SPACE
+    configs = sample_configs(space, n_trials, seed)
+    ids = [config_id(c) for c in configs]
+    by_id = dict(zip(ids, configs))
+
+    fractions = []
+    frac = min_fraction
+    while frac < 1.0 - 1e-9:
+        fractions.append(frac)
+        frac *= eta
+    fractions.append(1.0)
+
+    n = len(df)
+    train_end = int(n * train_ratio)
+    val_end = int(n * (train_ratio + val_ratio))
+    max_lookforward = max(space.get('label__lookforward', [LABEL_DEFAULTS['lookforward']]))
+    # Labels at the end of the train window must not see validation bars
+    embargoed_end = train_end - max_lookforward
+
+    n_workers = n_workers or os.cpu_count() or 1
+    n_jobs = max(1, (os.cpu_count() or 1) // n_workers)
+    labels = LabelCache(df)
+    labels.prefetch(*(space.get(f'label__{name}', [LABEL_DEFAULTS[name]])
+                      for name in ('lookforward', 'trend_threshold', 'vol_threshold')))
+    done = _read_log(log_path)
+    if log_path:
+        Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+
+    print(f"Hyperparameter search: {len(configs)} configs, rungs {fractions}, "
+          f"{n_workers} workers, {len(done)} trials already logged")
+
+    shm, spec = _share_array(df[feature_columns].to_numpy(dtype=np.float64))
+    pool = None
+    try:
+        if n_workers > 1:
+            pool = ProcessPoolExecutor(max_workers=n_workers, initializer=_attach_shared,
+                                       initargs=({'X': spec},))
+        else:
+            _attach_shared({'X': spec})
+
+        alive = ids
+        results = []
+        for rung, fraction in enumerate(fractions):
+            train_start = int(embargoed_end * (1 - fraction))
+            tasks = []
+            for trial_id in alive:
+                if (trial_id, rung) in done:
+                    continue
+                model_params, label_params = split_config(by_id[trial_id])
+                tasks.append({
+                    'trial_id': trial_id,
+                    'config': by_id[trial_id],
+                    'rung': rung,
+                    'fraction': fraction,
+                    'model_params': model_params,
+                    'labels': labels.get(label_params['lookforward'],
+                                         label_params['trend_threshold'],
+                                         label_params['vol_threshold']),
+                    'train': (train_start, embargoed_end),
+                    'val': (train_end, val_end),
+                    'feature_columns': list(feature_columns),
+                    'n_jobs': n_jobs
+                })
+
+            start = time.perf_counter()
+            mapper = pool.map if pool else map
+            for record in mapper(_run_trial, tasks):
+                done[(record['trial_id'], rung)] = record
+                if log_path:
+                    with open(log_path, 'a') as f:
+                        f.write(json.dumps(record) + '\n')
+
+            results = sorted((done[(t, rung)] for t in alive),
+                             key=lambda r: r['score'], reverse=True)
+            print(f"  Rung {rung}: {len(alive)} configs on {fraction:.0%} of train, "
+                  f"best F1 {results[0]['score']:.3f} ({time.perf_counter() - start:.1f}s)")
+
+            if rung < len(fractions) - 1:
+                alive = [r['trial_id'] for r in results[:max(1, len(alive) // eta)]]
+    finally:
+        if pool:
+            pool.shutdown()
+        else:
+            _SHARED.pop('X', None)
+            _SHARED.pop('X_shm').close()
+        shm.close()
+        shm.unlink()
+
+    # Every configuration at the furthest rung it reached
+    furthest = {}
+    for (trial_id, rung), record in done.items():
+        if trial_id in by_id and (trial_id not in furthest or rung > furthest[trial_id]['rung']):
+            furthest[trial_id] = record
+    table = pd.DataFrame([{**r['config'], **{k: v for k, v in r.items() if k != 'config'}}
+                          for r in furthest.values()])
+    table = table.sort_values(['rung', 'score'], ascending=False).reset_index(drop=True)
+
+    best = results[0]
+    print(f"Best config ({best['trial_id']}): F1 {best['score']:.3f}, "
+          f"accuracy {best['val_accuracy']:.2%}")
+    for key, value in best['config'].items():
+        print(f"  {key}: {value}")
+    return table
+
+
+if __name__ == "__main__":
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+    from src.feature_store import FeatureStore
+    from src.features import get_feature_columns
+
+    root = Path(__file__).parent.parent
+    csv_path = root / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if csv_path.exists():
+        df = load_mt5_csv(str(csv_path), use_cache=True)
+        df = clean_data(df)
+        df = create_time_features(df)
+        # Stored columns; labeling reads Close and Return_Abs
+        store = FeatureStore(str(root / "cache" / "features"))
+        df = store.get_features(df, get_feature_columns() + ['Close', 'Return_Abs'],
+                                add_labels=False)
+
+        run_search(df, get_feature_columns(),
+                   log_path=str(root / "models" / "search_trials.jsonl"))
+    else:
+        print(f"CSV not found: {csv_path}")
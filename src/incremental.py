@@ -0,0 +1,362 @@
+"""
+Incremental Regime Detector
+===========================
+Extends a fitted model with new bars instead of refitting from scratch.
+
+Each partial_fit(X_new, y_new):
+- Scaler: StandardScaler.partial_fit merges the new bars into the running
+  mean/variance. Every kept tree is then remapped to the new scaling
+  (t' = (t * old_scale + old_mean - new_mean) / new_scale), so its splits
+  stay where they were in raw feature space (forest trees compare in
+  float32, so a row within rounding of a split can still flip; ~5e-5 of
+  rows per tree on XAUUSD H1)
+- Forest: `trees_per_update` new trees are grown on the recent window and
+  appended to the RandomForest (warm start). Trees older than
+  `max_tree_age` updates, or beyond the newest `max_trees`, are evicted
+- Boosting: refit on the sliding window of the last `window_bars` bars
+  (boosting trees depend on each other, so they cannot be appended).
+  The refit waits until the window holds at least as many bars as the
+  current boosting member was fitted on (capped at `window_bars`), so a
+  few hundred new bars never replace a model trained on years
+
+The recent window (raw float32 rows and labels) is part of the saved
+state. A plain RegimeDetector file loaded with load() has no window:
+pass its training rows to seed_window() first, otherwise the boosting
+member is kept until `window_bars` new bars have arrived. save() writes
+the RegimeDetector format plus the incremental state, so
+RegimeDetector.load, export_onnx and tree_inference read the file
+unchanged.
+"""
+
+import contextlib
+import io
+import sys
+import time
+import joblib
+import numpy as np
+from pathlib import Path
+from typing import Dict, Optional
+
+if __name__ == "__main__":
+    # Run as a script (python src/incremental.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.regime_detector import RegimeDetector
+from src.tracing import span, traced
+
+
+class IncrementalRegimeDetector(RegimeDetector):
+    """RegimeDetector with running-moment scaling and a rolling forest"""
+
+    def __init__(self, feature_columns: list, n_jobs: int = -1,
+                 model_params: Optional[Dict] = None,
+                 backend: str = 'exact',
+                 trees_per_update: int = 20,
+                 max_trees: Optional[int] = None,
+                 max_tree_age: Optional[int] = None,
+                 window_bars: int = 20_000,
+                 refresh_boosting: bool = True):
+        super().__init__(feature_columns, n_jobs, model_params, backend)
+        self.trees_per_update = trees_per_update
+        # Forest size cap (default: the initial n_estimators)
+        self.max_trees = max_trees
+        # Evict trees grown more than this many updates ago (None = never)
+        self.max_tree_age = max_tree_age
+        self.window_bars = window_bars
+        self.refresh_boosting = refresh_boosting
+        self.n_updates = 0
+        # Update number at which each forest tree was grown
+        self.tree_birth = np.zeros(0, dtype=np.int64)
+        self.window_X = None
+        self.window_y = None
+        # Rows the current boosting member was fitted on (None = unknown)
+        self.boosting_bars = None
+
+    def _keep_window(self, X: np.ndarray, y: np.ndarray):
+        if self.window_X is not None:
+            X = np.concatenate([self.window_X, np.asarray(X, dtype=np.float32)])
+            y = np.concatenate([self.window_y, y])
+        self.window_X = np.ascontiguousarray(X[-self.window_bars:], dtype=np.float32)
+        self.window_y = np.asarray(y[-self.window_bars:]).copy()
+
+    def fit(self, X_train: np.ndarray, y_train: np.ndarray,
+            X_val: Optional[np.ndarray] = None,
+            y_val: Optional[np.ndarray] = None) -> Dict:
+        """Full fit; starts the incremental state"""
+        results = super().fit(X_train, y_train, X_val, y_val)
+        rf = self.model.named_estimators_['rf']
+        self.tree_birth = np.zeros(len(rf.estimators_), dtype=np.int64)
+        self.max_trees = self.max_trees or len(rf.estimators_)
+        self.n_updates = 0
+        self.window_X = self.window_y = None
+        self._keep_window(X_train, y_train)
+        self.boosting_bars = len(X_train)
+        return results
+
+    def seed_window(self, X: np.ndarray, y: np.ndarray):
+        """Put history before the bars already in the window (e.g. the
+        training rows of a model loaded from a RegimeDetector file)"""
+        window_X, window_y = self.window_X, self.window_y
+        self.window_X = self.window_y = None
+        self._keep_window(X, y)
+        if window_X is not None:
+            self._keep_window(window_X, window_y)
+        if self.boosting_bars is None:
+            self.boosting_bars = len(X)
+
+    # ------------------------------------------------------------------
+    # Incremental update
+    # ------------------------------------------------------------------
+
+    def _rescale_trees(self, old_mean: np.ndarray, old_scale: np.ndarray):
+        """Move every split threshold from the old to the new scaling"""
+        mean, scale = self.scaler.mean_, self.scaler.scale_
+
+        def remap(feature, threshold):
+            return (threshold * old_scale[feature] + old_mean[feature] - mean[feature]) / scale[feature]
+
+        def remap_tree(tree):
+            split = tree.children_left >= 0
+            threshold = tree.threshold
+            threshold[split] = remap(tree.feature[split], threshold[split])
+
+        for est in self.model.named_estimators_['rf'].estimators_:
+            remap_tree(est.tree_)
+        gb = self.model.named_estimators_['gb']
+        if hasattr(gb, 'estimators_'):
+            for est in gb.estimators_.ravel():
+                remap_tree(est.tree_)
+        else:
+            for stage in gb._predictors:
+                for predictor in stage:
+                    nodes = predictor.nodes
+                    split = ~nodes['is_leaf'].astype(bool)
+                    nodes['num_threshold'][split] = remap(nodes['feature_idx'][split],
+                                                          nodes['num_threshold'][split])
+
+    def _grow_trees(self, X_scaled: np.ndarray, y: np.ndarray):
+        """Append trees_per_update trees grown on the window"""
+        from sklearn.ensemble import RandomForestClassifier
+
+        rf = self.model.named_estimators_['rf']
+        params = {**self.DEFAULT_RF_PARAMS, **self.model_params.get('rf', {})}
+        params['n_estimators'] = self.trees_per_update
+        params['random_state'] = (params.get('random_state') or 0) + 1000 * (self.n_updates + 1)
+        grown = RandomForestClassifier(**params, n_jobs=self.n_jobs).fit(X_scaled, y)
+
+        rf.estimators_ = rf.estimators_ + grown.estimators_
+        self.tree_birth = np.concatenate([
+            self.tree_birth, np.full(len(grown.estimators_), self.n_updates + 1)
+        ])
+
+    def _evict_trees(self) -> int:
+        rf = self.model.named_estimators_['rf']
+        age = (self.n_updates + 1) - self.tree_birth
+        keep = np.ones(len(age), dtype=bool)
+        if self.max_tree_age is not None:
+            keep &= age <= self.max_tree_age
+        # Newest trees win the size cap (births are in ascending order)
+        if keep.sum() > self.max_trees:
+            keep[np.flatnonzero(keep)[:-self.max_trees]] = False
+        rf.estimators_ = [est for est, k in zip(rf.estimators_, keep) if k]
+        rf.n_estimators = len(rf.estimators_)
+        self.tree_birth = self.tree_birth[keep]
+        return int((~keep).sum())
+
+    def _refit_boosting(self, X_scaled: np.ndarray, y: np.ndarray):
+        gb = self._create_ensemble().estimators[1][1].fit(X_scaled, y)
+        self.model.named_estimators_['gb'] = gb
+        self.model.estimators_[1] = gb
+
+    @traced('partial_fit')
+    def partial_fit(self, X_new: np.ndarray, y_new: np.ndarray) -> Dict:
+        """
+        Extend the model with new bars.
+
+        Returns:
+            Timings (seconds) of each step and the forest size after it
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call fit() first.")
+        timings = {}
+
+        start = time.perf_counter()
+        with span('partial_fit.scale'):
+            old_mean, old_scale = self.scaler.mean_.copy(), self.scaler.scale_.copy()
+            self.scaler.partial_fit(X_new)
+            self._rescale_trees(old_mean, old_scale)
+            self._keep_window(X_new, y_new)
+            X_scaled = self.scaler.transform(self.window_X)
+        timings['scale'] = time.perf_counter() - start
+
+        # New trees and the boosting refit need every regime in the window
+        complete = len(np.unique(self.window_y)) == len(self.model.classes_)
+        if not complete:
+            print(f"  Window of {len(self.window_y):,} bars lacks a regime; "
+                  f"only the scaler was updated")
+
+        start = time.perf_counter()
+        evicted = 0
+        if complete and self.trees_per_update:
+            with span('partial_fit.forest'):
+                self._grow_trees(X_scaled, self.window_y)
+                evicted = self._evict_trees()
+        timings['forest'] = time.perf_counter() - start
+
+        # A refit on fewer bars than the current member saw would lose data
+        min_bars = min(self.window_bars, self.boosting_bars or self.window_bars)
+        refit = complete and self.refresh_boosting and len(self.window_y) >= min_bars
+        if complete and self.refresh_boosting and not refit:
+            print(f"  Window of {len(self.window_y):,} bars is below {min_bars:,}; "
+                  f"boosting member kept")
+
+        start = time.perf_counter()
+        if refit:
+            with span('partial_fit.boosting', backend=self.backend):
+                self._refit_boosting(X_scaled, self.window_y)
+            self.boosting_bars = len(self.window_y)
+        timings['boosting'] = time.perf_counter() - start
+
+        self.n_updates += 1
+        n_trees = len(self.model.named_estimators_['rf'].estimators_)
+        print(f"Update {self.n_updates}: +{len(y_new):,} bars, forest {n_trees} trees "
+              f"({evicted} evicted), {sum(timings.values()):.2f}s")
+        return {**timings, 'trees': n_trees, 'evicted': evicted}
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    @traced('save')
+    def save(self, filepath: str):
+        """RegimeDetector format plus the incremental state"""
+        save_dict = {
+            'model': self.model,
+            'scaler': self.scaler,
+            'feature_columns': self.feature_columns,
+            'model_params': self.model_params,
+            'backend': self.backend,
+            'is_fitted': self.is_fitted,
+            'incremental': {
+                'trees_per_update': self.trees_per_update,
+                'max_trees': self.max_trees,
+                'max_tree_age': self.max_tree_age,
+                'window_bars': self.window_bars,
+                'refresh_boosting': self.refresh_boosting,
+                'n_updates': self.n_updates,
+                'tree_birth': self.tree_birth,
+                'window_X': self.window_X,
+                'window_y': self.window_y,
+                'boosting_bars': self.boosting_bars
+            }
+        }
+        joblib.dump(save_dict, filepath)
+        print(f"Model saved to: {filepath}")
+
+    @classmethod
+    def load(cls, filepath: str) -> 'IncrementalRegimeDetector':
+        """
+        Load an incremental model, or start one from a RegimeDetector
+        file. The latter has no window: call seed_window() with its
+        training rows, or the boosting member is only refit once
+        `window_bars` new bars have arrived.
+        """
+        save_dict = joblib.load(filepath)
+        state = save_dict.get('incremental', {})
+        detector = cls(save_dict['feature_columns'],
+                       model_params=save_dict.get('model_params'),
+                       backend=save_dict.get('backend', 'exact'),
+                       **{k: state[k] for k in ('trees_per_update', 'max_trees', 'max_tree_age',
+                                                'window_bars', 'refresh_boosting') if k in state})
+        detector.model = save_dict['model']
+        detector.scaler = save_dict['scaler']
+        detector.is_fitted = save_dict['is_fitted']
+        n_trees = len(detector.model.named_estimators_['rf'].estimators_)
+        detector.n_updates = state.get('n_updates', 0)
+        detector.tree_birth = state.get('tree_birth', np.zeros(n_trees, dtype=np.int64))
+        detector.max_trees = detector.max_trees or n_trees
+        detector.window_X = state.get('window_X')
+        detector.window_y = state.get('window_y')
+        detector.boosting_bars = state.get('boosting_bars')
+        # Plain RegimeDetector scalers start their running count here
+        if not hasattr(detector.scaler, 'n_samples_seen_'):
+            detector.scaler.n_samples_seen_ = 0
+        print(f"Model loaded from: {filepath}")
+        return detector
+
+
+def benchmark_incremental(X: np.ndarray, y: np.ndarray,
+                          initial_bars: int,
+                          update_bars: int = 120,
+                          n_updates: int = 4,
+                          backend: str = 'exact',
+                          **incremental_params) -> Dict:
+    """
+    Walk forward in update_bars steps: each step either partial_fit()s
+    the new bars or refits on everything so far, then both models are
+    scored on the following update_bars bars.
+
+    Returns:
+        Per-step rows plus mean update/refit seconds and accuracies
+    """
+    from sklearn.metrics import accuracy_score
+
+    feature_columns = list(range(X.shape[1]))
+    incremental = IncrementalRegimeDetector(feature_columns, backend=backend, **incremental_params)
+    with contextlib.redirect_stdout(io.StringIO()):
+        incremental.fit(X[:initial_bars], y[:initial_bars])
+
+    steps = []
+    for step in range(n_updates):
+        end = initial_bars + (step + 1) * update_bars
+        test = slice(end, end + update_bars)
+        if test.start >= len(X):
+            break
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            incremental.partial_fit(X[end - update_bars:end], y[end - update_bars:end])
+        update_seconds = time.perf_counter() - start
+
+        full = RegimeDetector(feature_columns, backend=backend)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            full.fit(X[:end], y[:end])
+        refit_seconds = time.perf_counter() - start
+
+        steps.append({
+            'bars': end,
+            'update_seconds': update_seconds,
+            'refit_seconds': refit_seconds,
+            'update_accuracy': accuracy_score(y[test], incremental.predict(X[test])),
+            'refit_accuracy': accuracy_score(y[test], full.predict(X[test]))
+        })
+
+    print(f"Incremental vs full refit ({backend} backend, {update_bars}-bar updates):")
+    print(f"  {'bars':>8} {'update s':>9} {'refit s':>9} {'upd acc':>8} {'refit acc':>9}")
+    for s in steps:
+        print(f"  {s['bars']:8,d} {s['update_seconds']:9.2f} {s['refit_seconds']:9.2f} "
+              f"{s['update_accuracy']:8.2%} {s['refit_accuracy']:9.2%}")
+    summary = {key: float(np.mean([s[key] for s in steps])) for key in steps[0]} if steps else {}
+    if steps:
+        print(f"  mean update {summary['update_seconds']:.2f}s vs refit {summary['refit_seconds']:.2f}s "
+              f"({summary['refit_seconds'] / summary['update_seconds']:.1f}x), accuracy "
+              f"{summary['update_accuracy']:.2%} vs {summary['refit_accuracy']:.2%}")
+    return {'steps': steps, 'summary': summary}
+
+
+if __name__ == "__main__":
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+    from src.features import prepare_features, get_feature_columns
+
+    csv_path = Path(__file__).parent.parent / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if csv_path.exists():
+        df = prepare_features(create_time_features(clean_data(load_mt5_csv(str(csv_path), use_cache=True))))
+        X = df[get_feature_columns()].to_numpy(dtype=np.float64)
+        y = df['Regime'].to_numpy()
+        # Weekly H1 updates over the last quarter of the history
+        benchmark_incremental(X, y, initial_bars=int(len(X) * 0.75), update_bars=120,
+                              n_updates=4, backend='hist', window_bars=10_000)
+    else:
+        print(f"CSV not found: {csv_path}")
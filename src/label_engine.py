@@ -0,0 +1,208 @@
+"""
+Multi-Horizon Label Engine
+==========================
+Regime labels of add_regime_labels for many lookforward horizons and
+(trend_threshold, vol_threshold) sets in one pass over the bars.
+
+- Every window mean comes from one float64 prefix sum of Return_Abs:
+  mean(x[a:b]) = (S[b] - S[a]) / (b - a), so each extra horizon costs a
+  few vectorized subtractions instead of a rolling pass
+- Future return per horizon is a single shifted division of Close
+- Labels are stored as one int8 tensor (bars x horizons x threshold sets),
+  -1 where the future window is incomplete or the 50-bar average is not
+  yet defined (the rows prepare_features() would drop)
+
+Values match add_regime_labels up to prefix-sum rounding (~1e-12
+relative), which can only matter for a ratio exactly at a threshold.
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from itertools import product
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+if __name__ == "__main__":
+    # Run as a script (python src/label_engine.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.tracing import traced
+
+
+# Trailing window of the volatility baseline in add_regime_labels
+AVG_WINDOW = 50
+
+
+def threshold_grid(trend_thresholds: Sequence[float],
+                   vol_thresholds: Sequence[float]) -> List[Tuple[float, float]]:
+    """Every (trend_threshold, vol_threshold) combination"""
+    return list(product(trend_thresholds, vol_thresholds))
+
+
+def _prefix_sums(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Prefix sums of the values (NaN as 0) and of the NaN count"""
+    missing = np.isnan(values)
+    prefix = np.zeros(len(values) + 1)
+    np.cumsum(np.where(missing, 0.0, values), out=prefix[1:])
+    gaps = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(missing, out=gaps[1:])
+    return prefix, gaps
+
+
+def _window_means(prefix: np.ndarray, gaps: np.ndarray,
+                  window: int, offset: int) -> np.ndarray:
+    """
+    mean(values[i + offset - window + 1 : i + offset + 1]) for every i,
+    NaN where the window leaves the array or holds a NaN (pandas'
+    rolling(window).mean() semantics).
+    """
+    n = len(prefix) - 1
+    out = np.full(n, np.nan)
+    first = max(window - offset - 1, 0)
+    last = n - offset
+    if last <= first:
+        return out
+    hi = np.arange(first, last) + offset + 1
+    means = (prefix[hi] - prefix[hi - window]) / window
+    means[gaps[hi] - gaps[hi - window] > 0] = np.nan
+    out[first:last] = means
+    return out
+
+
+@traced('labels.tensor')
+def compute_label_tensor(df: pd.DataFrame,
+                         horizons: Sequence[int] = (5, 10, 20, 40),
+                         threshold_sets: Sequence[Tuple[float, float]] = ((0.005, 1.5),),
+                         value_dtype=np.float32) -> Dict[str, np.ndarray]:
+    """
+    Future return, future volatility ratio and regime for every horizon
+    and threshold set.
+
+    Args:
+        df: Bars with Close (Return_Abs is used when present, else
+            derived from Close exactly as add_price_features does)
+        horizons: Lookforward bar counts
+        threshold_sets: (trend_threshold, vol_threshold) pairs
+        value_dtype: Storage dtype of the float outputs
+
+    Returns:
+        {'horizons': (H,), 'thresholds': (S, 2),
+         'future_return': (bars, H), 'future_vol_ratio': (bars, H),
+         'regime': (bars, H, S) int8, -1 = undefined}
+    """
+    close = df['Close'].to_numpy(dtype=np.float64)
+    if 'Return_Abs' in df.columns:
+        ret_abs = df['Return_Abs'].to_numpy(dtype=np.float64)
+    else:
+        ret_abs = np.abs(pd.Series(close).pct_change().to_numpy())
+    n = len(close)
+    horizons = np.asarray(horizons, dtype=np.int64)
+    thresholds = np.asarray(threshold_sets, dtype=np.float64).reshape(-1, 2)
+
+    prefix, gaps = _prefix_sums(ret_abs)
+    avg_vol = _window_means(prefix, gaps, AVG_WINDOW, 0)
+    avg_vol[avg_vol == 0] = np.nan
+
+    future_return = np.full((n, len(horizons)), np.nan, dtype=value_dtype)
+    vol_ratio = np.full((n, len(horizons)), np.nan, dtype=value_dtype)
+    regime = np.full((n, len(horizons), len(thresholds)), -1, dtype=np.int8)
+
+    for j, h in enumerate(horizons):
+        fr = np.full(n, np.nan)
+        if h < n:
+            fr[:n - h] = close[h:] / close[:n - h] - 1
+        # Mean of the h returns after bar i, over the trailing baseline
+        ratio = _window_means(prefix, gaps, h, h) / avg_vol
+        future_return[:, j] = fr
+        vol_ratio[:, j] = ratio
+
+        undefined = np.isnan(fr) | np.isnan(ratio)
+        fr_abs = np.abs(fr)
+        labels = np.empty(n, dtype=np.int8)
+        for k, (trend_threshold, vol_threshold) in enumerate(thresholds):
+            # NaN compares False, so undefined rows only need the final -1
+            np.greater(fr_abs, trend_threshold, out=labels, casting='unsafe')
+            labels[ratio >= vol_threshold] = 2
+            labels[undefined] = -1
+            regime[:, j, k] = labels
+
+    return {
+        'horizons': horizons,
+        'thresholds': thresholds,
+        'future_return': future_return,
+        'future_vol_ratio': vol_ratio,
+        'regime': regime
+    }
+
+
+def label_slice(tensor: Dict[str, np.ndarray], lookforward: int,
+                trend_threshold: float, vol_threshold: float) -> np.ndarray:
+    """Regime column of one (horizon, threshold set) variant"""
+    horizon = np.flatnonzero(tensor['horizons'] == lookforward)
+    if not len(horizon):
+        raise KeyError(f"Horizon {lookforward} not in tensor")
+    j = int(horizon[0])
+    match = np.flatnonzero((tensor['thresholds'][:, 0] == trend_threshold) &
+                           (tensor['thresholds'][:, 1] == vol_threshold))
+    if not len(match):
+        raise KeyError(f"Threshold set ({trend_threshold}, {vol_threshold}) not in tensor")
+    return tensor['regime'][:, j, match[0]]
+
+
+def benchmark_label_engine(df: pd.DataFrame,
+                           horizons: Sequence[int] = (5, 10, 20, 40),
+                           threshold_sets: Sequence[Tuple[float, float]] = None) -> Dict:
+    """
+    One-pass tensor vs one add_regime_labels call per variant: time and
+    label agreement on the defined rows.
+    """
+    from src.features import add_regime_labels
+
+    threshold_sets = threshold_sets or threshold_grid([0.003, 0.005, 0.008], [1.3, 1.5, 1.8])
+    base = pd.DataFrame({'Close': df['Close'].to_numpy(dtype=np.float64)})
+    base['Return_Abs'] = base['Close'].pct_change().abs()
+
+    start = time.perf_counter()
+    tensor = compute_label_tensor(base, horizons, threshold_sets)
+    tensor_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mismatches = 0
+    for (j, h), (k, (trend, vol)) in product(enumerate(horizons), enumerate(threshold_sets)):
+        ref = add_regime_labels(base, h, trend, vol)
+        defined = (~ref['FutureReturn'].isna() & ~ref['FutureVolRatio'].isna()).to_numpy()
+        ours = tensor['regime'][:, j, k]
+        mismatches += int(np.sum(ours[defined] != ref['Regime'].to_numpy()[defined]))
+        mismatches += int(np.sum(ours[~defined] != -1))
+    loop_seconds = time.perf_counter() - start
+
+    variants = len(horizons) * len(threshold_sets)
+    results = {
+        'bars': len(base),
+        'variants': variants,
+        'tensor_seconds': tensor_seconds,
+        'loop_seconds': loop_seconds,
+        'speedup': loop_seconds / tensor_seconds,
+        'tensor_mb': tensor['regime'].nbytes / 1e6,
+        'label_mismatches': mismatches
+    }
+    print(f"Label engine: {variants} variants on {len(base):,} bars")
+    print(f"  add_regime_labels loop: {loop_seconds:.2f}s")
+    print(f"  one-pass tensor:        {tensor_seconds:.2f}s ({results['speedup']:.1f}x), "
+          f"{results['tensor_mb']:.1f} MB int8")
+    print(f"  label mismatches:       {mismatches}")
+    return results
+
+
+if __name__ == "__main__":
+    from src.data_pipeline import load_mt5_csv, clean_data
+
+    csv_path = Path(__file__).parent.parent / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if csv_path.exists():
+        df = clean_data(load_mt5_csv(str(csv_path), use_cache=True))
+        benchmark_label_engine(df)
+    else:
+        print(f"CSV not found: {csv_path}")
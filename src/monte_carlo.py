@@ -0,0 +1,236 @@
+"""
+Monte Carlo Robustness
+======================
+Drawdown and ruin distributions for a trade (or per-bar return) stream,
+e.g. the pnl_pips column of backtest.run_backtest.
+
+Resampling methods:
+- 'reshuffle': random permutation of the trades (same total, new order)
+- 'bootstrap': trades drawn with replacement
+- 'block':     circular block bootstrap, keeping runs of block_size
+               consecutive trades together (preserves streaks/regimes)
+
+Costs can be perturbed per resampled trade: the trade's own spread cost
+is replaced by a spread drawn from the bars' `Spread` column (scaled by
+spread_scale) plus half-normal slippage.
+
+Paths are generated in batches sized to a fixed element budget, spread
+over a process pool that reads the trade arrays from shared memory. Each
+batch is reduced to per-path scalars (final pnl, max drawdown, lowest
+equity) straight away, so full equity curves never accumulate.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+if __name__ == "__main__":
+    # Run as a script (python src/monte_carlo.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.walk_forward import _share_array, _attach_shared, _SHARED
+
+
+METHODS = ('reshuffle', 'bootstrap', 'block')
+
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+
+# Path matrix elements per batch (paths x trades), ~16 MB of float64
+BATCH_ELEMENTS = 2_000_000
+
+
+def spread_pool_from_bars(df: pd.DataFrame, point: float = 0.01,
+                          pip_size: float = 0.1) -> np.ndarray:
+    """Empirical spread distribution in pips from the Spread column"""
+    return df['Spread'].to_numpy(dtype=np.float64) * point / pip_size
+
+
+def _resample_index(rng: np.random.Generator, method: str, n_paths: int,
+                    n_trades: int, block_size: int) -> np.ndarray:
+    if method == 'reshuffle':
+        return rng.permuted(np.tile(np.arange(n_trades), (n_paths, 1)), axis=1)
+    if method == 'bootstrap':
+        return rng.integers(0, n_trades, size=(n_paths, n_trades))
+    n_blocks = -(-n_trades // block_size)
+    starts = rng.integers(0, n_trades, size=(n_paths, n_blocks, 1))
+    idx = (starts + np.arange(block_size)) % n_trades
+    return idx.reshape(n_paths, -1)[:, :n_trades]
+
+
+def _simulate_batch(task: Dict) -> Dict[str, np.ndarray]:
+    """Per-path summary scalars for one batch of resampled paths"""
+    rng = np.random.default_rng(task['seed'])
+    pnl = _SHARED['pnl']
+    n_paths, n_trades = task['n_paths'], len(pnl)
+
+    idx = _resample_index(rng, task['method'], n_paths, n_trades, task['block_size'])
+    paths = pnl[idx]
+
+    if 'spread_pool' in _SHARED:
+        # Swap each trade's own spread for a random bar's spread
+        pool = _SHARED['spread_pool']
+        drawn = pool[rng.integers(0, len(pool), size=paths.shape)] * task['spread_scale']
+        paths += _SHARED['cost'][idx] - drawn
+    if task['slippage_pips'] > 0:
+        paths -= np.abs(rng.normal(0.0, task['slippage_pips'], size=paths.shape))
+
+    equity = np.cumsum(paths, axis=1, out=paths)
+    lowest = equity.min(axis=1)
+    final = equity[:, -1].copy()
+    # Drawdown from the running peak, with the starting balance as a peak
+    peak = np.maximum.accumulate(equity, axis=1)
+    np.maximum(peak, 0.0, out=peak)
+    max_dd = np.subtract(peak, equity, out=peak).max(axis=1)
+    return {'final': final, 'max_drawdown': max_dd, 'lowest': lowest}
+
+
+def run_monte_carlo(pnl: np.ndarray,
+                    cost: Optional[np.ndarray] = None,
+                    spread_pool: Optional[np.ndarray] = None,
+                    method: str = 'block',
+                    n_paths: int = 100_000,
+                    block_size: int = 20,
+                    spread_scale: float = 1.0,
+                    slippage_pips: float = 0.0,
+                    ruin_pips: float = 1000.0,
+                    n_workers: Optional[int] = None,
+                    seed: int = 42) -> Dict:
+    """
+    Resample a pnl stream into n_paths equity paths.
+
+    Args:
+        pnl: Per-trade (or per-bar) pnl in pips, in chronological order
+        cost: Spread cost already inside each pnl (e.g. trades['cost_pips']);
+            needed with spread_pool
+        spread_pool: Spread distribution in pips (spread_pool_from_bars)
+            to redraw costs from; None keeps the historical costs
+        method: 'reshuffle', 'bootstrap' or 'block'
+        n_paths: Number of paths
+        block_size: Trades per block for method='block'
+        spread_scale: Multiplier on drawn spreads (stress test)
+        slippage_pips: Scale of half-normal slippage per trade
+        ruin_pips: A path is ruined once equity falls to -ruin_pips
+        n_workers: Worker processes (default: one per CPU)
+        seed: Base seed; each batch gets its own child seed
+
+    Returns:
+        Dict with percentiles of final pnl, max drawdown and lowest
+        equity, the ruin probability and drawdown exceedance rates
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method: {method}. Use one of {METHODS}")
+    pnl = np.ascontiguousarray(pnl, dtype=np.float64)
+    n_trades = len(pnl)
+    if n_trades == 0:
+        raise ValueError("Empty pnl stream")
+    if spread_pool is not None and cost is None:
+        raise ValueError("cost is required to redraw spreads")
+
+    n_workers = n_workers or os.cpu_count() or 1
+    per_batch = max(1, BATCH_ELEMENTS // n_trades)
+    sizes = [min(per_batch, n_paths - i) for i in range(0, n_paths, per_batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [{'seed': s, 'n_paths': k, 'method': method, 'block_size': block_size,
+              'spread_scale': spread_scale, 'slippage_pips': slippage_pips}
+             for s, k in zip(seeds, sizes)]
+
+    arrays = {'pnl': pnl}
+    if spread_pool is not None:
+        arrays['cost'] = np.ascontiguousarray(cost, dtype=np.float64)
+        arrays['spread_pool'] = np.ascontiguousarray(spread_pool, dtype=np.float64)
+
+    print(f"Monte Carlo ({method}): {n_paths:,} paths x {n_trades:,} trades, "
+          f"{len(sizes)} batches, {n_workers} workers")
+
+    start = time.perf_counter()
+    blocks, specs = [], {}
+    try:
+        for key, arr in arrays.items():
+            shm, spec = _share_array(arr)
+            blocks.append(shm)
+            specs[key] = spec
+
+        if n_workers == 1:
+            _attach_shared(specs)
+            try:
+                results = [_simulate_batch(task) for task in tasks]
+            finally:
+                for key in specs:
+                    _SHARED.pop(key)
+                    _SHARED.pop(key + '_shm').close()
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_attach_shared,
+                                     initargs=(specs,)) as pool:
+                results = list(pool.map(_simulate_batch, tasks))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    final = np.concatenate([r['final'] for r in results])
+    max_dd = np.concatenate([r['max_drawdown'] for r in results])
+    lowest = np.concatenate([r['lowest'] for r in results])
+
+    report = {
+        'method': method,
+        'n_paths': n_paths,
+        'n_trades': n_trades,
+        'seconds': time.perf_counter() - start,
+        'percentiles': PERCENTILES,
+        'final_pips': np.percentile(final, PERCENTILES).tolist(),
+        'max_drawdown_pips': np.percentile(max_dd, PERCENTILES).tolist(),
+        'lowest_equity_pips': np.percentile(lowest, PERCENTILES).tolist(),
+        'ruin_pips': ruin_pips,
+        'ruin_probability': float(np.mean(lowest <= -ruin_pips)),
+        'prob_loss': float(np.mean(final < 0)),
+        'drawdown_exceedance': {
+            int(level): float(np.mean(max_dd >= level))
+            for level in np.percentile(max_dd, [50, 90, 99]).round(-1)
+        },
+        'historical_final_pips': float(pnl.sum())
+    }
+    print_report(report)
+    return report
+
+
+def print_report(report: Dict):
+    print(f"  {report['n_paths']:,} paths in {report['seconds']:.1f}s; "
+          f"historical total {report['historical_final_pips']:,.0f} pips")
+    header = ''.join(f"{f'p{p}':>10}" for p in report['percentiles'])
+    print(f"  {'':<18}{header}")
+    for key, label in (('final_pips', 'final pnl'), ('max_drawdown_pips', 'max drawdown'),
+                       ('lowest_equity_pips', 'lowest equity')):
+        print(f"  {label:<18}" + ''.join(f"{v:10,.0f}" for v in report[key]))
+    print(f"  P(ruin at -{report['ruin_pips']:,.0f} pips) {report['ruin_probability']:.2%}, "
+          f"P(loss) {report['prob_loss']:.2%}")
+
+
+if __name__ == "__main__":
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+    from src.features import prepare_features
+    from src.regime_detector import RegimeDetector
+    from src.backtest import run_backtest, load_regime_settings
+
+    root = Path(__file__).parent.parent
+    model_path = root / "models" / "regime_detector.joblib"
+    csv_path = root / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if model_path.exists() and csv_path.exists():
+        detector = RegimeDetector.load(str(model_path))
+        df = load_mt5_csv(str(csv_path), use_cache=True)
+        df = prepare_features(create_time_features(clean_data(df)), add_labels=False)
+        regimes = detector.predict(df[detector.feature_columns].values)
+        trades, _ = run_backtest(df, regimes, load_regime_settings(str(root / "config.yaml")))
+
+        pnl, cost = trades['pnl_pips'].values, trades['cost_pips'].values
+        for method in METHODS:
+            run_monte_carlo(pnl, method=method)
+        run_monte_carlo(pnl, cost, spread_pool_from_bars(df), method='block',
+                        spread_scale=1.5, slippage_pips=2.0)
+    else:
+        print("Model or CSV not found. Train the model first.")
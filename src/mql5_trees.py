@@ -0,0 +1,283 @@
+"""
+Native MQL5 Tree Code Generation
+================================
+Emits the whole RegimeDetector ensemble as branch-coded MQL5 functions,
+an ONNX-free inference path for the EA.
+
+The trees come from CompiledEnsemble (tree_inference), so the scaler is
+already folded into every split threshold and the generated functions
+take raw feature values. The include provides:
+
+    void RegimePredictProba(const double &x[], double &proba[])
+    int  RegimePredict(const double &x[], double &confidence)
+
+RandomForest leaves add their class distribution, boosting trees add raw
+scores, and the two are combined with the same soft vote as the
+VotingClassifier (softmax / sigmoid of the boosting scores).
+
+The same walker also emits an equivalent Python module; verify_generated
+executes it against RegimeDetector.predict_proba, so the generator is
+checked without an MQL5 compiler.
+"""
+
+import sys
+import time
+import numpy as np
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+if __name__ == "__main__":
+    # Run as a script (python src/mql5_trees.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.tree_inference import CompiledEnsemble
+
+
+# Python refuses more than 100 indentation levels
+MAX_PYTHON_DEPTH = 90
+
+
+def _literal(value: float) -> str:
+    """Round-trippable double literal (valid MQL5 and Python)"""
+    return '%.17g' % value
+
+
+def _emit_tree(packed: Dict, root: int, leaf: Callable[[np.ndarray], str],
+               lang: str, indent: int) -> List[str]:
+    """
+    Nested if/else for the tree starting at packed node `root`.
+
+    Leaves are the self-looping nodes of the packed table; `leaf` turns a
+    leaf's value row into one statement.
+    """
+    children, feature, threshold = packed['children'], packed['feature'], packed['threshold']
+    lines = []
+
+    def walk(node, depth):
+        pad = '   ' * depth if lang == 'mql5' else '    ' * depth
+        left, right = children[2 * node], children[2 * node + 1]
+        if left == node:
+            lines.append(pad + leaf(packed['value'][node]))
+            return
+        test = f"x[{feature[node]}] <= {_literal(threshold[node])}"
+        if lang == 'mql5':
+            lines.append(f"{pad}if({test}) {{")
+            walk(left, depth + 1)
+            lines.append(f"{pad}}} else {{")
+            walk(right, depth + 1)
+            lines.append(f"{pad}}}")
+        else:
+            lines.append(f"{pad}if {test}:")
+            walk(left, depth + 1)
+            lines.append(f"{pad}else:")
+            walk(right, depth + 1)
+
+    walk(root, indent)
+    return lines
+
+
+def _ensemble_parts(compiled: CompiledEnsemble, lang: str) -> Dict[str, List]:
+    """Per-tree function bodies for both members"""
+    n_classes = compiled.forest['value'].shape[1]
+    n_stages, n_raw = compiled.boost_shape
+    end = ';' if lang == 'mql5' else ''
+
+    def rf_leaf(value):
+        return ' '.join(f"p[{k}] += {_literal(v)};" for k, v in enumerate(value)).rstrip(';') + end
+
+    rf = [_emit_tree(compiled.forest, root, rf_leaf, lang, 1)
+          for root in compiled.forest['roots']]
+
+    gb = []
+    for i, root in enumerate(compiled.boost['roots']):
+        k = i % n_raw  # stage-major order
+        gb.append((k, _emit_tree(compiled.boost, root,
+                                 lambda value, k=k: f"raw[{k}] += {_literal(value[0])}{end}",
+                                 lang, 1)))
+
+    return {'rf': rf, 'gb': gb, 'n_classes': n_classes, 'n_raw': n_raw}
+
+
+def generate_mql5_trees(compiled: CompiledEnsemble) -> str:
+    """MQL5 include source for the full ensemble"""
+    parts = _ensemble_parts(compiled, 'mql5')
+    n_classes, n_raw = parts['n_classes'], parts['n_raw']
+    n_rf, n_gb = len(parts['rf']), len(parts['gb'])
+    w_rf, w_gb = compiled.weights
+
+    out = [
+        '//+------------------------------------------------------------------+',
+        '//|                                                RegimeTrees.mqh   |',
+        '//|                        Auto-generated from ML model export       |',
+        '//+------------------------------------------------------------------+',
+        '#property copyright "Regime Detector ML"',
+        '#property strict',
+        '',
+        '// Native tree ensemble: raw (unscaled) features in, scaler folded',
+        '// into the split thresholds',
+        '#define REGIME_NATIVE_TREES 1',
+        f'#define REGIME_TREE_FEATURES {compiled.n_features}',
+        f'#define REGIME_TREE_CLASSES {n_classes}',
+        f'#define REGIME_RF_TREES {n_rf}',
+        f'#define REGIME_GB_TREES {n_gb}',
+        ''
+    ]
+
+    for i, body in enumerate(parts['rf']):
+        out.append(f'void RegimeRF_{i}(const double &x[], double &p[]) {{')
+        out.extend(body)
+        out.extend(['}', ''])
+
+    for i, (_, body) in enumerate(parts['gb']):
+        out.append(f'void RegimeGB_{i}(const double &x[], double &raw[]) {{')
+        out.extend(body)
+        out.extend(['}', ''])
+
+    baseline = ', '.join(_literal(b) for b in compiled.boost_baseline)
+    out.append('// Soft vote of forest class distribution and boosting probabilities')
+    out.append('void RegimePredictProba(const double &x[], double &proba[]) {')
+    out.append(f'   double p[{n_classes}];')
+    out.append('   ArrayInitialize(p, 0.0);')
+    out.append(f'   double raw[{n_raw}] = {{ {baseline} }};')
+    out.extend(f'   RegimeRF_{i}(x, p);' for i in range(n_rf))
+    out.extend(f'   RegimeGB_{i}(x, raw);' for i in range(n_gb))
+    out.append(f'   double gb[{n_classes}];')
+    if n_raw == 1:
+        out.append('   gb[1] = 1.0 / (1.0 + MathExp(-raw[0]));')
+        out.append('   gb[0] = 1.0 - gb[1];')
+    else:
+        out.append('   double top = raw[0];')
+        out.append(f'   for(int k = 1; k < {n_raw}; k++) top = MathMax(top, raw[k]);')
+        out.append('   double total = 0.0;')
+        out.append(f'   for(int k = 0; k < {n_raw}; k++) {{ gb[k] = MathExp(raw[k] - top); total += gb[k]; }}')
+        out.append(f'   for(int k = 0; k < {n_raw}; k++) gb[k] /= total;')
+    out.append(f'   ArrayResize(proba, {n_classes});')
+    out.append(f'   for(int k = 0; k < {n_classes}; k++)')
+    out.append(f'      proba[k] = {_literal(w_rf)} * p[k] / {n_rf}.0 + {_literal(w_gb)} * gb[k];')
+    out.append('}')
+    out.append('')
+    out.append('// Most likely regime; confidence is its probability in percent')
+    out.append('int RegimePredict(const double &x[], double &confidence) {')
+    out.append('   double proba[];')
+    out.append('   RegimePredictProba(x, proba);')
+    out.append('   int best = ArrayMaximum(proba);')
+    out.append('   confidence = proba[best] * 100.0;')
+    out.append('   return best;')
+    out.append('}')
+    out.append('//+------------------------------------------------------------------+')
+    return '\n'.join(out) + '\n'
+
+
+def generate_python_trees(compiled: CompiledEnsemble) -> str:
+    """Python source equivalent to generate_mql5_trees (for verification)"""
+    depth = max(compiled.forest['depth'], compiled.boost['depth'])
+    if depth > MAX_PYTHON_DEPTH:
+        raise ValueError(f"Trees too deep for the Python emitter: {depth}")
+
+    parts = _ensemble_parts(compiled, 'python')
+    n_classes, n_raw = parts['n_classes'], parts['n_raw']
+    n_rf = len(parts['rf'])
+    w_rf, w_gb = compiled.weights
+
+    out = ['import math', '']
+    for i, body in enumerate(parts['rf']):
+        out.append(f'def rf_{i}(x, p):')
+        out.extend(body)
+        out.append('')
+    for i, (_, body) in enumerate(parts['gb']):
+        out.append(f'def gb_{i}(x, raw):')
+        out.extend(body)
+        out.append('')
+
+    baseline = ', '.join(_literal(b) for b in compiled.boost_baseline)
+    out.append('def predict_proba(x):')
+    out.append(f'    p = [0.0] * {n_classes}')
+    out.append(f'    raw = [{baseline}]')
+    out.extend(f'    rf_{i}(x, p)' for i in range(n_rf))
+    out.extend(f'    gb_{i}(x, raw)' for i in range(len(parts['gb'])))
+    if n_raw == 1:
+        out.append('    p1 = 1.0 / (1.0 + math.exp(-raw[0]))')
+        out.append('    gb = [1.0 - p1, p1]')
+    else:
+        out.append('    top = max(raw)')
+        out.append('    gb = [math.exp(r - top) for r in raw]')
+        out.append('    total = sum(gb)')
+        out.append('    gb = [g / total for g in gb]')
+    out.append(f'    return [{_literal(w_rf)} * p[k] / {n_rf}.0 + {_literal(w_gb)} * gb[k]'
+               f' for k in range({n_classes})]')
+    return '\n'.join(out) + '\n'
+
+
+def verify_generated(detector, X_check: np.ndarray,
+                     compiled: Optional[CompiledEnsemble] = None) -> Dict:
+    """Execute the emitted Python trees and compare with predict_proba"""
+    compiled = compiled or CompiledEnsemble.from_detector(detector)
+    namespace = {}
+    exec(compile(generate_python_trees(compiled), '<regime_trees>', 'exec'), namespace)
+
+    start = time.perf_counter()
+    generated = np.array([namespace['predict_proba'](row) for row in X_check.tolist()])
+    elapsed = time.perf_counter() - start
+
+    expected = detector.predict_proba(X_check)
+    diff = np.abs(generated - expected)
+    report = {
+        'rows': len(X_check),
+        'max_abs_diff': float(diff.max()),
+        'argmax_agreement': float(np.mean(generated.argmax(axis=1) == expected.argmax(axis=1))),
+        'python_us_per_row': elapsed / max(len(X_check), 1) * 1e6
+    }
+    print(f"  Generated trees on {len(X_check):,} rows: max |diff| {report['max_abs_diff']:.2e}, "
+          f"argmax agreement {report['argmax_agreement']:.2%}")
+    return report
+
+
+def create_mt5_trees_include(model_path: str, output_path: str,
+                             X_check: Optional[np.ndarray] = None) -> Optional[Dict]:
+    """
+    Write RegimeTrees.mqh for a saved RegimeDetector.
+
+    Args:
+        model_path: Path to saved .joblib model
+        output_path: Output .mqh path
+        X_check: Optional raw feature rows to verify the generator on
+
+    Returns:
+        verify_generated report (None without X_check)
+    """
+    from src.regime_detector import RegimeDetector
+
+    detector = RegimeDetector.load(model_path)
+    compiled = CompiledEnsemble.from_detector(detector)
+
+    source = generate_mql5_trees(compiled)
+    with open(output_path, 'w') as f:
+        f.write(source)
+    n_nodes = len(compiled.forest['feature']) + len(compiled.boost['feature'])
+    print(f"  MQL5 trees saved: {output_path} ({n_nodes:,} nodes, {len(source) / 1024:.0f} KB)")
+
+    if X_check is None:
+        return None
+    return verify_generated(detector, X_check, compiled)
+
+
+if __name__ == "__main__":
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+    from src.features import prepare_features
+
+    root = Path(__file__).parent.parent
+    model_path = root / "models" / "regime_detector.joblib"
+    csv_path = root / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if model_path.exists():
+        X_check = None
+        if csv_path.exists():
+            import joblib
+            feature_columns = joblib.load(model_path)['feature_columns']
+            df = load_mt5_csv(str(csv_path), use_cache=True)
+            df = prepare_features(create_time_features(clean_data(df)), add_labels=False)
+            X_check = df[feature_columns].values[-1000:]
+        create_mt5_trees_include(str(model_path), str(root / "models" / "RegimeTrees.mqh"),
+                                 X_check)
+    else:
+        print(f"Model not found: {model_path}")
@@ -0,0 +1,163 @@
+"""
+Multi-Timeframe Features
+========================
+Higher-timeframe (H4, D1, ...) bars built from the cleaned base series,
+with the model feature set computed on each and joined back onto the
+base bars.
+
+- Resampling is one pass over int64 timestamps: bucket ids come from
+  integer division, OHLC from ufunc.reduceat over the bucket starts
+- Alignment is index based: every base bar gets the position of the last
+  higher bar that had fully closed by the base bar's own close, and the
+  higher-timeframe columns are gathered with that index (no merges)
+
+A higher bar counts as closed only once its full period has elapsed, so
+a base bar never sees an incomplete H4/D1 bar; rows before the first
+closed higher bar (or its feature warm-up) get NaN.
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+if __name__ == "__main__":
+    # Run as a script (python src/multi_timeframe.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.fast_features import compute_features, TIME_COLUMNS
+from src.features import get_feature_columns
+
+
+TIMEFRAME_MINUTES = {
+    'M1': 1, 'M5': 5, 'M15': 15, 'M30': 30,
+    'H1': 60, 'H4': 240, 'D1': 1440
+}
+
+_NS_PER_MINUTE = 60 * 10**9
+
+
+def _timestamps(df: pd.DataFrame) -> np.ndarray:
+    return df['Date'].values.astype('datetime64[ns]', copy=False).view(np.int64)
+
+
+def infer_timeframe_minutes(df: pd.DataFrame) -> int:
+    """Base bar length in minutes (most common spacing between bars)"""
+    step = np.diff(_timestamps(df[:10_000]))
+    values, counts = np.unique(step[step > 0], return_counts=True)
+    return int(values[counts.argmax()] // _NS_PER_MINUTE)
+
+
+def resample_bars(df: pd.DataFrame, timeframe: str) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Aggregate sorted base bars into `timeframe` bars.
+
+    Buckets are aligned to midnight (as MT5 aligns H4 and D1). Spread is
+    the bucket minimum, matching MT5's per-bar spread.
+
+    Returns:
+        (higher-timeframe bars, position of each base bar's bucket in them)
+    """
+    period = TIMEFRAME_MINUTES[timeframe] * _NS_PER_MINUTE
+    bucket = _timestamps(df) // period
+
+    new_bucket = np.empty(len(bucket), dtype=bool)
+    new_bucket[:1] = True
+    np.not_equal(bucket[1:], bucket[:-1], out=new_bucket[1:])
+    starts = np.flatnonzero(new_bucket)
+    ends = np.append(starts[1:], len(bucket))
+    position = np.cumsum(new_bucket) - 1
+
+    data = {
+        'Date': (bucket[starts] * period).astype('datetime64[ns]'),
+        'Open': df['Open'].values[starts],
+        'High': np.maximum.reduceat(df['High'].values, starts),
+        'Low': np.minimum.reduceat(df['Low'].values, starts),
+        'Close': df['Close'].values[ends - 1]
+    }
+    for col, reduce in (('TickVolume', np.add), ('Volume', np.add), ('Spread', np.minimum)):
+        if col in df.columns:
+            data[col] = reduce.reduceat(df[col].values, starts)
+    return pd.DataFrame(data), position
+
+
+def closed_bar_index(df: pd.DataFrame, position: np.ndarray, timeframe: str,
+                     base_minutes: int) -> np.ndarray:
+    """
+    Index of the last higher bar closed by each base bar's close (-1 = none).
+
+    The base bar's own bucket counts only when that base bar closes at or
+    after the bucket's end time.
+    """
+    period = TIMEFRAME_MINUTES[timeframe] * _NS_PER_MINUTE
+    stamps = _timestamps(df)
+    base_close = stamps + base_minutes * _NS_PER_MINUTE
+    bucket_end = (stamps // period + 1) * period
+    return position - (base_close < bucket_end)
+
+
+def get_mtf_feature_columns(timeframes: List[str],
+                            columns: Optional[List[str]] = None) -> List[str]:
+    """Names of the joined columns, '<feature>_<timeframe>'"""
+    columns = columns or [c for c in get_feature_columns() if c not in TIME_COLUMNS]
+    return [f'{col}_{tf}' for tf in timeframes for col in columns]
+
+
+def add_higher_timeframe_features(df: pd.DataFrame,
+                                  timeframes: List[str] = ('H4', 'D1'),
+                                  columns: Optional[List[str]] = None,
+                                  base_minutes: Optional[int] = None) -> pd.DataFrame:
+    """
+    Join higher-timeframe features onto base bars.
+
+    Args:
+        df: clean_data() output (optionally with time features), sorted
+        timeframes: Higher timeframes to add
+        columns: Features per timeframe (default: get_feature_columns()
+            without the time-of-day columns)
+        base_minutes: Base bar length (default: inferred from Date)
+
+    Returns:
+        df with '<feature>_<timeframe>' columns added; run
+        prepare_features() afterwards, whose dropna() removes the rows
+        before the slowest timeframe has warmed up
+    """
+    columns = columns or [c for c in get_feature_columns() if c not in TIME_COLUMNS]
+    base_minutes = base_minutes or infer_timeframe_minutes(df)
+
+    print(f"Adding higher-timeframe features {list(timeframes)} "
+          f"(base {base_minutes} min)...")
+    joined = {}
+    for tf in timeframes:
+        if TIMEFRAME_MINUTES[tf] <= base_minutes:
+            raise ValueError(f"{tf} is not above the base timeframe ({base_minutes} min)")
+        start = time.perf_counter()
+        bars, position = resample_bars(df, tf)
+        arrays = compute_features(bars, add_labels=False)
+        valid = arrays.pop('_valid')
+
+        # A trailing NaN row makes index -1 (no closed bar yet) gather NaN
+        idx = closed_bar_index(df, position, tf, base_minutes)
+        for col in columns:
+            values = np.append(np.where(valid, arrays[col], np.nan), np.nan)
+            joined[f'{col}_{tf}'] = values[idx]
+        print(f"  {tf}: {len(bars):,} bars, {len(columns)} columns "
+              f"in {time.perf_counter() - start:.2f}s")
+    return pd.concat([df, pd.DataFrame(joined, index=df.index)], axis=1)
+
+
+if __name__ == "__main__":
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+
+    csv_path = Path(__file__).parent.parent / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if csv_path.exists():
+        df = load_mt5_csv(str(csv_path), use_cache=True)
+        df = create_time_features(clean_data(df))
+        df = add_higher_timeframe_features(df, ['H4', 'D1'])
+        cols = get_mtf_feature_columns(['H4', 'D1'])
+        print(df[['Date', 'Close'] + cols[:3]].dropna().head())
+    else:
+        print(f"CSV not found: {csv_path}")
@@ -0,0 +1,258 @@
+"""
+Regime Settings Sweep
+=====================
+Parallel search over the per-regime trading settings
+(atr_sl_mult, atr_tp_mult, trailing_start, min_confidence) using the
+vectorized backtester.
+
+Features, EA signals and predicted regimes are computed once and placed
+in shared memory (see walk_forward); workers evaluate batches of
+settings against them. Results are collected in a compact columnar table
+(float32 metrics, one column per parameter) that can be saved as .npz,
+ranked with top_n, and the winner is written back into the exported
+regime_config.json.
+"""
+
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+if __name__ == "__main__":
+    # Run as a script (python src/param_sweep.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.backtest import REGIME_NAMES, DEFAULT_REGIME_SETTINGS, run_backtest
+from src.hyperparam_search import sample_configs
+from src.walk_forward import _share_array, _attach_shared, _SHARED
+
+
+SETTING_KEYS = ['atr_sl_mult', 'atr_tp_mult', 'trailing_start', 'min_confidence']
+
+# Per-regime value lists; every regime is swept over the same lists
+DEFAULT_SWEEP_SPACE = {
+    'atr_sl_mult': [0.75, 1.0, 1.5, 2.0, 2.5],
+    'atr_tp_mult': [1.0, 1.5, 2.0, 2.5, 3.0, 4.0],
+    'trailing_start': [8, 12, 15, 20, 30],
+    'min_confidence': [55, 60, 70, 80]
+}
+
+METRIC_COLUMNS = ['trades', 'win_rate', 'total_pips', 'expectancy_pips',
+                  'profit_factor', 'max_drawdown_pips', 'avg_r']
+
+_SHARED_COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close', 'Spread']
+_SIGNAL_COLUMNS = ['direction', 'confidence', 'tradeable', 'atr']
+
+
+def expand_space(space: Dict[str, List]) -> Dict[str, List]:
+    """Per-regime space with '<REGIME>__<setting>' keys"""
+    return {f'{regime}__{key}': list(values)
+            for regime in REGIME_NAMES for key, values in space.items()}
+
+
+def config_to_settings(config: Dict, base: Optional[Dict[str, Dict]] = None) -> Dict[str, Dict]:
+    """Flat '<REGIME>__<setting>' config -> regime_settings dict"""
+    settings = {name: dict(values) for name, values in (base or DEFAULT_REGIME_SETTINGS).items()}
+    for key, value in config.items():
+        regime, name = key.split('__', 1)
+        settings[regime][name] = value
+    return settings
+
+
+def _sweep_frame() -> pd.DataFrame:
+    """Bars frame rebuilt once per worker from the shared arrays"""
+    if 'frame' not in _SHARED:
+        _SHARED['frame'] = pd.DataFrame({col: _SHARED[col] for col in _SHARED_COLUMNS
+                                         if col in _SHARED})
+    return _SHARED['frame']
+
+
+def _run_batch(task: Dict) -> List[Dict]:
+    """Backtest a batch of flat configs on the shared arrays"""
+    df = _sweep_frame()
+    signal = {key: _SHARED[f'signal_{key}'] for key in _SIGNAL_COLUMNS}
+    rows = []
+    for config in task['configs']:
+        _, summary = run_backtest(df, _SHARED['regimes'],
+                                  config_to_settings(config, task['base']),
+                                  task['rules'], signal=signal, verbose=False)
+        rows.append({**config, **{m: summary[m] for m in METRIC_COLUMNS}})
+    return rows
+
+
+def run_sweep(df: pd.DataFrame,
+              regime_proba: np.ndarray,
+              space: Optional[Dict[str, List]] = None,
+              n_samples: int = 2000,
+              rules: Optional[Dict] = None,
+              base_settings: Optional[Dict[str, Dict]] = None,
+              batch_size: int = 25,
+              n_workers: Optional[int] = None,
+              seed: int = 42) -> pd.DataFrame:
+    """
+    Evaluate sampled per-regime settings in parallel.
+
+    Args:
+        df: prepare_features() output
+        regime_proba: RegimeDetector.predict_proba rows aligned with df
+        space: Per-setting value lists (default: DEFAULT_SWEEP_SPACE),
+            swept independently for each regime; a dict with
+            '<REGIME>__<setting>' keys is used as is
+        n_samples: Configurations to draw (the full grid if smaller)
+        rules: Overrides for backtest.DEFAULT_RULES
+        base_settings: Values for settings not in the space
+        batch_size: Configurations per worker task
+        n_workers: Worker processes (default: one per CPU)
+        seed: Seed for configuration sampling
+
+    Returns:
+        Columnar results table, one row per configuration
+    """
+    from src.backtest import ea_signals
+
+    space = space or DEFAULT_SWEEP_SPACE
+    if not any('__' in key for key in space):
+        space = expand_space(space)
+    configs = sample_configs(space, n_samples, seed)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    signal = ea_signals(df, rules)
+    arrays = {col: df[col].to_numpy() for col in _SHARED_COLUMNS if col in df.columns}
+    arrays['Date'] = arrays['Date'].astype('datetime64[ns]')
+    arrays['regimes'] = np.asarray(regime_proba).argmax(axis=1).astype(np.int8)
+    arrays.update({f'signal_{key}': signal[key] for key in _SIGNAL_COLUMNS})
+
+    print(f"Regime settings sweep: {len(configs):,} configs over {len(df):,} bars, "
+          f"{n_workers} workers")
+
+    blocks, specs = [], {}
+    start = time.perf_counter()
+    try:
+        for key, arr in arrays.items():
+            shm, spec = _share_array(arr)
+            blocks.append(shm)
+            specs[key] = spec
+
+        tasks = [{'configs': configs[i:i + batch_size], 'base': base_settings,
+                  'rules': rules}
+                 for i in range(0, len(configs), batch_size)]
+        rows = []
+        if n_workers == 1:
+            _attach_shared(specs)
+            try:
+                for task in tasks:
+                    rows.extend(_run_batch(task))
+            finally:
+                _SHARED.pop('frame', None)
+                for key in specs:
+                    _SHARED.pop(key)
+                    _SHARED.pop(key + '_shm').close()
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_attach_shared,
+                                     initargs=(specs,)) as pool:
+                for batch in pool.map(_run_batch, tasks):
+                    rows.extend(batch)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    table = results_table(rows, list(space))
+    elapsed = time.perf_counter() - start
+    print(f"  {len(table):,} configs in {elapsed:.1f}s "
+          f"({elapsed / max(len(table), 1) * 1000:.0f} ms each)")
+    return table
+
+
+def results_table(rows: List[Dict], param_columns: List[str]) -> pd.DataFrame:
+    """Compact columnar table: float32 params/metrics, int32 trade counts"""
+    data = {}
+    for col in param_columns:
+        data[col] = np.array([r[col] for r in rows], dtype=np.float32)
+    for col in METRIC_COLUMNS:
+        dtype = np.int32 if col == 'trades' else np.float32
+        data[col] = np.array([r[col] for r in rows], dtype=dtype)
+    return pd.DataFrame(data)
+
+
+def save_results(table: pd.DataFrame, path: str):
+    """Save the table as one array per column (.npz)"""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(path, **{col: table[col].to_numpy() for col in table.columns})
+
+
+def load_results(path: str) -> pd.DataFrame:
+    with np.load(path) as data:
+        return pd.DataFrame({col: data[col] for col in data.files})
+
+
+def top_n(table: pd.DataFrame, n: int = 10, metric: str = 'profit_factor',
+          min_trades: int = 100) -> pd.DataFrame:
+    """Best n configurations by `metric` among those with enough trades"""
+    eligible = table[(table['trades'] >= min_trades) & np.isfinite(table[metric])]
+    return eligible.nlargest(n, metric)
+
+
+def row_to_settings(row: pd.Series, base: Optional[Dict[str, Dict]] = None) -> Dict[str, Dict]:
+    """Results-table row -> regime_settings dict (native int/float values)"""
+    config = {}
+    for key, value in row.items():
+        if '__' not in key:
+            continue
+        name = key.split('__', 1)[1]
+        config[key] = int(value) if name in ('trailing_start', 'min_confidence') else float(value)
+    return config_to_settings(config, base)
+
+
+def write_best_settings(config_path: str, settings: Dict[str, Dict],
+                        metrics: Optional[Dict] = None):
+    """Write regime settings into an exported regime_config.json"""
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+    for regime, values in settings.items():
+        config['regime_settings'].setdefault(regime, {})
+        config['regime_settings'][regime].update({k: values[k] for k in SETTING_KEYS})
+    if metrics is not None:
+        config['regime_settings_sweep'] = metrics
+    with open(config_path, 'w') as f:
+        json.dump(config, f, indent=2)
+    print(f"  Regime settings written: {config_path}")
+
+
+if __name__ == "__main__":
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+    from src.features import prepare_features
+    from src.regime_detector import RegimeDetector
+    from src.backtest import load_regime_settings
+    from src.export_onnx import create_mt5_include
+
+    root = Path(__file__).parent.parent
+    model_dir = root / "models"
+    csv_path = root / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if (model_dir / "regime_detector.joblib").exists() and csv_path.exists():
+        detector = RegimeDetector.load(str(model_dir / "regime_detector.joblib"))
+        df = load_mt5_csv(str(csv_path), use_cache=True)
+        df = prepare_features(create_time_features(clean_data(df)), add_labels=False)
+        proba = detector.predict_proba(df[detector.feature_columns].values)
+
+        base = load_regime_settings(str(root / "config.yaml"))
+        table = run_sweep(df, proba, base_settings=base)
+        save_results(table, str(model_dir / "sweep_results.npz"))
+
+        best = top_n(table, 10)
+        print(best.to_string(index=False))
+        if len(best) and (model_dir / "regime_config.json").exists():
+            winner = best.iloc[0]
+            write_best_settings(str(model_dir / "regime_config.json"),
+                                row_to_settings(winner, base),
+                                {m: float(winner[m]) for m in METRIC_COLUMNS})
+            create_mt5_include(str(model_dir / "regime_config.json"),
+                               str(model_dir / "RegimeModelConfig.mqh"))
+    else:
+        print("Model or CSV not found. Train the model first.")
@@ -7,21 +7,23 @@ ML model to classify market regime:
 - VOLATILE (2): Be cautious, wider stops or skip
 
 Uses ensemble of simple models for robustness.
+
+sklearn is imported by the methods that need it, so importing this module
+(e.g. for model_matrix) stays cheap.
 """
 
 import numpy as np
 import pandas as pd
 import joblib
+import sys
 from pathlib import Path
 from typing import Tuple, Dict, Optional
-from sklearn.ensemble import (
-    RandomForestClassifier, 
-    GradientBoostingClassifier,
-    VotingClassifier
-)
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
-from sklearn.model_selection import cross_val_score
+
+if __name__ == "__main__":
+    # Run as a script (python src/regime_detector.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.tracing import span, traced
 
 
 class RegimeDetector:
@@ -29,32 +31,81 @@ class RegimeDetector:
     
     REGIME_NAMES = {0: 'RANGING', 1: 'TRENDING', 2: 'VOLATILE'}
     
-    def __init__(self, feature_columns: list):
+    # Defaults for the ensemble members; override per key via model_params
+    DEFAULT_RF_PARAMS = {
+        'n_estimators': 100,
+        'max_depth': 10,
+        'min_samples_split': 20,
+        'min_samples_leaf': 10,
+        'class_weight': 'balanced',
+        'random_state': 42
+    }
+    
+    DEFAULT_GB_PARAMS = {
+        'n_estimators': 100,
+        'max_depth': 5,
+        'learning_rate': 0.1,
+        'min_samples_split': 20,
+        'random_state': 42
+    }
+    
+    # Histogram/binned boosting: multi-threaded, for M5/M1-sized data;
+    # overridden via model_params['hgb']
+    DEFAULT_HGB_PARAMS = {
+        'max_iter': 100,
+        'max_depth': 5,
+        'learning_rate': 0.1,
+        'min_samples_leaf': 20,
+        'early_stopping': False,
+        'random_state': 42
+    }
+    
+    BACKENDS = ('exact', 'hist')
+    
+    def __init__(self, feature_columns: list, n_jobs: int = -1,
+                 model_params: Optional[Dict] = None,
+                 backend: str = 'exact'):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {self.BACKENDS}")
         self.feature_columns = feature_columns
+        self.n_jobs = n_jobs
+        # Boosting member: 'exact' GradientBoosting or 'hist' HistGradientBoosting
+        self.backend = backend
+        # {'rf': {...}, 'gb': {...}, 'hgb': {...}} overrides of the default
+        # parameters; 'gb' applies to the exact backend, 'hgb' to hist
+        self.model_params = model_params or {}
+        from sklearn.preprocessing import StandardScaler
         self.scaler = StandardScaler()
         self.model = None
         self.is_fitted = False
         
-    def _create_ensemble(self) -> VotingClassifier:
+    def _create_ensemble(self) -> 'VotingClassifier':
         """Create ensemble of models"""
-        rf = RandomForestClassifier(
-            n_estimators=100,
-            max_depth=10,
-            min_samples_split=20,
-            min_samples_leaf=10,
-            class_weight='balanced',
-            random_state=42,
-            n_jobs=-1
+        from sklearn.ensemble import (
+            RandomForestClassifier,
+            GradientBoostingClassifier,
+            HistGradientBoostingClassifier,
+            VotingClassifier
         )
         
-        gb = GradientBoostingClassifier(
-            n_estimators=100,
-            max_depth=5,
-            learning_rate=0.1,
-            min_samples_split=20,
-            random_state=42
+        rf = RandomForestClassifier(
+            **{**self.DEFAULT_RF_PARAMS, **self.model_params.get('rf', {})},
+            n_jobs=self.n_jobs
         )
         
+        if self.backend == 'hist':
+            # GradientBoosting keys (n_estimators, subsample, ...) do not
+            # exist on HistGradientBoosting, so hist has its own 'hgb' key
+            if self.model_params.get('gb') and 'hgb' not in self.model_params:
+                print("  Note: model_params['gb'] is ignored by the hist backend; use 'hgb'")
+            gb = HistGradientBoostingClassifier(
+                **{**self.DEFAULT_HGB_PARAMS, **self.model_params.get('hgb', {})}
+            )
+        else:
+            gb = GradientBoostingClassifier(
+                **{**self.DEFAULT_GB_PARAMS, **self.model_params.get('gb', {})}
+            )
+        
         # Voting ensemble
         ensemble = VotingClassifier(
             estimators=[
@@ -66,25 +117,30 @@ class RegimeDetector:
         
         return ensemble
     
+    @traced('fit')
     def fit(self, X_train: np.ndarray, y_train: np.ndarray,
             X_val: Optional[np.ndarray] = None, 
             y_val: Optional[np.ndarray] = None) -> Dict:
         """Train the regime detector"""
+        from sklearn.metrics import classification_report, accuracy_score
         
         print("Training Regime Detector...")
         print(f"  Training samples: {len(X_train):,}")
         print(f"  Features: {X_train.shape[1]}")
         
         # Scale features
-        X_train_scaled = self.scaler.fit_transform(X_train)
+        with span('fit.scale'):
+            X_train_scaled = self.scaler.fit_transform(X_train)
         
         # Create and train model
         self.model = self._create_ensemble()
-        self.model.fit(X_train_scaled, y_train)
+        with span('fit.ensemble', backend=self.backend):
+            self.model.fit(X_train_scaled, y_train)
         self.is_fitted = True
         
         # Training accuracy
-        train_pred = self.model.predict(X_train_scaled)
+        with span('fit.train_predict'):
+            train_pred = self.model.predict(X_train_scaled)
         train_acc = accuracy_score(y_train, train_pred)
         
         results = {
@@ -96,8 +152,9 @@ class RegimeDetector:
         
         # Validation if provided
         if X_val is not None and y_val is not None:
-            X_val_scaled = self.scaler.transform(X_val)
-            val_pred = self.model.predict(X_val_scaled)
+            with span('fit.val_predict'):
+                X_val_scaled = self.scaler.transform(X_val)
+                val_pred = self.model.predict(X_val_scaled)
             val_acc = accuracy_score(y_val, val_pred)
             
             results['val_accuracy'] = val_acc
@@ -112,6 +169,7 @@ class RegimeDetector:
         
         return results
     
+    @traced('predict')
     def predict(self, X: np.ndarray) -> np.ndarray:
         """Predict regime"""
         if not self.is_fitted:
@@ -119,6 +177,7 @@ class RegimeDetector:
         X_scaled = self.scaler.transform(X)
         return self.model.predict(X_scaled)
     
+    @traced('predict_proba')
     def predict_proba(self, X: np.ndarray) -> np.ndarray:
         """Predict regime probabilities"""
         if not self.is_fitted:
@@ -126,8 +185,11 @@ class RegimeDetector:
         X_scaled = self.scaler.transform(X)
         return self.model.predict_proba(X_scaled)
     
+    @traced('evaluate')
     def evaluate(self, X_test: np.ndarray, y_test: np.ndarray) -> Dict:
         """Evaluate on test set"""
+        from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
+        
         X_test_scaled = self.scaler.transform(X_test)
         y_pred = self.model.predict(X_test_scaled)
         y_proba = self.model.predict_proba(X_test_scaled)
@@ -159,12 +221,15 @@ class RegimeDetector:
             'confusion_matrix': cm
         }
     
+    @traced('save')
     def save(self, filepath: str):
         """Save model and scaler"""
         save_dict = {
             'model': self.model,
             'scaler': self.scaler,
             'feature_columns': self.feature_columns,
+            'model_params': self.model_params,
+            'backend': self.backend,
             'is_fitted': self.is_fitted
         }
         joblib.dump(save_dict, filepath)
@@ -174,7 +239,9 @@ class RegimeDetector:
     def load(cls, filepath: str) -> 'RegimeDetector':
         """Load saved model"""
         save_dict = joblib.load(filepath)
-        detector = cls(save_dict['feature_columns'])
+        detector = cls(save_dict['feature_columns'],
+                       model_params=save_dict.get('model_params'),
+                       backend=save_dict.get('backend', 'exact'))
         detector.model = save_dict['model']
         detector.scaler = save_dict['scaler']
         detector.is_fitted = save_dict['is_fitted']
@@ -186,27 +253,87 @@ class RegimeDetector:
         return self.REGIME_NAMES.get(regime_id, 'UNKNOWN')
 
 
+def benchmark_backends(X_train: np.ndarray, y_train: np.ndarray,
+                       X_test: np.ndarray, y_test: np.ndarray) -> Dict[str, Dict]:
+    """Fit/predict throughput and accuracy of each boosting backend"""
+    import contextlib
+    import io
+    import time
+    from sklearn.metrics import accuracy_score
+    
+    results = {}
+    for backend in RegimeDetector.BACKENDS:
+        detector = RegimeDetector(list(range(X_train.shape[1])), backend=backend)
+        
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            detector.fit(X_train, y_train)
+        fit_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        y_pred = detector.predict(X_test)
+        predict_seconds = time.perf_counter() - start
+        
+        results[backend] = {
+            'fit_seconds': fit_seconds,
+            'fit_rows_per_sec': len(X_train) / fit_seconds,
+            'predict_seconds': predict_seconds,
+            'predict_rows_per_sec': len(X_test) / predict_seconds,
+            'accuracy': accuracy_score(y_test, y_pred)
+        }
+    
+    print("Backend benchmark:")
+    print(f"  {'backend':<8} {'fit s':>8} {'fit rows/s':>12} {'pred rows/s':>12} {'accuracy':>9}")
+    for backend, r in results.items():
+        print(f"  {backend:<8} {r['fit_seconds']:8.2f} {r['fit_rows_per_sec']:12,.0f} "
+              f"{r['predict_rows_per_sec']:12,.0f} {r['accuracy']:9.2%}")
+    
+    return results
+
+
+def model_matrix(df: pd.DataFrame, feature_columns: list,
+                 dtype=np.float64) -> np.ndarray:
+    """
+    Feature columns as one C-contiguous (rows, features) array.
+    
+    Filled column by column into a single allocation, where
+    df[cols].values would first copy the column subset and then
+    interleave it. float32 input also spares the trees their own float32
+    copy: sklearn's tree code casts X to float32 anyway.
+    """
+    X = np.empty((len(df), len(feature_columns)), dtype=dtype)
+    for j, col in enumerate(feature_columns):
+        X[:, j] = df[col].values
+    return X
+
+
 def train_regime_detector(
     train_df: pd.DataFrame,
     val_df: pd.DataFrame,
     test_df: pd.DataFrame,
     feature_columns: list,
-    save_path: Optional[str] = None
+    save_path: Optional[str] = None,
+    backend: str = 'exact',
+    dtype_policy='default'
 ) -> Tuple[RegimeDetector, Dict]:
-    """Full training pipeline"""
+    """Full training pipeline (model input dtype from dtype_policy)"""
+    from src.data_pipeline import get_dtype_policy
+    policy = get_dtype_policy(dtype_policy)
+    dtype = policy['feature'] or np.float64
+    label_dtype = policy['label'] or np.int64
     
     # Prepare data
-    X_train = train_df[feature_columns].values
-    y_train = train_df['Regime'].values
+    X_train = model_matrix(train_df, feature_columns, dtype)
+    y_train = train_df['Regime'].to_numpy(dtype=label_dtype)
     
-    X_val = val_df[feature_columns].values
-    y_val = val_df['Regime'].values
+    X_val = model_matrix(val_df, feature_columns, dtype)
+    y_val = val_df['Regime'].to_numpy(dtype=label_dtype)
     
-    X_test = test_df[feature_columns].values
-    y_test = test_df['Regime'].values
+    X_test = model_matrix(test_df, feature_columns, dtype)
+    y_test = test_df['Regime'].to_numpy(dtype=label_dtype)
     
     # Create and train detector
-    detector = RegimeDetector(feature_columns)
+    detector = RegimeDetector(feature_columns, backend=backend)
     train_results = detector.fit(X_train, y_train, X_val, y_val)
     
     # Evaluate on test set
@@ -221,10 +348,6 @@ def train_regime_detector(
 
 if __name__ == "__main__":
     # Test the detector
-    from pathlib import Path
-    import sys
-    sys.path.insert(0, str(Path(__file__).parent.parent))
-    
     from src.data_pipeline import load_mt5_csv, clean_data, create_time_features, split_data
     from src.features import prepare_features, get_feature_columns
     
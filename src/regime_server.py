@@ -0,0 +1,517 @@
+"""
+Regime Inference Server
+=======================
+Local asyncio server that keeps a RegimeDetector and one
+StreamingFeatureState per symbol in memory, so the EA can ask Python for
+the current regime on every new bar.
+
+Protocol: one request per line over TCP (127.0.0.1) or a Unix socket.
+JSON requests ({"op": ...}):
+- bar:     {"op": "bar", "symbol": "XAUUSD", "time": 1704189600,
+            "open": .., "high": .., "low": .., "close": ..}
+           ingest a closed bar, reply with the regime for it
+- predict: {"op": "predict", "symbol": "XAUUSD"}  regime for the last bar
+- warmup:  {"op": "warmup", "symbol": "XAUUSD", "bars": [[time, o, h, l, c], ...]}
+- reload:  {"op": "reload", "path": optional}  hot-swap the model file
+- stats:   latency percentiles and batching counters
+Plain-text form for MQL5 (no JSON parsing on the EA side):
+    BAR <symbol> <unix time> <open> <high> <low> <close>
+    PREDICT <symbol>
+reply "<regime> <confidence %> <name>", with regime -1 during warm-up.
+
+Bars at or before a symbol's last ingested bar time (kept in the state
+snapshots) are skipped, so a client that re-sends its warm-up history
+after a server restart, or repeats a BAR after a reconnect, cannot feed
+the rolling windows twice. A skipped BAR is answered with the regime of
+the last ingested bar and "skipped": true.
+
+Prediction requests from all connections and symbols go through one
+queue; the batcher turns everything waiting (up to max_batch) into a
+single predict_proba call. Requests arriving while a batch runs form the
+next one, so batches grow with load without a fixed wait (max_wait_ms
+adds an optional coalescing window; event-loop timers are ~1 ms coarse).
+By default the model runs as a CompiledEnsemble (tree_inference) inline
+on the loop, far cheaper per call than sklearn for these small batches;
+the sklearn engine runs on a worker thread.
+
+The model file is watched (mtime) and reloaded on a background thread;
+the new model replaces the old one between batches, so connections and
+feature state are kept. A model with different feature columns is
+rejected, since the per-symbol state could not be rebuilt.
+"""
+
+import asyncio
+import contextlib
+import json
+import math
+import os
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+if __name__ == "__main__":
+    # Run as a script (python src/regime_server.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.streaming_features import StreamingFeatureState
+
+
+REGIME_NAMES = {0: 'RANGING', 1: 'TRENDING', 2: 'VOLATILE'}
+
+ENGINES = ('compiled', 'sklearn')
+
+# Request latencies kept for the percentile counters
+LATENCY_WINDOW = 100_000
+
+
+class _LoadedModel:
+    """A loaded detector with its inference engine"""
+
+    def __init__(self, path: str, engine: str, version: int):
+        from src.regime_detector import RegimeDetector
+
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        self.version = version
+        self.detector = RegimeDetector.load(path)
+        self.feature_columns = list(self.detector.feature_columns)
+        if engine == 'compiled':
+            from src.tree_inference import CompiledEnsemble
+            self.predictor = CompiledEnsemble.from_detector(self.detector)
+        else:
+            self.predictor = self.detector
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        return self.predictor.predict_proba(X)
+
+
+def _percentiles_us(samples) -> Dict[str, float]:
+    if not samples:
+        return {'p50_us': math.nan, 'p99_us': math.nan}
+    p50, p99 = np.percentile(np.fromiter(samples, dtype=np.float64), [50, 99])
+    return {'p50_us': float(p50) / 1000, 'p99_us': float(p99) / 1000}
+
+
+def _parse_time(value):
+    """MQL5 datetime (unix seconds) or any pandas-parsable string"""
+    if isinstance(value, (int, float)):
+        return pd.Timestamp(int(value), unit='s')
+    return pd.Timestamp(value)
+
+
+def _is_new_bar(state: StreamingFeatureState, ts: pd.Timestamp) -> bool:
+    """True unless the bar is at or before the state's last ingested bar"""
+    return state.last_time is None or ts > state.last_time
+
+
+class RegimeServer:
+    """Micro-batching regime inference server"""
+
+    def __init__(self, model_path: str,
+                 host: str = '127.0.0.1',
+                 port: int = 5555,
+                 unix_path: Optional[str] = None,
+                 engine: str = 'compiled',
+                 max_batch: int = 256,
+                 max_wait_ms: float = 0.0,
+                 watch_interval: float = 2.0,
+                 state_dir: Optional[str] = None):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}. Use one of {ENGINES}")
+        self.model_path = model_path
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.watch_interval = watch_interval
+        self.state_dir = Path(state_dir) if state_dir else None
+
+        self.model = _LoadedModel(model_path, engine, version=1)
+        self.states: Dict[str, StreamingFeatureState] = {}
+
+        # sklearn predictions on one thread, model loads on another, so a
+        # reload never stalls the batcher
+        self._predict_pool = ThreadPoolExecutor(1, thread_name_prefix='regime-predict')
+        self._load_pool = ThreadPoolExecutor(1, thread_name_prefix='regime-load')
+        self._queue: Optional[asyncio.Queue] = None
+        self._server = None
+        self._reload_lock = None
+
+        self.started = time.time()
+        self.counters = {'requests': 0, 'bars': 0, 'skipped_bars': 0, 'predictions': 0,
+                         'batches': 0, 'max_batch': 0, 'errors': 0, 'reloads': 0, 'connections': 0}
+        self.latency_ns = deque(maxlen=LATENCY_WINDOW)
+        self.batch_ns = deque(maxlen=LATENCY_WINDOW)
+
+    # ------------------------------------------------------------------
+    # Feature state
+    # ------------------------------------------------------------------
+
+    def _state(self, symbol: str) -> StreamingFeatureState:
+        state = self.states.get(symbol)
+        if state is None:
+            snapshot = self.state_dir / f"{symbol}.json" if self.state_dir else None
+            if snapshot is not None and snapshot.exists():
+                state = StreamingFeatureState.load(str(snapshot))
+            if state is None or state.feature_columns != self.model.feature_columns:
+                state = StreamingFeatureState(self.model.feature_columns)
+            self.states[symbol] = state
+        return state
+
+    def save_states(self):
+        """Snapshot every symbol's feature state into state_dir"""
+        if self.state_dir is None:
+            return
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        for symbol, state in self.states.items():
+            state.save(str(self.state_dir / f"{symbol}.json"))
+
+    # ------------------------------------------------------------------
+    # Batching and model swaps
+    # ------------------------------------------------------------------
+
+    async def _predict(self, x: np.ndarray) -> np.ndarray:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((x, future))
+        return await future
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            # Let handlers whose requests were already read queue them too
+            await asyncio.sleep(self.max_wait)
+            while len(items) < self.max_batch and not self._queue.empty():
+                items.append(self._queue.get_nowait())
+
+            X = np.vstack([x for x, _ in items])
+            model = self.model  # swapped only between batches
+            start = time.perf_counter_ns()
+            try:
+                if self.engine == 'compiled':
+                    # ~0.2 ms: cheaper inline than a thread hand-off; requests
+                    # arriving meanwhile form the next batch
+                    proba = model.predict_proba(X)
+                else:
+                    proba = await loop.run_in_executor(self._predict_pool,
+                                                       model.predict_proba, X)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batch_ns.append(time.perf_counter_ns() - start)
+            self.counters['batches'] += 1
+            self.counters['predictions'] += len(items)
+            self.counters['max_batch'] = max(self.counters['max_batch'], len(items))
+            for (_, future), row in zip(items, proba):
+                if not future.done():
+                    future.set_result(row)
+
+    async def reload(self, path: Optional[str] = None) -> Dict:
+        """Load a model file off the event loop and swap it in"""
+        async with self._reload_lock:
+            path = path or self.model_path
+            loop = asyncio.get_running_loop()
+            new = await loop.run_in_executor(self._load_pool, _LoadedModel, path,
+                                             self.engine, self.model.version + 1)
+            if new.feature_columns != self.model.feature_columns:
+                raise ValueError("New model uses different feature columns; "
+                                 "restart the server to rebuild feature state")
+            self.model = new
+            self.model_path = path
+            self.counters['reloads'] += 1
+            print(f"  Model v{new.version} live: {path}")
+            return {'ok': True, 'model_version': new.version, 'path': path}
+
+    async def _watch_model(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                mtime = os.stat(self.model_path).st_mtime
+                if mtime != self.model.mtime:
+                    # Let the writer finish before loading
+                    await asyncio.sleep(0.5)
+                    await self.reload()
+            except Exception as e:
+                self.counters['errors'] += 1
+                print(f"  Model reload failed, keeping v{self.model.version}: {e}")
+
+    # ------------------------------------------------------------------
+    # Requests
+    # ------------------------------------------------------------------
+
+    async def _regime(self, symbol: str, state: StreamingFeatureState) -> Dict:
+        if not state.is_ready:
+            return {'symbol': symbol, 'ready': False, 'regime': -1, 'bars': state.n_bars}
+        proba = await self._predict(state.feature_vector()[None, :])
+        regime = int(np.argmax(proba))
+        return {'symbol': symbol, 'ready': True, 'regime': regime,
+                'name': REGIME_NAMES.get(regime, 'UNKNOWN'),
+                'confidence': float(proba[regime]) * 100, 'proba': proba.tolist(),
+                'model_version': self.model.version}
+
+    async def _handle_json(self, request: Dict) -> Dict:
+        op = request.get('op')
+        if op == 'bar':
+            state = self._state(request['symbol'])
+            ts = _parse_time(request['time'])
+            if _is_new_bar(state, ts):
+                state.update(ts, float(request['open']), float(request['high']),
+                             float(request['low']), float(request['close']))
+                self.counters['bars'] += 1
+                return await self._regime(request['symbol'], state)
+            self.counters['skipped_bars'] += 1
+            return {**await self._regime(request['symbol'], state), 'skipped': True}
+        if op == 'predict':
+            return await self._regime(request['symbol'], self._state(request['symbol']))
+        if op == 'warmup':
+            state = self._state(request['symbol'])
+            skipped = 0
+            for t, o, h, l, c in request['bars']:
+                ts = _parse_time(t)
+                if _is_new_bar(state, ts):
+                    state.update(ts, float(o), float(h), float(l), float(c))
+                else:
+                    skipped += 1
+            self.counters['bars'] += len(request['bars']) - skipped
+            self.counters['skipped_bars'] += skipped
+            return {'symbol': request['symbol'], 'bars': state.n_bars,
+                    'skipped': skipped, 'ready': state.is_ready}
+        if op == 'reload':
+            return await self.reload(request.get('path'))
+        if op == 'stats':
+            return self.stats()
+        if op == 'ping':
+            return {'ok': True}
+        raise ValueError(f"Unknown op: {op}")
+
+    async def _handle_text(self, parts: List[str]) -> str:
+        command = parts[0].upper()
+        if command == 'BAR' and len(parts) == 7:
+            request = {'op': 'bar', 'symbol': parts[1], 'time': float(parts[2]),
+                       'open': parts[3], 'high': parts[4], 'low': parts[5], 'close': parts[6]}
+        elif command == 'PREDICT' and len(parts) == 2:
+            request = {'op': 'predict', 'symbol': parts[1]}
+        else:
+            raise ValueError(f"Bad request: {' '.join(parts)}")
+        reply = await self._handle_json(request)
+        if not reply['ready']:
+            return "-1 0 WARMUP"
+        return f"{reply['regime']} {reply['confidence']:.2f} {reply['name']}"
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.counters['connections'] += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start = time.perf_counter_ns()
+                text = line.decode().strip()
+                if not text:
+                    continue
+                self.counters['requests'] += 1
+                try:
+                    if text.startswith('{'):
+                        reply = json.dumps(await self._handle_json(json.loads(text)))
+                    else:
+                        reply = await self._handle_text(text.split())
+                except Exception as e:
+                    self.counters['errors'] += 1
+                    reply = json.dumps({'error': f"{type(e).__name__}: {e}"})
+                writer.write(reply.encode() + b'\n')
+                await writer.drain()
+                self.latency_ns.append(time.perf_counter_ns() - start)
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            self.counters['connections'] -= 1
+            writer.close()
+
+    def stats(self) -> Dict:
+        batches = max(self.counters['batches'], 1)
+        return {
+            **self.counters,
+            'mean_batch': self.counters['predictions'] / batches,
+            'latency': _percentiles_us(self.latency_ns),
+            'batch_predict': _percentiles_us(self.batch_ns),
+            'symbols': len(self.states),
+            'model_version': self.model.version,
+            'model_path': self.model_path,
+            'engine': self.engine,
+            'uptime_seconds': time.time() - self.started
+        }
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._reload_lock = asyncio.Lock()
+        if self.unix_path:
+            self._server = await asyncio.start_unix_server(self._handle_client, self.unix_path)
+            where = self.unix_path
+        else:
+            self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+            where = f"{self.host}:{self.port}"
+        self._tasks = [asyncio.create_task(self._batcher())]
+        if self.watch_interval:
+            self._tasks.append(asyncio.create_task(self._watch_model()))
+        print(f"Regime server on {where} ({self.engine} engine, "
+              f"{len(self.model.feature_columns)} features, max batch {self.max_batch})")
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        for task in self._tasks:
+            task.cancel()
+        self._predict_pool.shutdown()
+        self._load_pool.shutdown()
+        self.save_states()
+
+    async def serve_forever(self):
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with contextlib.suppress(NotImplementedError):  # Windows
+                loop.add_signal_handler(sig, self._server.close)
+        try:
+            await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self.stop()
+        print("Regime server stopped")
+
+
+def run_server(model_path: str, **kwargs):
+    """Blocking entry point; SIGINT/SIGTERM stop it and save feature state"""
+    asyncio.run(RegimeServer(model_path, **kwargs).serve_forever())
+
+
+# ----------------------------------------------------------------------
+# Load-test client
+# ----------------------------------------------------------------------
+
+def _synthetic_bars(n: int, seed: int) -> List[List[float]]:
+    """Random-walk H1 bars as [unix time, open, high, low, close] rows"""
+    rng = np.random.default_rng(seed)
+    close = 2000 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    wick = np.abs(rng.normal(0, 0.001, (2, n))) * close
+    high = np.maximum(open_, close) + wick[0]
+    low = np.minimum(open_, close) - wick[1]
+    times = 1_600_000_000 + 3600 * np.arange(n)
+    return np.column_stack([times, open_, high, low, close]).tolist()
+
+
+async def _client_session(host: str, port: int, symbols: List[str], n_bars: int,
+                          warmup_bars: int, text: bool, latencies: List[int], seed: int):
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def call(line: str) -> str:
+        writer.write(line.encode() + b'\n')
+        await writer.drain()
+        return (await reader.readline()).decode()
+
+    bars = {s: _synthetic_bars(warmup_bars + n_bars, seed + i) for i, s in enumerate(symbols)}
+    for symbol in symbols:
+        await call(json.dumps({'op': 'warmup', 'symbol': symbol,
+                               'bars': bars[symbol][:warmup_bars]}))
+
+    errors = 0
+    for k in range(warmup_bars, warmup_bars + n_bars):
+        for symbol in symbols:
+            t, o, h, l, c = bars[symbol][k]
+            if text:
+                line = f"BAR {symbol} {int(t)} {o:.5f} {h:.5f} {l:.5f} {c:.5f}"
+            else:
+                line = json.dumps({'op': 'bar', 'symbol': symbol, 'time': int(t),
+                                   'open': o, 'high': h, 'low': l, 'close': c})
+            start = time.perf_counter_ns()
+            reply = await call(line)
+            latencies.append(time.perf_counter_ns() - start)
+            errors += 'error' in reply
+    writer.close()
+    return errors
+
+
+async def _load_test(host: str, port: int, n_clients: int, symbols_per_client: int,
+                     n_bars: int, warmup_bars: int, text: bool) -> Dict:
+    latencies: List[int] = []
+    sessions = [
+        _client_session(host, port, [f"SYM{c}_{s}" for s in range(symbols_per_client)],
+                        n_bars, warmup_bars, text, latencies, seed=c * 1000)
+        for c in range(n_clients)
+    ]
+    start = time.perf_counter()
+    errors = sum(await asyncio.gather(*sessions))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"op": "stats"}\n')
+    server_stats = json.loads(await reader.readline())
+    writer.close()
+
+    # Warm-up requests are included in the wall time but not the latencies
+    return {
+        'clients': n_clients,
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': elapsed,
+        'requests_per_sec': len(latencies) / elapsed,
+        'client_latency': _percentiles_us(latencies),
+        'server': server_stats
+    }
+
+
+def run_load_test(host: str = '127.0.0.1', port: int = 5555, n_clients: int = 8,
+                  symbols_per_client: int = 2, n_bars: int = 500,
+                  warmup_bars: int = 600, text: bool = False) -> Dict:
+    """
+    Drive a running server with concurrent clients sending bar updates.
+
+    Each client owns its symbols, warms them up, then sends n_bars bar
+    requests per symbol, waiting for every reply (as an EA would).
+    """
+    report = asyncio.run(_load_test(host, port, n_clients, symbols_per_client,
+                                    n_bars, warmup_bars, text))
+    server = report['server']
+    print(f"Load test: {report['clients']} clients, {report['requests']:,} bar requests "
+          f"in {report['seconds']:.1f}s ({report['requests_per_sec']:,.0f} req/s), "
+          f"{report['errors']} errors")
+    print(f"  Client latency p50 {report['client_latency']['p50_us']:.0f}us "
+          f"p99 {report['client_latency']['p99_us']:.0f}us")
+    print(f"  Server latency p50 {server['latency']['p50_us']:.0f}us "
+          f"p99 {server['latency']['p99_us']:.0f}us; mean batch {server['mean_batch']:.1f} "
+          f"(max {server['max_batch']}), batch predict p50 "
+          f"{server['batch_predict']['p50_us']:.0f}us")
+    return report
+
+
+if __name__ == "__main__":
+    import yaml
+
+    root = Path(__file__).parent.parent
+    model_path = root / "models" / "regime_detector.joblib"
+    with open(root / "config.yaml", 'r') as f:
+        settings = yaml.safe_load(f).get('server', {})
+    settings['state_dir'] = str(root / settings.get('state_dir', 'models/feature_state'))
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'loadtest':
+        run_load_test(settings.get('host', '127.0.0.1'), settings.get('port', 5555))
+    elif model_path.exists():
+        run_server(str(model_path), **settings)
+    else:
+        print(f"Model not found: {model_path}")
@@ -0,0 +1,416 @@
+"""
+Streaming Feature State
+=======================
+Incremental, O(1)-per-bar computation of the model feature vector.
+
+StreamingFeatureState ingests one OHLC bar at a time and keeps ring
+buffers with running sums, EMA state and monotonic min/max deques, so the
+get_feature_columns() vector for the newest bar is available without
+recomputing any history. This is what drives RegimeDetector.predict_proba
+on live bars.
+
+Values match prepare_features() run over the same bars. EMA-based
+features are seeded from the first bar seen, exactly like pandas'
+ewm(adjust=False), so warm up on at least ~500 bars for them to converge
+to the full-history values.
+"""
+
+import json
+import math
+import sys
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+if __name__ == "__main__":
+    # Run as a script (python src/streaming_features.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.features import get_feature_columns
+
+
+SNAPSHOT_VERSION = 1
+
+EMA_SPANS = (5, 10, 12, 20, 26, 50)
+
+
+class _RollingWindow:
+    """Fixed-size window with running sum and sum of squares"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.values = deque(maxlen=size)
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._bad = 0
+        self._since_resync = 0
+
+    def push(self, x: float):
+        if len(self.values) == self.size:
+            old = self.values[0]
+            if math.isfinite(old):
+                self._sum -= old
+                self._sumsq -= old * old
+            else:
+                self._bad -= 1
+        self.values.append(x)
+        if math.isfinite(x):
+            self._sum += x
+            self._sumsq += x * x
+        else:
+            self._bad += 1
+
+        # Re-derive the running sums once per window length so rounding
+        # error never accumulates (amortised O(1))
+        self._since_resync += 1
+        if self._since_resync >= self.size:
+            self._resync()
+
+    def _resync(self):
+        finite = [v for v in self.values if math.isfinite(v)]
+        self._sum = math.fsum(finite)
+        self._sumsq = math.fsum(v * v for v in finite)
+        self._bad = len(self.values) - len(finite)
+        self._since_resync = 0
+
+    @property
+    def full(self) -> bool:
+        return len(self.values) == self.size
+
+    def mean(self) -> float:
+        if not self.full:
+            return math.nan
+        if self._bad:
+            # NaN/inf semantics identical to pandas' rolling sum
+            return float(np.sum(np.array(self.values)) / self.size)
+        return self._sum / self.size
+
+    def std(self) -> float:
+        if not self.full:
+            return math.nan
+        if self._bad:
+            return math.nan
+        var = (self._sumsq - self._sum * self._sum / self.size) / (self.size - 1)
+        return math.sqrt(max(var, 0.0))
+
+    def to_dict(self) -> Dict:
+        return {'size': self.size, 'values': list(self.values)}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> '_RollingWindow':
+        window = cls(data['size'])
+        window.values.extend(data['values'])
+        window._resync()
+        return window
+
+
+class _RollingExtreme:
+    """Rolling min or max over a fixed window via a monotonic deque"""
+
+    def __init__(self, size: int, mode: str):
+        self.size = size
+        self.mode = mode
+        self.count = 0
+        self.candidates = deque()  # (bar index, value)
+
+    def push(self, x: float):
+        worse = (lambda a, b: a >= b) if self.mode == 'min' else (lambda a, b: a <= b)
+        while self.candidates and worse(self.candidates[-1][1], x):
+            self.candidates.pop()
+        self.candidates.append((self.count, x))
+        self.count += 1
+        while self.candidates[0][0] <= self.count - 1 - self.size:
+            self.candidates.popleft()
+
+    def value(self) -> float:
+        if self.count < self.size:
+            return math.nan
+        return self.candidates[0][1]
+
+    def to_dict(self) -> Dict:
+        return {
+            'size': self.size, 'mode': self.mode, 'count': self.count,
+            'candidates': [list(c) for c in self.candidates]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> '_RollingExtreme':
+        extreme = cls(data['size'], data['mode'])
+        extreme.count = data['count']
+        extreme.candidates.extend(tuple(c) for c in data['candidates'])
+        return extreme
+
+
+def _div(a: float, b: float) -> float:
+    """a / b with pandas/NumPy float semantics (x/0 -> +/-inf, 0/0 -> NaN)"""
+    if b == 0:
+        if a == 0 or math.isnan(a):
+            return math.nan
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+    return a / b
+
+
+def _nan_if_zero(x: float) -> float:
+    return math.nan if x == 0 else x
+
+
+class StreamingFeatureState:
+    """Incremental feature state for live regime inference"""
+
+    def __init__(self, feature_columns: Optional[List[str]] = None):
+        self.feature_columns = feature_columns or get_feature_columns()
+        self.n_bars = 0
+        # Time of the last ingested bar (None before the first)
+        self.last_time: Optional[pd.Timestamp] = None
+
+        self.prev_close = math.nan
+        self.prev_high = math.nan
+        self.prev_low = math.nan
+
+        self.closes = deque(maxlen=21)          # ROC_20 needs Close[t-20]
+        self.sma20_hist = deque(maxlen=6)       # SMA20_Slope lag 5
+        self.sma50_hist = deque(maxlen=11)      # SMA50_Slope lag 10
+
+        self.returns = {p: _RollingWindow(p) for p in (5, 10, 20)}
+        self.tr = {p: _RollingWindow(p) for p in (5, 10, 14, 20)}
+        self.close_win = {p: _RollingWindow(p) for p in (20, 50)}
+        self.plus_dm = _RollingWindow(14)
+        self.minus_dm = _RollingWindow(14)
+        self.dx = _RollingWindow(14)
+        self.gain = _RollingWindow(14)
+        self.loss = _RollingWindow(14)
+        self.low14 = _RollingExtreme(14, 'min')
+        self.high14 = _RollingExtreme(14, 'max')
+
+        self.ema = {p: math.nan for p in EMA_SPANS}
+        self.macd_signal = math.nan
+
+        self.last_features: Dict[str, float] = {}
+
+    @staticmethod
+    def _ema_step(prev: float, x: float, span: int) -> float:
+        if math.isnan(prev):
+            return x
+        alpha = 2.0 / (span + 1.0)
+        return (1.0 - alpha) * prev + alpha * x
+
+    def update(self, timestamp, open_: float, high: float,
+               low: float, close: float) -> np.ndarray:
+        """Ingest one bar and return its feature vector"""
+        f = {}
+        pc = self.prev_close
+
+        # Price
+        ret = _div(close, pc) - 1.0 if not math.isnan(pc) else math.nan
+        rng = high - low
+        f['RangePercent'] = _div(rng, close)
+        f['BodyPercent'] = _div(abs(close - open_), _nan_if_zero(rng))
+
+        # Volatility
+        if math.isnan(pc):
+            tr = rng
+        else:
+            tr = max(rng, abs(high - pc), abs(low - pc))
+        for win in self.tr.values():
+            win.push(tr)
+        for win in self.returns.values():
+            win.push(ret)
+
+        atr = {p: win.mean() for p, win in self.tr.items()}
+        vol = {p: win.std() for p, win in self.returns.items()}
+        for p in (5, 10, 20):
+            f[f'ATR_{p}_Pct'] = _div(atr[p], close)
+            f[f'Volatility_{p}'] = vol[p]
+        f['VolatilityRatio'] = _div(vol[5], _nan_if_zero(vol[20]))
+        f['ATRRatio'] = _div(atr[5], _nan_if_zero(atr[20]))
+
+        # Trend
+        for win in self.close_win.values():
+            win.push(close)
+        sma20 = self.close_win[20].mean()
+        sma50 = self.close_win[50].mean()
+        self.sma20_hist.append(sma20)
+        self.sma50_hist.append(sma50)
+        f['PriceVsSMA20'] = _div(close - sma20, sma20)
+        f['PriceVsSMA50'] = _div(close - sma50, sma50)
+        sma20_lag = self.sma20_hist[0] if len(self.sma20_hist) == 6 else math.nan
+        sma50_lag = self.sma50_hist[0] if len(self.sma50_hist) == 11 else math.nan
+        f['SMA20_Slope'] = _div(sma20 - sma20_lag, sma20_lag)
+        f['SMA50_Slope'] = _div(sma50 - sma50_lag, sma50_lag)
+
+        for p in EMA_SPANS:
+            self.ema[p] = self._ema_step(self.ema[p], close, p)
+        e = self.ema
+        f['MA_Alignment'] = (int(e[5] > e[10]) + int(e[10] > e[20]) + int(e[20] > e[50])) - 1.5
+
+        plus_dm = high - self.prev_high
+        minus_dm = self.prev_low - low
+        plus_dm = 0.0 if plus_dm < 0 else plus_dm
+        minus_dm = 0.0 if minus_dm < 0 else minus_dm
+        self.plus_dm.push(plus_dm)
+        self.minus_dm.push(minus_dm)
+        plus_di = 100 * _div(self.plus_dm.mean(), atr[14])
+        minus_di = 100 * _div(self.minus_dm.mean(), atr[14])
+        dx = 100 * _div(abs(plus_di - minus_di), _nan_if_zero(plus_di + minus_di))
+        self.dx.push(dx)
+        f['ADX'] = self.dx.mean()
+        f['DI_Diff'] = plus_di - minus_di
+
+        # Momentum
+        delta = close - pc
+        self.gain.push(delta if delta > 0 else 0.0)
+        self.loss.push(-delta if delta < 0 else 0.0)
+        rs = _div(self.gain.mean(), _nan_if_zero(self.loss.mean()))
+        rsi = 100 - _div(100, 1 + rs)
+        f['RSI'] = rsi
+        f['RSI_Extreme'] = int(rsi < 30 or rsi > 70)
+
+        macd = e[12] - e[26]
+        self.macd_signal = self._ema_step(self.macd_signal, macd, 9)
+        f['MACD_Hist'] = macd - self.macd_signal
+
+        self.low14.push(low)
+        self.high14.push(high)
+        low14 = self.low14.value()
+        high14 = self.high14.value()
+        f['Stoch_K'] = 100 * _div(close - low14, _nan_if_zero(high14 - low14))
+
+        self.closes.append(close)
+        for p in (5, 10, 20):
+            lag = self.closes[-1 - p] if len(self.closes) > p else math.nan
+            f[f'ROC_{p}'] = _div(close - lag, lag)
+
+        # Time
+        ts = pd.Timestamp(timestamp)
+        hour = ts.hour
+        f['Hour'] = hour
+        f['DayOfWeek'] = ts.dayofweek
+        f['IsAsianSession'] = int(0 <= hour < 8)
+        f['IsLondonSession'] = int(8 <= hour < 16)
+        f['IsNYSession'] = int(13 <= hour < 22)
+        f['IsOverlap'] = int(13 <= hour < 16)
+
+        self.prev_close = close
+        self.prev_high = high
+        self.prev_low = low
+        self.n_bars += 1
+        self.last_time = ts
+        self.last_features = f
+
+        return self.feature_vector()
+
+    def feature_vector(self) -> np.ndarray:
+        """Feature vector of the last ingested bar, in feature_columns order"""
+        return np.array(
+            [self.last_features.get(col, math.nan) for col in self.feature_columns],
+            dtype=np.float64
+        )
+
+    @property
+    def is_ready(self) -> bool:
+        """True once every feature of the last bar is defined"""
+        return bool(self.last_features) and not np.isnan(self.feature_vector()).any()
+
+    def warm_up(self, df: pd.DataFrame) -> np.ndarray:
+        """Ingest a historical block of bars; returns the last feature vector"""
+        vec = self.feature_vector()
+        for row in zip(df['Date'].values, df['Open'].values, df['High'].values,
+                       df['Low'].values, df['Close'].values):
+            vec = self.update(*row)
+        print(f"Warmed up streaming features on {len(df):,} bars")
+        return vec
+
+    def to_dict(self) -> Dict:
+        """Serializable snapshot of the full state"""
+        return {
+            'version': SNAPSHOT_VERSION,
+            'feature_columns': self.feature_columns,
+            'n_bars': self.n_bars,
+            'last_time': self.last_time.isoformat() if self.last_time is not None else None,
+            'prev': [self.prev_close, self.prev_high, self.prev_low],
+            'closes': list(self.closes),
+            'sma20_hist': list(self.sma20_hist),
+            'sma50_hist': list(self.sma50_hist),
+            'returns': {p: w.to_dict() for p, w in self.returns.items()},
+            'tr': {p: w.to_dict() for p, w in self.tr.items()},
+            'close_win': {p: w.to_dict() for p, w in self.close_win.items()},
+            'windows': {
+                name: getattr(self, name).to_dict()
+                for name in ('plus_dm', 'minus_dm', 'dx', 'gain', 'loss')
+            },
+            'low14': self.low14.to_dict(),
+            'high14': self.high14.to_dict(),
+            'ema': self.ema,
+            'macd_signal': self.macd_signal,
+            'last_features': self.last_features
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'StreamingFeatureState':
+        """Restore a state produced by to_dict()"""
+        if data.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version: {data.get('version')}")
+        state = cls(data['feature_columns'])
+        state.n_bars = data['n_bars']
+        if data.get('last_time') is not None:
+            state.last_time = pd.Timestamp(data['last_time'])
+        state.prev_close, state.prev_high, state.prev_low = data['prev']
+        state.closes.extend(data['closes'])
+        state.sma20_hist.extend(data['sma20_hist'])
+        state.sma50_hist.extend(data['sma50_hist'])
+        # JSON turns int keys into strings
+        state.returns = {int(p): _RollingWindow.from_dict(w) for p, w in data['returns'].items()}
+        state.tr = {int(p): _RollingWindow.from_dict(w) for p, w in data['tr'].items()}
+        state.close_win = {int(p): _RollingWindow.from_dict(w) for p, w in data['close_win'].items()}
+        for name, w in data['windows'].items():
+            setattr(state, name, _RollingWindow.from_dict(w))
+        state.low14 = _RollingExtreme.from_dict(data['low14'])
+        state.high14 = _RollingExtreme.from_dict(data['high14'])
+        state.ema = {int(p): v for p, v in data['ema'].items()}
+        state.macd_signal = data['macd_signal']
+        state.last_features = data['last_features']
+        return state
+
+    def save(self, filepath: str):
+        """Save snapshot as JSON"""
+        with open(filepath, 'w') as f:
+            json.dump(self.to_dict(), f)
+        print(f"Feature state saved to: {filepath}")
+
+    @classmethod
+    def load(cls, filepath: str) -> 'StreamingFeatureState':
+        """Load snapshot saved with save()"""
+        with open(filepath, 'r') as f:
+            state = cls.from_dict(json.load(f))
+        print(f"Feature state loaded from: {filepath}")
+        return state
+
+
+if __name__ == "__main__":
+    # Check streaming features against the batch pipeline
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+    from src.features import (
+        add_price_features, add_volatility_features,
+        add_trend_features, add_momentum_features
+    )
+
+    csv_path = Path(__file__).parent.parent / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if csv_path.exists():
+        df = load_mt5_csv(str(csv_path), use_cache=True)
+        df = clean_data(df)
+        df = create_time_features(df).tail(2000).reset_index(drop=True)
+
+        batch = add_momentum_features(add_trend_features(
+            add_volatility_features(add_price_features(df))))
+
+        state = StreamingFeatureState()
+        state.warm_up(df)
+        expected = batch[state.feature_columns].iloc[-1].values.astype(np.float64)
+        diff = np.abs(state.feature_vector() - expected)
+        print(f"Max abs difference vs batch: {np.nanmax(diff):.2e}")
+    else:
+        print(f"CSV not found: {csv_path}")
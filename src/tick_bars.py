@@ -0,0 +1,294 @@
+"""
+Tick-to-Bar Aggregation
+=======================
+Builds OHLC bars directly from MT5 tick exports
+(<DATE> <TIME> <BID> <ASK> <LAST> <VOLUME> <FLAGS>).
+
+Bar types:
+- 'time':   fixed timeframe buckets (M1 ... D1), aligned like MT5 bars
+- 'tick':   every `size` ticks
+- 'volume': every `size` units of real volume (exports with <VOLUME>),
+            split where cumulative volume crosses a multiple of `size`
+
+Prices are bid prices, as on MT5 charts. Spread is measured per tick
+from ask - bid, so every bar carries its real average and maximum spread
+in points. Output columns follow load_mt5_csv (Date, Open, High, Low,
+Close, TickVolume, Volume, Spread), with Spread the rounded average, plus
+SpreadAvg and SpreadMax; the result feeds clean_data(),
+create_time_features() and prepare_features() unchanged.
+
+The file is streamed in chunks. Each chunk is aggregated in one
+vectorized pass (bucket ids + ufunc.reduceat); only the running
+aggregates of the last, still-open bar carry over to the next chunk.
+"""
+
+import io
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+if __name__ == "__main__":
+    # Run as a script (python src/tick_bars.py): make `src` importable
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.multi_timeframe import TIMEFRAME_MINUTES
+
+
+BAR_TYPES = ('time', 'tick', 'volume')
+
+_NS_PER_MINUTE = 60 * 10**9
+
+_AGG_COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close', 'TickVolume', 'Volume',
+                'SpreadSum', 'SpreadMax']
+
+
+def _read_header(filepath: str) -> List[str]:
+    with open(filepath, 'rb') as f:
+        header = f.readline().decode().strip().split('\t')
+    if header[:2] != ['<DATE>', '<TIME>'] or not {'<BID>', '<ASK>'} <= set(header):
+        raise ValueError(f"Not an MT5 tick export (<DATE> <TIME> <BID> <ASK> ...): {filepath}")
+    return header
+
+
+def _parse_times(buf: np.ndarray, starts: np.ndarray, has_ms: bool) -> np.ndarray:
+    """
+    int64 ns timestamps from lines starting 'YYYY.MM.DD\tHH:MM:SS[.fff]'.
+
+    Decoded from the digit bytes at fixed offsets. Dates change rarely,
+    so only the first line of each run of equal dates goes through
+    to_datetime.
+    """
+    def number(*offsets):
+        value = np.zeros(len(starts), dtype=np.int64)
+        for off in offsets:
+            value *= 10
+            value += buf[starts + off]
+            value -= ord('0')
+        return value
+
+    ymd = number(0, 1, 2, 3, 5, 6, 8, 9)
+    change = np.flatnonzero(np.diff(ymd)) + 1
+    runs = np.concatenate(([0], change))
+    days = pd.to_datetime(ymd[runs].astype(str), format='%Y%m%d').values
+    stamps = np.repeat(days.astype('datetime64[ns]').view(np.int64),
+                       np.diff(np.append(runs, len(ymd))))
+
+    seconds = number(11, 12) * 3600 + number(14, 15) * 60 + number(17, 18)
+    stamps += seconds * 10**9
+    if has_ms:
+        stamps += number(20, 21, 22) * 10**6
+    return stamps
+
+
+def _iter_tick_blocks(filepath: str, chunk_bytes: int) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Raw tick columns from whole-line byte blocks of the export.
+
+    Timestamps are decoded from the bytes directly; only the numeric
+    columns go through read_csv, which skips building string objects.
+    """
+    header = _read_header(filepath)
+    numeric = {c: header.index(c) for c in ('<BID>', '<ASK>', '<VOLUME>') if c in header}
+    tail = b''
+    has_ms = None
+    with open(filepath, 'rb') as f:
+        f.readline()
+        while True:
+            data = f.read(chunk_bytes)
+            block = tail + data
+            if data:
+                cut = block.rfind(b'\n') + 1
+                block, tail = block[:cut], block[cut:]
+            # One line per '\n': blank trailing lines would be skipped by read_csv
+            block = block.rstrip(b'\r\n')
+            if block:
+                block += b'\n'
+                buf = np.frombuffer(block, dtype=np.uint8)
+                starts = np.concatenate(([0], np.flatnonzero(buf == ord('\n'))[:-1] + 1))
+                if has_ms is None:
+                    has_ms = block[19:20] == b'.'
+                cols = pd.read_csv(io.BytesIO(block), sep='\t', header=None,
+                                   usecols=list(numeric.values()), dtype=np.float64)
+                yield {
+                    'stamps': _parse_times(buf, starts, has_ms),
+                    'bid': cols[numeric['<BID>']].values,
+                    'ask': cols[numeric['<ASK>']].values,
+                    'volume': (np.nan_to_num(cols[numeric['<VOLUME>']].values)
+                               if '<VOLUME>' in numeric else np.zeros(len(cols)))
+                }
+            if not data:
+                return
+
+
+def _ffill(values: np.ndarray, last: float) -> np.ndarray:
+    """Forward-fill NaN (MT5 leaves unchanged bid/ask empty), seeded with last"""
+    values = np.concatenate(([last], values))
+    idx = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    return values[idx][1:]
+
+
+def _aggregate(stamps: np.ndarray, bid: np.ndarray, spread: np.ndarray,
+               volume: np.ndarray, keys: np.ndarray,
+               period: Optional[int]) -> Dict[str, np.ndarray]:
+    """One row of running aggregates per run of equal keys"""
+    n = len(keys)
+    new_bar = np.empty(n, dtype=bool)
+    new_bar[:1] = True
+    np.not_equal(keys[1:], keys[:-1], out=new_bar[1:])
+    starts = np.flatnonzero(new_bar)
+    ends = np.append(starts[1:], n)
+    return {
+        'key': keys[starts],
+        # Time bars are stamped with the bucket start, like MT5; tick and
+        # volume bars with their first tick
+        'Date': keys[starts] * period if period else stamps[starts],
+        'Open': bid[starts],
+        'High': np.maximum.reduceat(bid, starts),
+        'Low': np.minimum.reduceat(bid, starts),
+        'Close': bid[ends - 1],
+        'TickVolume': ends - starts,
+        'Volume': np.add.reduceat(volume, starts),
+        'SpreadSum': np.add.reduceat(spread, starts),
+        'SpreadMax': np.maximum.reduceat(spread, starts)
+    }
+
+
+def _merge_open_bar(carry: Dict[str, np.ndarray], bars: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Fold the previous chunk's open bar into this chunk's bars"""
+    if carry['key'][0] != bars['key'][0]:
+        return {col: np.concatenate((carry[col], bars[col])) for col in bars}
+    bars = {col: values.copy() for col, values in bars.items()}
+    for col in ('Date', 'Open'):
+        bars[col][0] = carry[col][0]
+    for col in ('TickVolume', 'Volume', 'SpreadSum'):
+        bars[col][0] += carry[col][0]
+    for col, fn in (('High', max), ('SpreadMax', max), ('Low', min)):
+        bars[col][0] = fn(bars[col][0], carry[col][0])
+    return bars
+
+
+def _to_frame(bars: Dict[str, np.ndarray], point: float) -> pd.DataFrame:
+    """Aggregates -> load_mt5_csv-style bars"""
+    count = bars['TickVolume']
+    avg_spread = bars['SpreadSum'] / count / point
+    return pd.DataFrame({
+        'Date': bars['Date'].astype('datetime64[ns]'),
+        'Open': bars['Open'],
+        'High': bars['High'],
+        'Low': bars['Low'],
+        'Close': bars['Close'],
+        'TickVolume': count.astype(np.int64),
+        'Volume': bars['Volume'],
+        'Spread': np.rint(avg_spread).astype(np.int64),
+        'SpreadAvg': avg_spread,
+        'SpreadMax': np.rint(bars['SpreadMax'] / point).astype(np.int64)
+    })
+
+
+def iter_tick_bars(filepath: str,
+                   bar_type: str = 'time',
+                   timeframe: str = 'M1',
+                   size: float = 1000,
+                   point: float = 0.01,
+                   chunk_bytes: int = 64 * 1024**2) -> Iterator[pd.DataFrame]:
+    """
+    Stream bars from an MT5 tick export.
+
+    Args:
+        filepath: Tab-separated MT5 tick export
+        bar_type: 'time', 'tick' or 'volume'
+        timeframe: Bar timeframe for bar_type='time'
+        size: Ticks per bar ('tick') or volume per bar ('volume')
+        point: Price point size; spreads are reported in points
+        chunk_bytes: Bytes of the file parsed per step
+
+    Yields:
+        DataFrames of completed bars (the last bar comes with the final
+        chunk); ticks must be in time order, as MT5 writes them
+    """
+    if bar_type not in BAR_TYPES:
+        raise ValueError(f"Unknown bar_type: {bar_type}. Use one of {BAR_TYPES}")
+    period = TIMEFRAME_MINUTES[timeframe] * _NS_PER_MINUTE if bar_type == 'time' else None
+
+    carry = None
+    last_bid = last_ask = np.nan
+    ticks_seen = 0
+    volume_seen = 0.0
+
+    for block in _iter_tick_blocks(filepath, chunk_bytes):
+        bid = _ffill(block['bid'], last_bid)
+        ask = _ffill(block['ask'], last_ask)
+        last_bid, last_ask = bid[-1], ask[-1]
+        stamps, volume = block['stamps'], block['volume']
+        # Ticks before both a bid and an ask are known carry no spread
+        quoted = ~(np.isnan(bid) | np.isnan(ask))
+        if not quoted.all():
+            stamps, bid, ask, volume = stamps[quoted], bid[quoted], ask[quoted], volume[quoted]
+        if len(stamps) == 0:
+            continue
+
+        if bar_type == 'time':
+            keys = stamps // period
+        elif bar_type == 'tick':
+            keys = (ticks_seen + np.arange(len(stamps), dtype=np.int64)) // int(size)
+        else:
+            # Bars split where cumulative volume crosses a multiple of
+            # `size`; the crossing tick closes its bar
+            before = volume_seen + np.cumsum(volume) - volume
+            keys = (before // size).astype(np.int64)
+            volume_seen = before[-1] + volume[-1]
+        ticks_seen += len(stamps)
+        if np.any(keys[1:] < keys[:-1]):
+            raise ValueError(f"Ticks out of time order in {filepath}")
+
+        bars = _aggregate(stamps, bid, ask - bid, volume, keys, period)
+        if carry is not None:
+            bars = _merge_open_bar(carry, bars)
+        carry = {col: values[-1:] for col, values in bars.items()}
+        if len(bars['key']) > 1:
+            yield _to_frame({col: values[:-1] for col, values in bars.items()}, point)
+
+    if bar_type == 'volume' and volume_seen == 0:
+        raise ValueError(f"No real volume in {filepath}; use bar_type='tick'")
+    if carry is not None:
+        yield _to_frame(carry, point)
+
+
+def load_mt5_ticks(filepath: str,
+                   bar_type: str = 'time',
+                   timeframe: str = 'M1',
+                   size: float = 1000,
+                   point: float = 0.01,
+                   chunk_bytes: int = 64 * 1024**2) -> pd.DataFrame:
+    """Aggregate a whole tick export into one bars DataFrame (see iter_tick_bars)"""
+    label = timeframe if bar_type == 'time' else f"{size:g} {bar_type}"
+    print(f"Aggregating ticks into {label} bars...")
+    start = time.perf_counter()
+    parts = list(iter_tick_bars(filepath, bar_type, timeframe, size, point, chunk_bytes))
+    bars = pd.concat(parts, ignore_index=True) if parts else _to_frame(
+        {col: np.empty(0, dtype=np.int64 if col in ('Date', 'TickVolume') else np.float64)
+         for col in _AGG_COLUMNS}, point)
+    elapsed = time.perf_counter() - start
+    ticks = int(bars['TickVolume'].sum())
+    print(f"  {ticks:,} ticks -> {len(bars):,} bars in {elapsed:.1f}s "
+          f"({ticks / max(elapsed, 1e-9) / 1e6:.1f}M ticks/s)")
+    return bars
+
+
+if __name__ == "__main__":
+    from src.data_pipeline import clean_data, create_time_features
+    from src.features import prepare_features
+
+    tick_path = Path(__file__).parent.parent / "XAUUSD_ticks.csv"
+
+    if tick_path.exists():
+        bars = load_mt5_ticks(str(tick_path), 'time', 'H1')
+        df = prepare_features(create_time_features(clean_data(bars)))
+        print(df[['Date', 'Close', 'TickVolume', 'Spread', 'SpreadMax', 'Regime']].tail())
+        load_mt5_ticks(str(tick_path), 'tick', size=2000)
+    else:
+        print(f"Tick export not found: {tick_path}")
@@ -0,0 +1,256 @@
+"""
+Pipeline Tracing
+================
+Spans around pipeline stages with wall time and sampled peak memory,
+written as a trace file plus a per-stage summary table.
+
+    from src import tracing
+    tracing.enable('runs/train.trace.json')    # Chrome trace (chrome://tracing, Perfetto)
+    ...run the pipeline...
+    tracing.disable()                          # writes the file, prints the summary
+
+or, without code changes, set EATRADING_TRACE=<path> (.json = Chrome
+trace, .jsonl = one JSON record per span); the trace is written at exit.
+Worker processes inherit the variable, so put {pid} in the path for
+multi-process runs (batch_pipeline, walk_forward).
+
+Stage functions are wrapped with @traced('<stage>') and inner steps with
+`with span('<stage>'):`. While tracing is disabled both cost one global
+lookup per call. When enabled, a sampler thread reads the process RSS
+every `interval` seconds and raises the peak of every open span, so a
+span's peak_rss_mb includes the memory its children touched.
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# Environment variable that enables tracing at import time
+TRACE_ENV = 'EATRADING_TRACE'
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_tracer: Optional['Tracer'] = None
+_NULL_SPAN = nullcontext()
+
+
+def _rss_bytes() -> int:
+    """
+    Current resident set size (falls back to the peak off Linux, and to
+    0 where neither /proc nor the resource module exists, e.g. Windows)
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Tracer:
+    """Collects finished spans and samples RSS for the open ones"""
+
+    def __init__(self, path: Optional[str] = None, sample_memory: bool = True,
+                 interval: float = 0.005):
+        self.path = path
+        self.origin = time.perf_counter()
+        self.records: List[Dict] = []
+        self.samples: List[tuple] = []
+        self._open: List[Dict] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        # No sampler where RSS cannot be read (_rss_bytes() == 0)
+        if sample_memory and _rss_bytes():
+            self._sampler = threading.Thread(target=self._sample, args=(interval,),
+                                             name='trace-rss-sampler', daemon=True)
+            self._sampler.start()
+
+    def _sample(self, interval: float):
+        while not self._stop.wait(interval):
+            rss = _rss_bytes()
+            with self._lock:
+                self.samples.append((time.perf_counter() - self.origin, rss))
+                for record in self._open:
+                    if rss > record['_peak']:
+                        record['_peak'] = rss
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        rss = _rss_bytes()
+        record = {'name': name, 'parent': stack[-1]['name'] if stack else None,
+                  'depth': len(stack), 'tid': threading.get_ident(),
+                  'args': attrs, '_rss': rss, '_peak': rss}
+        stack.append(record)
+        with self._lock:
+            self._open.append(record)
+        start = time.perf_counter()
+        try:
+            yield record['args']
+        finally:
+            end = time.perf_counter()
+            rss_end = _rss_bytes()
+            stack.pop()
+            with self._lock:
+                self._open.remove(record)
+                # Propagate to the parent, which may have opened before a sample
+                peak = max(record.pop('_peak'), rss_end)
+                if stack and peak > stack[-1]['_peak']:
+                    stack[-1]['_peak'] = peak
+                rss_start = record.pop('_rss')
+                record.update({
+                    'start': start - self.origin,
+                    'seconds': end - start,
+                    'rss_start_mb': rss_start / 1024**2,
+                    'rss_end_mb': rss_end / 1024**2,
+                    'peak_rss_mb': peak / 1024**2
+                })
+                self.records.append(record)
+
+    def close(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    # ------------------------------------------------------------------
+    # Output
+    # ------------------------------------------------------------------
+
+    def write(self, path: Optional[str] = None) -> Optional[str]:
+        """Chrome trace for a .json path, JSON lines otherwise"""
+        path = path or self.path
+        if not path:
+            return None
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        records = sorted(self.records, key=lambda r: r['start'])
+        if str(path).endswith('.jsonl'):
+            with open(path, 'w') as f:
+                for r in records:
+                    f.write(json.dumps(r, default=str) + '\n')
+            return str(path)
+
+        pid = os.getpid()
+        events = [{
+            'name': r['name'], 'ph': 'X', 'pid': pid, 'tid': r['tid'],
+            'ts': r['start'] * 1e6, 'dur': r['seconds'] * 1e6,
+            'args': {**r['args'], 'peak_rss_mb': round(r['peak_rss_mb'], 1),
+                     'rss_delta_mb': round(r['rss_end_mb'] - r['rss_start_mb'], 1)}
+        } for r in records]
+        events += [{'name': 'RSS', 'ph': 'C', 'pid': pid, 'ts': t * 1e6,
+                    'args': {'MB': round(rss / 1024**2, 1)}} for t, rss in self.samples]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+        return str(path)
+
+    def summary(self) -> List[Dict]:
+        """Per-stage totals in order of first appearance"""
+        stages: Dict[str, Dict] = {}
+        for r in self.records:
+            s = stages.setdefault(r['name'], {'stage': r['name'], 'calls': 0, 'seconds': 0.0,
+                                               'max_seconds': 0.0, 'peak_rss_mb': 0.0,
+                                               'depth': r['depth'], 'first': r['start']})
+            s['calls'] += 1
+            s['seconds'] += r['seconds']
+            s['max_seconds'] = max(s['max_seconds'], r['seconds'])
+            s['peak_rss_mb'] = max(s['peak_rss_mb'], r['peak_rss_mb'])
+            s['depth'] = min(s['depth'], r['depth'])
+            s['first'] = min(s['first'], r['start'])
+        wall = sum(r['seconds'] for r in self.records if r['depth'] == 0) or 1.0
+        for s in stages.values():
+            s['share'] = s['seconds'] / wall
+        return sorted(stages.values(), key=lambda s: s['first'])
+
+    def print_summary(self):
+        rows = self.summary()
+        print("Trace summary:")
+        print(f"  {'stage':<28} {'calls':>6} {'total s':>9} {'max s':>8} {'share':>6} {'peak MB':>8}")
+        for s in rows:
+            name = '  ' * s['depth'] + s['stage']
+            print(f"  {name:<28} {s['calls']:6d} {s['seconds']:9.3f} {s['max_seconds']:8.3f} "
+                  f"{s['share']:6.1%} {s['peak_rss_mb']:8.1f}")
+
+
+def enable(path: Optional[str] = None, sample_memory: bool = True,
+           interval: float = 0.005) -> Tracer:
+    """
+    Start recording spans.
+
+    Args:
+        path: Trace file written by disable() (.json = Chrome trace,
+            .jsonl = JSON lines); None keeps the spans in memory only
+        sample_memory: Run the RSS sampler thread
+        interval: Seconds between RSS samples
+    """
+    global _tracer
+    if _tracer is not None:
+        disable(report=False)
+    _tracer = Tracer(path, sample_memory, interval)
+    return _tracer
+
+
+def disable(report: bool = True) -> Optional[Tracer]:
+    """Stop recording, write the trace file and print the summary"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return None
+    tracer.close()
+    written = tracer.write()
+    if report:
+        tracer.print_summary()
+        if written:
+            print(f"Trace saved: {written}")
+    return tracer
+
+
+def is_enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, **attrs):
+    """Context manager timing a block (a shared no-op while disabled)"""
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, **attrs)
+
+
+def traced(name: str):
+    """
+    Decorator: run the function inside span(name). The row count of a
+    leading DataFrame/array argument is recorded as 'rows'.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return fn(*args, **kwargs)
+            attrs = {}
+            for arg in args[:2]:
+                if hasattr(arg, 'shape'):
+                    attrs['rows'] = int(arg.shape[0])
+                    break
+            with tracer.span(name, **attrs):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV].replace('{pid}', str(os.getpid())))
+    atexit.register(disable)
@@ -0,0 +1,216 @@
+"""
+Walk-Forward Evaluation
+=======================
+Parallel walk-forward / expanding-window training and evaluation of
+RegimeDetector.
+
+Folds are chronological. Each training window ends `embargo` bars before
+its test window starts, so labels computed with lookforward_bars of
+future data never overlap the test period. The feature matrix and labels
+are placed in shared memory once; worker processes attach to them
+instead of receiving a pickled copy per fold.
+"""
+
+import contextlib
+import io
+import os
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+
+# Per-process views onto the shared arrays (set by _attach_shared)
+_SHARED = {}
+
+
+def walk_forward_splits(n_samples: int,
+                        n_folds: int = 5,
+                        embargo: int = 10,
+                        min_train_ratio: float = 0.3,
+                        expanding: bool = True) -> List[Tuple[int, int, int, int]]:
+    """
+    Chronological fold boundaries.
+
+    The first min_train_ratio of the data is only ever used for training;
+    the rest is cut into n_folds consecutive test windows.
+
+    Args:
+        n_samples: Number of rows
+        n_folds: Number of test windows
+        embargo: Bars dropped between train end and test start
+        min_train_ratio: Share of data before the first test window
+        expanding: Expanding train window (False = rolling, fixed length)
+
+    Returns:
+        List of (train_start, train_end, test_start, test_end), end-exclusive
+    """
+    first_test = int(n_samples * min_train_ratio)
+    test_len = (n_samples - first_test) // n_folds
+    if test_len <= 0 or first_test <= embargo:
+        raise ValueError("Not enough samples for the requested folds")
+
+    splits = []
+    for k in range(n_folds):
+        test_start = first_test + k * test_len
+        test_end = n_samples if k == n_folds - 1 else test_start + test_len
+        train_end = test_start - embargo
+        train_start = 0 if expanding else max(0, train_end - (first_test - embargo))
+        splits.append((train_start, train_end, test_start, test_end))
+    return splits
+
+
+def _share_array(arr: np.ndarray) -> Tuple[shared_memory.SharedMemory, Dict]:
+    """Copy arr into a new shared memory block"""
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, {'name': shm.name, 'shape': arr.shape, 'dtype': arr.dtype.str}
+
+
+def _attach_shared(specs: Dict[str, Dict]):
+    """Pool initializer: map the shared blocks into this process"""
+    for key, spec in specs.items():
+        shm = shared_memory.SharedMemory(name=spec['name'])
+        _SHARED[key + '_shm'] = shm  # keep the mapping alive
+        _SHARED[key] = np.ndarray(spec['shape'], dtype=np.dtype(spec['dtype']), buffer=shm.buf)
+
+
+def _run_fold(task: Tuple[int, Tuple[int, int, int, int], List[str], int]) -> Dict:
+    """Fit and evaluate one fold on the shared arrays"""
+    from src.regime_detector import RegimeDetector
+    from sklearn.metrics import accuracy_score, f1_score
+
+    fold, (train_start, train_end, test_start, test_end), feature_columns, n_jobs = task
+    X, y = _SHARED['X'], _SHARED['y']
+
+    detector = RegimeDetector(feature_columns, n_jobs=n_jobs)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fit_results = detector.fit(X[train_start:train_end], y[train_start:train_end])
+    fit_seconds = time.perf_counter() - start
+
+    y_test = y[test_start:test_end]
+    y_pred = detector.predict(X[test_start:test_end])
+
+    return {
+        'fold': fold,
+        'train_start': train_start,
+        'train_end': train_end,
+        'test_start': test_start,
+        'test_end': test_end,
+        'train_samples': train_end - train_start,
+        'test_samples': test_end - test_start,
+        'train_accuracy': fit_results['train_accuracy'],
+        'test_accuracy': accuracy_score(y_test, y_pred),
+        'test_f1_macro': f1_score(y_test, y_pred, average='macro', labels=[0, 1, 2],
+                                  zero_division=0),
+        'fit_seconds': fit_seconds,
+        **{f'test_share_{k}': float(np.mean(y_test == k)) for k in (0, 1, 2)}
+    }
+
+
+def run_walk_forward(df: pd.DataFrame,
+                     feature_columns: List[str],
+                     n_folds: int = 5,
+                     embargo: int = 10,
+                     min_train_ratio: float = 0.3,
+                     expanding: bool = True,
+                     n_workers: Optional[int] = None) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Walk-forward evaluation of RegimeDetector across a process pool.
+
+    Args:
+        df: Output of prepare_features() (must contain 'Regime')
+        feature_columns: Model input columns
+        n_folds: Number of test windows
+        embargo: Gap in bars between train and test (use lookforward_bars)
+        min_train_ratio: Share of data before the first test window
+        expanding: Expanding (True) or rolling (False) train window
+        n_workers: Worker processes (default: one per CPU, capped at n_folds)
+
+    Returns:
+        (per-fold metrics DataFrame, aggregated metrics dict)
+    """
+    splits = walk_forward_splits(len(df), n_folds, embargo, min_train_ratio, expanding)
+    n_workers = min(n_workers or os.cpu_count() or 1, n_folds)
+    # Forest threads share the cores with the other folds
+    n_jobs = max(1, (os.cpu_count() or 1) // n_workers)
+
+    print(f"Walk-forward: {n_folds} folds, embargo {embargo} bars, {n_workers} workers")
+
+    X = df[feature_columns].to_numpy(dtype=np.float64)
+    y = df['Regime'].to_numpy(dtype=np.int64)
+
+    blocks = []
+    specs = {}
+    try:
+        for key, arr in (('X', X), ('y', y)):
+            shm, spec = _share_array(arr)
+            blocks.append(shm)
+            specs[key] = spec
+        del X, y
+
+        tasks = [(k, split, list(feature_columns), n_jobs) for k, split in enumerate(splits)]
+        start = time.perf_counter()
+        if n_workers == 1:
+            _attach_shared(specs)
+            results = [_run_fold(task) for task in tasks]
+            for key in specs:
+                _SHARED.pop(key)
+                _SHARED.pop(key + '_shm').close()
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_attach_shared,
+                                     initargs=(specs,)) as pool:
+                results = list(pool.map(_run_fold, tasks))
+        elapsed = time.perf_counter() - start
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    folds = pd.DataFrame(results).sort_values('fold').reset_index(drop=True)
+    summary = {
+        'n_folds': n_folds,
+        'embargo': embargo,
+        'wall_seconds': elapsed,
+        'test_accuracy_mean': folds['test_accuracy'].mean(),
+        'test_accuracy_std': folds['test_accuracy'].std(),
+        'test_accuracy_min': folds['test_accuracy'].min(),
+        'test_f1_macro_mean': folds['test_f1_macro'].mean(),
+        'fit_seconds_total': folds['fit_seconds'].sum()
+    }
+
+    for _, row in folds.iterrows():
+        print(f"  Fold {int(row['fold']):2d}: train {int(row['train_samples']):7,}  "
+              f"test {int(row['test_samples']):6,}  acc {row['test_accuracy']:.2%}  "
+              f"f1 {row['test_f1_macro']:.3f}")
+    print(f"  Accuracy: {summary['test_accuracy_mean']:.2%} "
+          f"± {summary['test_accuracy_std']:.2%} (min {summary['test_accuracy_min']:.2%})")
+    print(f"  Wall time: {elapsed:.1f}s (sum of fits {summary['fit_seconds_total']:.1f}s)")
+
+    return folds, summary
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+    import sys
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+    from src.data_pipeline import load_mt5_csv, clean_data, create_time_features
+    from src.features import prepare_features, get_feature_columns
+
+    csv_path = Path(__file__).parent.parent / "XAUUSD_H1_201501020900_202512221100.csv"
+
+    if csv_path.exists():
+        df = load_mt5_csv(str(csv_path), use_cache=True)
+        df = clean_data(df)
+        df = create_time_features(df)
+        df = prepare_features(df)
+
+        feature_cols = [c for c in get_feature_columns() if c in df.columns]
+        run_walk_forward(df, feature_cols, n_folds=10, embargo=10)
+    else:
+        print(f"CSV not found: {csv_path}")